@@ -0,0 +1,183 @@
+#   Name:           EdgeStore
+#   Description:    Array-backed storage for the edges of a stream network,
+#                   used as a compact alternative to a NetworkX graph.
+#   Created:        10/17/2026
+
+import numpy as np
+import networkx as nx
+from graph_tools import component_labels
+
+# global variables
+fid = "_FID_"
+calclen = "_calclen_"
+
+
+class EdgeStore(object):
+
+    def __init__(self, fields):
+        """
+        Columnar storage for network edges. Edge end points are stored as node ids
+        (indexes into the node coordinate array), attributes as typed NumPy columns,
+        and line geometries as WKB in a single buffer with per-edge offsets.
+        :param fields: list of attribute field names
+        """
+        self.fields = list(fields)
+        self.node_ids = {}
+        self.node_xy = None
+        self.from_node = None
+        self.to_node = None
+        self.fid = None
+        self.length = None
+        self.columns = {}
+        self.wkb = None
+        self.wkb_offsets = None
+
+        # row buffers, converted to arrays by finalize()
+        self._rows = {"from": [], "to": [], "fid": [], "length": [], "wkb": []}
+        self._values = dict((f, []) for f in self.fields)
+
+    def __len__(self):
+        if self.fid is None:
+            return len(self._rows["fid"])
+        return len(self.fid)
+
+    def _node_id(self, pt):
+        node = self.node_ids.get(pt)
+        if node is None:
+            node = self.node_ids[pt] = len(self.node_ids)
+        return node
+
+    def add_edge(self, from_pt, to_pt, edge_fid, length, values, wkb=None):
+        """
+        Appends an edge to the store.
+        :param from_pt: (x, y) coordinates of the upstream node
+        :param to_pt: (x, y) coordinates of the downstream node
+        :param edge_fid: feature ID of the source feature
+        :param length: length of the edge
+        :param values: attribute values, in the same order as the store fields
+        :param wkb: edge geometry as WKB (optional)
+        """
+        rows = self._rows
+        rows["from"].append(self._node_id(from_pt))
+        rows["to"].append(self._node_id(to_pt))
+        rows["fid"].append(edge_fid)
+        rows["length"].append(length)
+        if wkb is not None:
+            rows["wkb"].append(wkb)
+        for f, val in zip(self.fields, values):
+            self._values[f].append(val)
+
+    def finalize(self):
+        """Converts the appended rows into arrays."""
+        rows = self._rows
+        self.from_node = np.array(rows["from"], dtype=np.int32)
+        self.to_node = np.array(rows["to"], dtype=np.int32)
+        self.fid = np.array(rows["fid"], dtype=np.int64)
+        self.length = np.array(rows["length"], dtype=np.float64)
+
+        self.node_xy = np.zeros((len(self.node_ids), 2), dtype=np.float64)
+        for pt, node in self.node_ids.items():
+            self.node_xy[node] = pt[:2]
+
+        if rows["wkb"]:
+            sizes = np.array([len(g) for g in rows["wkb"]], dtype=np.int64)
+            self.wkb_offsets = np.concatenate(([0], np.cumsum(sizes)))
+            self.wkb = np.frombuffer(b"".join(rows["wkb"]), dtype=np.uint8)
+
+        for f in self.fields:
+            self.columns[f] = self._to_column(self._values[f])
+        # node ids are only needed while edges are being added
+        self.node_ids = None
+        self._rows = None
+        self._values = None
+        return
+
+    @staticmethod
+    def _to_column(values):
+        """Converts a list of values to a typed column, falling back to an object
+        column for text and null values"""
+        if any(val is None for val in values):
+            return np.array(values, dtype=object)
+        if all(isinstance(val, (int, long)) and not isinstance(val, bool) for val in values):
+            return np.array(values, dtype=np.int64)
+        if all(isinstance(val, float) for val in values):
+            return np.array(values, dtype=np.float64)
+        return np.array(values, dtype=object)
+
+    @staticmethod
+    def _to_values(column):
+        """Converts a column to a list of Python values. Integers are converted with int(), as
+        tolist() returns long values for int64 columns where the C long is 32 bit (i.e.
+        Python 2 on Windows), which are not written as integer fields."""
+        if column.dtype.kind in "iu":
+            return [int(val) for val in column.tolist()]
+        return column.tolist()
+
+    def set_column(self, name, values):
+        """Adds or replaces an attribute column"""
+        if name not in self.columns:
+            self.fields.append(name)
+        if isinstance(values, np.ndarray):
+            self.columns[name] = values
+        else:
+            self.columns[name] = self._to_column(list(values))
+
+    def edge_components(self):
+        """Returns the subnetwork (weakly connected component) number of each edge"""
+        return component_labels(len(self.node_xy), self.from_node.tolist(), self.to_node.tolist())
+
+    def node(self, node_id):
+        """Returns the coordinates of a node as a tuple"""
+        return tuple(self.node_xy[node_id].tolist())
+
+    def has_geometry(self):
+        return self.wkb is not None
+
+    def geometry(self, i):
+        """Returns the WKB geometry of an edge"""
+        return self.wkb[self.wkb_offsets[i]:self.wkb_offsets[i + 1]].tobytes()
+
+    def edge_attributes(self, i):
+        """Returns the attributes of a single edge as a dictionary"""
+        attrs = dict((f, self.columns[f][i]) for f in self.fields)
+        for f, val in attrs.items():
+            if isinstance(val, np.integer):
+                attrs[f] = int(val)
+            elif isinstance(val, np.generic):
+                attrs[f] = val.item()
+        attrs[fid] = int(self.fid[i])
+        attrs[calclen] = float(self.length[i])
+        if self.has_geometry():
+            attrs["Wkb"] = self.geometry(i)
+        return attrs
+
+    def edges_iter(self):
+        """Iterates over the edges as (from node, to node, attribute dictionary), building the
+        attributes of one edge at a time"""
+        for i in xrange(len(self)):
+            yield self.node(self.from_node[i]), self.node(self.to_node[i]), self.edge_attributes(i)
+
+    def to_networkx(self, edges=None):
+        """
+        Builds a NetworkX graph from the store.
+        :param edges: indexes of the edges to include. All edges are included if None.
+        :return: MultiDiGraph keyed by feature ID
+        """
+        if edges is None:
+            edges = np.arange(len(self))
+        edges = np.asarray(edges, dtype=np.int64)
+        G = nx.MultiDiGraph()
+        nodes = [tuple(pt) for pt in self.node_xy.tolist()]
+        columns = [(f, self._to_values(self.columns[f][edges])) for f in self.fields]
+        from_node = self.from_node[edges].tolist()
+        to_node = self.to_node[edges].tolist()
+        edge_fid = self._to_values(self.fid[edges])
+        length = self.length[edges].tolist()
+        for j, i in enumerate(edges.tolist()):
+            attrs = dict((f, values[j]) for f, values in columns)
+            attrs[fid] = edge_fid[j]
+            attrs[calclen] = length[j]
+            if self.has_geometry():
+                attrs["Wkb"] = self.geometry(i)
+            G.add_edge(nodes[from_node[j]], nodes[to_node[j]], key=edge_fid[j], attr_dict=attrs)
+        return G
@@ -17,7 +17,9 @@
 
 # # Import Modules # #
 import arcpy
+import os
 import sys
+import math
 
 scratchWorkspace = arcpy.env.scratchWorkspace
 
@@ -135,6 +137,121 @@ def checkReq(input_dataset):
         sys.exit(0)
 
 
+def network_nodes(in_lines, out_nodes, tolerance=0.001, min_degree=3):
+    """Writes the nodes of a polyline network to a point feature class, from the end points
+    of each line part, read in a single pass. End points within the tolerance distance are
+    binned on a quantized grid as one node. Output fields are POINT_X, POINT_Y, Degree (number
+    of line ends), InCount (lines ending at the node) and OutCount (lines starting at the node).
+    min_degree = 3 returns confluence and divergence nodes, 1 returns all nodes.
+    """
+    index = EndpointIndex(tolerance)
+    list_nodes = [] # [x, y, in count, out count]
+
+    def add_end(pnt, count_idx):
+        pt = (pnt.X, pnt.Y)
+        near = index.near(pt)
+        if near:
+            node = list_nodes[near[0]]
+        else:
+            index.add(pt, len(list_nodes))
+            node = [pnt.X, pnt.Y, 0, 0]
+            list_nodes.append(node)
+        node[count_idx] += 1
+
+    with arcpy.da.SearchCursor(in_lines, ["SHAPE@"]) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            for i in range(row[0].partCount):
+                part = row[0].getPart(i)
+                if part.count < 2:
+                    continue
+                add_end(part.getObject(0), 3)
+                add_end(part.getObject(part.count - 1), 2)
+
+    resetData(out_nodes)
+    arcpy.CreateFeatureclass_management(os.path.dirname(out_nodes), os.path.basename(out_nodes), "POINT",
+                                        spatial_reference=arcpy.Describe(in_lines).spatialReference)
+    arcpy.AddField_management(out_nodes, "POINT_X", "DOUBLE")
+    arcpy.AddField_management(out_nodes, "POINT_Y", "DOUBLE")
+    arcpy.AddField_management(out_nodes, "Degree", "LONG")
+    arcpy.AddField_management(out_nodes, "InCount", "LONG")
+    arcpy.AddField_management(out_nodes, "OutCount", "LONG")
+    with arcpy.da.InsertCursor(out_nodes, ["SHAPE@XY", "POINT_X", "POINT_Y", "Degree", "InCount", "OutCount"]) as cursor:
+        for x, y, count_in, count_out in list_nodes:
+            if count_in + count_out >= min_degree:
+                cursor.insertRow(((x, y), x, y, count_in + count_out, count_in, count_out))
+    return out_nodes
+
+
+class EndpointIndex(object):
+    """ Hash of point coordinates quantized to a grid, used to find line end points
+    that are within a tolerance distance of each other without spatial queries. """
+
+    def __init__(self, tolerance=0.001):
+        self.tolerance = tolerance
+        self.cells = {}
+
+    def cell(self, pt):
+        return (int(math.floor(pt[0] / self.tolerance)), int(math.floor(pt[1] / self.tolerance)))
+
+    def add(self, pt, value):
+        self.cells.setdefault(self.cell(pt), []).append((pt, value))
+        return
+
+    def near(self, pt):
+        """ returns the values of all points within the tolerance distance of pt """
+        cx, cy = self.cell(pt)
+        tol_sq = self.tolerance ** 2
+        values = []
+        # points within the tolerance can fall in any of the neighbouring cells
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other, value in self.cells.get((cx + dx, cy + dy), ()):
+                    if (other[0] - pt[0]) ** 2 + (other[1] - pt[1]) ** 2 <= tol_sq:
+                        values.append(value)
+        return values
+
+
+class BoundingBoxIndex(object):
+    """ Grid of feature bounding boxes, used to find pairs of features with intersecting
+    extents without spatial queries. """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.extents = {}
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def add(self, extent, value):
+        """ extent is (xmin, ymin, xmax, ymax). The feature is added to every cell it covers. """
+        self.extents[value] = extent
+        cx_min, cy_min = self.cell(extent[0], extent[1])
+        cx_max, cy_max = self.cell(extent[2], extent[3])
+        for cx in range(cx_min, cx_max + 1):
+            for cy in range(cy_min, cy_max + 1):
+                self.cells.setdefault((cx, cy), []).append(value)
+        return
+
+    def pairs(self):
+        """ yields each pair of values with intersecting bounding boxes, once """
+        extents = self.extents
+        for key, values in self.cells.items():
+            for i in range(len(values)):
+                ext_a = extents[values[i]]
+                for j in range(i + 1, len(values)):
+                    ext_b = extents[values[j]]
+                    if ext_a[0] > ext_b[2] or ext_b[0] > ext_a[2] or ext_a[1] > ext_b[3] or ext_b[1] > ext_a[3]:
+                        continue
+                    # a pair shares several cells, so it is only reported from the cell holding the
+                    # lower left corner of the intersection of the two extents
+                    if self.cell(max(ext_a[0], ext_b[0]), max(ext_a[1], ext_b[1])) == key:
+                        yield values[i], values[j]
+        return
+
+
 ### Experimental ###
 class WorkspaceManager(object):
     """ object to manage files while geoprocessing """
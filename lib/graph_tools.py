@@ -0,0 +1,90 @@
+#   Name:           Graph Tools
+#   Description:    Graph algorithms on edge lists of node ids, shared by the
+#                   network classes and the stream network tools.
+#   Created:        10/17/2026
+
+
+def component_labels(node_count, from_nodes, to_nodes):
+    """
+    Labels the weakly connected components of a graph with a union-find over the edge
+    end points, in a single pass over the edges.
+    :param node_count: number of nodes (node ids are 0 to node_count - 1)
+    :param from_nodes: list of the start node id of each edge
+    :param to_nodes: list of the end node id of each edge
+    :return: list with a component number for each edge, numbered from 0 in order of
+        the first edge of each component
+    """
+    parent = list(range(node_count))
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        # path compression
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for u, v in zip(from_nodes, to_nodes):
+        root_u, root_v = find(u), find(v)
+        if root_u != root_v:
+            parent[root_u] = root_v
+
+    numbers = {}
+    labels = []
+    for u in from_nodes:
+        root = find(u)
+        if root not in numbers:
+            numbers[root] = len(numbers)
+        labels.append(numbers[root])
+    return labels
+
+
+def find_bridges(node_count, from_nodes, to_nodes):
+    """
+    Finds the bridges of the undirected multigraph of the edges (edges that are not part of
+    any cycle), with an iterative depth-first search that tracks the earliest node reachable
+    from each subtree. Parallel edges form a cycle, so they are never bridges, and self-loops
+    are cycles on their own.
+    :param node_count: number of nodes (node ids are 0 to node_count - 1)
+    :param from_nodes: list of the start node id of each edge
+    :param to_nodes: list of the end node id of each edge
+    :return: set of the indexes of the bridge edges
+    """
+    adj = [[] for i in range(node_count)]
+    for edge, (u, v) in enumerate(zip(from_nodes, to_nodes)):
+        if u != v:
+            adj[u].append((v, edge))
+            adj[v].append((u, edge))
+
+    bridges = set()
+    disc = [-1] * node_count
+    low = [0] * node_count
+    count = 0
+    for root in range(node_count):
+        if disc[root] != -1:
+            continue
+        disc[root] = low[root] = count
+        count += 1
+        stack = [(root, -1, -1, iter(adj[root]))]
+        while stack:
+            node, parent, parent_edge, nbrs = stack[-1]
+            for nbr, edge in nbrs:
+                # only the edge used to reach the node is skipped, so a parallel edge
+                # back to the parent closes a cycle
+                if edge == parent_edge:
+                    continue
+                if disc[nbr] != -1:
+                    low[node] = min(low[node], disc[nbr])
+                else:
+                    disc[nbr] = low[nbr] = count
+                    count += 1
+                    stack.append((nbr, node, edge, iter(adj[nbr])))
+                    break
+            else:
+                stack.pop()
+                if parent != -1:
+                    low[parent] = min(low[parent], low[node])
+                    if low[node] > disc[parent]:
+                        bridges.add(parent_edge)
+    return bridges
@@ -7,10 +7,19 @@
 #   Revised:        12/11/2017
 
 import os
+import re
 import sys
+import heapq
+import struct
+import weakref
+from collections import deque
+import numpy as np
 import ogr
 import osr
 import networkx as nx
+from edge_store import EdgeStore
+from graph_tools import component_labels, find_bridges
+import network_cache
 
 sys.setrecursionlimit(10000)
 
@@ -21,70 +30,191 @@ nodetype = "_nodetype_"
 netid = "_netid_"
 calclen = "_calclen_"
 riverkm = "_riverkm_"
+riverkm_from = "_rkm_from_"
+riverkm_to = "_rkm_to_"
 streamorder = "_strmordr_"
+streammag = "_strmmag_"
 errorflow = "_err_flow_"
 errordup = "_err_dupe_"
 errorout = "_err_out_"
 errorconf = "_err_conf_"
+braidid = "_braidid_"
 
-class Network:
+# output formats supported by _nx_to_shp
+OGRDrivers = {".shp": "ESRI Shapefile", ".gpkg": "GPKG", ".fgb": "FlatGeobuf"}
+# number of features written per transaction
+write_batch = 10000
 
-    def __init__(self, in_shp, msgcallback=None):
+class Network(object):
+
+    def __init__(self, in_shp, msgcallback=None, backend="networkx", geometry="eager",
+                 fields=None, where=None, cache=False):
         """
         Main class for processing stream networks in GNAT.
+        :param in_shp: input stream network shapefile
+        :param backend: "networkx" stores every edge as a dictionary in a NetworkX graph.
+            "columnar" stores edges in an array-backed EdgeStore, and only builds the
+            NetworkX graph when self.G is first used.
+        :param geometry: "eager" keeps the line geometry of every edge in memory. "lazy" only
+            keeps the feature IDs, and geometry is re-read from in_shp when the network is
+            written. "none" keeps no geometry, and edges are written as straight lines.
+        :param fields: list of attribute fields to read. All fields are read if None.
+        :param where: OGR attribute filter (SQL where clause) applied to the input features
+        :param cache: if True, the parsed network is reloaded from (or saved to) the on-disk
+            network cache, keyed by the contents of in_shp and the options above.
         """
         self.id_field = fid
         self.features = {}
         self.cols = []
+        self._attrb_index = weakref.WeakKeyDictionary() # graph: {attribute name: index}
+        self._G = None
+        self.store = None
 
         # get spatial reference
         self.data_src = in_shp
+        self.req_fields = fields
+        self.where = where
+
+        if geometry not in ("eager", "lazy", "none"):
+            raise ValueError("Unknown geometry mode: {0}".format(geometry))
+        self.geometry = geometry
+        geom_attrs = geometry == "eager"
+
+        if backend not in ("networkx", "columnar"):
+            raise ValueError("Unknown network backend: {0}".format(backend))
+
+        if cache:
+            self._load_cached(geom_attrs)
+            if backend == "networkx":
+                self.G = self.store.to_networkx()
+                self.store = None
+        elif backend == "networkx":
+            # Convert shapefile to NX MultiDiGraph
+            self._shp_to_nx(geom_attrs=geom_attrs)
+        else:
+            self._shp_to_store(geom_attrs=geom_attrs)
 
-        # Convert shapefile to NX MultiDiGraph
-        self._shp_to_nx()
+    @property
+    def G(self):
+        """NetworkX graph of the network, built from the edge store on first use"""
+        if self._G is None and self.store is not None:
+            self._G = self.store.to_networkx()
+        return self._G
 
-    def _shp_to_nx(self, simplify=True, geom_attrs=True):
+    @G.setter
+    def G(self, graph):
+        self._G = graph
+
+    def _read_features(self):
         """
-        Re-purposed version of read_shp from nx
-        :param simplify:
-        :param geom_attrs:
-        :return:
+        Reads the features of the input shapefile
+        :return: generator of feature ID, geometry and list of field values
         """
-
-        self.G = nx.MultiDiGraph()
         shp = ogr.Open(self.data_src)
         layer = shp.GetLayer()
         self.srs = layer.GetSpatialRef().ExportToWkt()
 
         for lyr in shp:
-            self.fields = [x.GetName() for x in lyr.schema]
+            all_fields = [x.GetName() for x in lyr.schema]
+            if self.req_fields is None:
+                self.fields = all_fields
+            else:
+                self.fields = [x for x in all_fields if x in self.req_fields]
+                # skip reading the other fields from the source
+                lyr.SetIgnoredFields([x for x in all_fields if x not in self.fields])
+            if self.where:
+                lyr.SetAttributeFilter(self.where)
+            # resolve field indexes once per layer
+            field_idx = [lyr.GetLayerDefn().GetFieldIndex(x) for x in self.fields]
             for f in lyr:
                 geo = f.geometry()
-                flddata = [f.GetField(f.GetFieldIndex(x)) for x in self.fields]
-                attributes = dict(zip(self.fields, flddata))
-                # Add a new _FID_ field
-                fid = f.GetFID()
-                attributes[self.id_field] = fid
-                attributes[calclen] = geo.Length()
-
-                # Using layer level geometry type
+                flddata = [f.GetField(i) for i in field_idx]
                 geo_type = geo.GetGeometryType()
-                if geo_type == ogr.wkbLineString or geo_type == ogr.wkbMultiLineString:
-                    for edge in self.edges_from_line(geo, attributes, simplify, geom_attrs):
-                        e1, e2, attr = edge
-                        self.features[fid] = attr
-                        self.G.add_edge(tuple(e1), tuple(e2), key=attr[self.id_field], attr_dict=attr)
-                    self.cols = self.features[self.features.keys()[0]].keys()
-                else:
+                if geo_type != ogr.wkbLineString and geo_type != ogr.wkbMultiLineString:
                     raise ImportError("GeometryType not supported. For now we only support LineString types.")
+                yield f.GetFID(), geo, flddata
+
+    def _shp_to_nx(self, simplify=True, geom_attrs=True):
+        """
+        Re-purposed version of read_shp from nx
+        :param simplify:
+        :param geom_attrs:
+        :return:
+        """
+
+        self.G = nx.MultiDiGraph()
+        for fid, geo, flddata in self._read_features():
+            attributes = dict(zip(self.fields, flddata))
+            # Add a new _FID_ field
+            attributes[self.id_field] = fid
+            attributes[calclen] = geo.Length()
+
+            for edge in self.edges_from_line(geo, attributes, simplify, geom_attrs):
+                e1, e2, attr = edge
+                self.features[fid] = attr
+                self.G.add_edge(tuple(e1), tuple(e2), key=attr[self.id_field], attr_dict=attr)
+            self.cols = self.features[self.features.keys()[0]].keys()
+
+        return
+
+    def _shp_to_store(self, geom_attrs=True):
+        """
+        Reads the shapefile into an array-backed edge store. Each line part becomes one edge,
+        in the same way as _shp_to_nx with simplify=True.
+        :param geom_attrs: if True, line geometry is kept as WKB
+        """
+        store = None
+        for fid, geo, flddata in self._read_features():
+            if store is None:
+                store = EdgeStore(self.fields)
+            length = geo.Length()
+            for part in self.line_parts(geo):
+                last = part.GetPointCount() - 1
+                wkb = part.ExportToWkb() if geom_attrs else None
+                store.add_edge(part.GetPoint_2D(0), part.GetPoint_2D(last), fid, length, flddata, wkb)
+        if store is None:
+            store = EdgeStore(getattr(self, "fields", []))
+        store.finalize()
+        self.store = store
+        self.cols = store.fields + [self.id_field, calclen]
+        return
 
+    def _load_cached(self, geom_attrs=True):
+        """
+        Loads the edge store from the network cache, reading the shapefile (and adding
+        it to the cache) if it is not cached yet.
+        :param geom_attrs: if True, line geometry is kept as WKB
+        """
+        key = network_cache.cache_key(self.data_src, geometry=self.geometry,
+                                      fields=self.req_fields, where=self.where)
+        cached = network_cache.load(key)
+        if cached is not None:
+            self.store = cached["store"]
+            self.srs = cached["srs"]
+            self.fields = cached["fields"]
+            self.cols = self.store.fields + [self.id_field, calclen]
+        else:
+            self._shp_to_store(geom_attrs=geom_attrs)
+            network_cache.save(key, {"store": self.store, "srs": self.srs, "fields": self.fields})
         return
 
+    def line_parts(self, geom):
+        """Returns the LineString parts of a LineString or MultiLineString geometry"""
+        if geom.GetGeometryType() == ogr.wkbLineString:
+            yield geom
+        elif geom.GetGeometryType() == ogr.wkbMultiLineString:
+            for i in range(geom.GetGeometryCount()):
+                yield geom.GetGeometryRef(i)
+
     def _nx_to_shp(self, G, out_shp, bool_node):
         """
         This is a re-purposing of the NetworkX write_shp module with some minor changes.
-        :param G: networkx directional graph
-        :param out_dir: directory where output shapefiles will be written
+        The output schema is built once for each layer, and features are written in batched
+        transactions where the output format supports them.
+        :param G: networkx directional graph, or an EdgeStore (written without building a graph)
+        :param out_shp: output file (shapefile, GeoPackage or FlatGeobuf, based on the extension).
+            Nodes are written to a second layer with "_nodes" appended to the name.
+        :param bool_node: if True, nodes are also written
         """
 
         # easier to debug in python if ogr throws exceptions
@@ -94,11 +224,18 @@ class Network:
         srs = osr.SpatialReference()
         srs.ImportFromWkt(self.srs)
 
+        # source layer for re-reading geometry by FID. The data source is kept open (referenced)
+        # for as long as the layer is used.
+        src_shp = ogr.Open(self.data_src) if self.geometry == "lazy" else None
+        src_lyr = src_shp.GetLayer() if src_shp is not None else None
+
         def netgeometry(key, data):
             if 'Wkb' in data:
                 geom = ogr.CreateGeometryFromWkb(data['Wkb'])
             elif 'Wkt' in data:
                 geom = ogr.CreateGeometryFromWkt(data['Wkt'])
+            elif src_lyr is not None and self.id_field in data:
+                geom = self.source_geometry(src_lyr, data[self.id_field], key[0])
             elif type(key[0]).__name__ == 'tuple':  # edge keys are packed tuples
                 geom = ogr.Geometry(ogr.wkbLineString)
                 _from, _to = key[0], key[1]
@@ -122,107 +259,187 @@ class Network:
 
             return geom
 
-        # Create_feature with new optional attributes arg (should be dict type)
-        def create_feature(geometry, lyr, attributes=None):
-            feature = ogr.Feature(lyr.GetLayerDefn())
-            feature.SetGeometry(g)
-            if attributes != None:
-                # Loop through attributes, assigning data to each field
-                for field, data in attributes.items():
-                    feature.SetField(field, data)
-            lyr.CreateFeature(feature)
-            feature.Destroy()
-
-        def build_attrb_dict(self, lyr, data, fields):
-            from collections import OrderedDict
-            attributes = OrderedDict()
-            ordered_data = order_attributes(self, data)
-            # Loop through attribute data in edges dictionary
-            for key, data in ordered_data.items():
-                # Reject spatial data not required for attribute table
-                if (key != 'Json' and key != 'Wkt' and key != 'Wkb'
-                    and key != 'ShpName'):
-                    # For all edges check/add field and data type to fields dict
-                    # if key not in fields:
-                    if key not in fields:
-                        # Field not in previous edges so add to dict
-                        if type(data) in OGRTypes:
-                            fields[key] = OGRTypes[type(data)]
-                        else:
-                            # Data type not supported, default to string (char 80)
-                            fields[key] = ogr.OFTString
-                        newfield = ogr.FieldDefn(key, fields[key])
-                        lyr.CreateField(newfield)
-                        # Store the data from new field to dict for CreateLayer()
-                        attributes[key] = data
-                    else:
-                        # Field already exists, add data to dict for CreateLayer()
-                        attributes[key] = data
-            return attributes
-
-        def order_attributes(self, attrb_dict):
-            # order dictionary attributes into list based on field list from input shapefile
-            from collections import OrderedDict
-            ordered_attrb = OrderedDict()
-            for f in self.fields:
-                for k, v in attrb_dict.iteritems():
-                    if k == f:
-                        ordered_attrb.update({k:v})
-            for k, v, in attrb_dict.iteritems():
-                if k.startswith('_') and k.endswith('_'):
-                    ordered_attrb.update({k:v})
-            return ordered_attrb
-
-        # Set up output shapefiles
+        def write_layer(ds, lyr_name, geom_type, items):
+            # items: function returning an iterator of (geometry key, attribute dictionary). It is
+            # called once for the schema and once for the features, so the items are never all
+            # held in memory.
+            try:
+                ds.DeleteLayer(lyr_name)
+            except:
+                pass
+            lyr = ds.CreateLayer(lyr_name, srs, geom_type)
+
+            # build the schema and the field indexes once for the whole layer
+            schema = self.layer_schema(data for key, data in items())
+            for name, ogr_type in schema:
+                lyr.CreateField(ogr.FieldDefn(name, ogr_type))
+            field_idx = list(enumerate(name for name, ogr_type in schema))
+            lyr_defn = lyr.GetLayerDefn()
+
+            use_transactions = ds.TestCapability(ogr.ODsCTransactions)
+            if use_transactions:
+                ds.StartTransaction()
+            for count, (key, data) in enumerate(items(), 1):
+                feature = ogr.Feature(lyr_defn)
+                feature.SetGeometry(netgeometry(key, data))
+                for i, name in field_idx:
+                    val = data.get(name)
+                    if val is not None:
+                        feature.SetField(i, val)
+                lyr.CreateFeature(feature)
+                feature = None
+                if use_transactions and count % write_batch == 0:
+                    ds.CommitTransaction()
+                    ds.StartTransaction()
+            if use_transactions:
+                ds.CommitTransaction()
+            lyr = None
+            ds = None
+
+        # Set up output data source
         base_name = os.path.basename(out_shp)
-        shp_name = os.path.splitext(base_name)[0]
+        shp_name, ext = os.path.splitext(base_name)
         shp_name = shp_name.encode('utf-8')
         dir_name = os.path.dirname(out_shp)
         node_name = "{}_nodes".format(shp_name)
-        edge_name = "{}_edges".format(shp_name)
-        drv = ogr.GetDriverByName("ESRI Shapefile")
-        shpdir = drv.CreateDataSource("{0}".format(dir_name))
+        ext = ext.lower()
+        if ext not in OGRDrivers:
+            raise ValueError("Output format not supported: {0}".format(base_name))
+        drv = ogr.GetDriverByName(OGRDrivers[ext])
+
+        def output_datasource(lyr_name):
+            if ext == ".gpkg":
+                # GeoPackage layers are stored in the same file
+                if os.path.exists(out_shp):
+                    return ogr.Open(out_shp, 1)
+                return drv.CreateDataSource(out_shp)
+            elif ext == ".fgb":
+                # FlatGeobuf stores a single layer per file
+                fgb_file = os.path.join(dir_name, "{0}.fgb".format(lyr_name))
+                if os.path.exists(fgb_file):
+                    drv.DeleteDataSource(fgb_file)
+                return drv.CreateDataSource(fgb_file)
+            else:
+                # shapefile directory
+                return drv.CreateDataSource("{0}".format(dir_name))
 
-        # Conversion dict between python and ogr types
-        OGRTypes = {int: ogr.OFTInteger, str: ogr.OFTString, float: ogr.OFTReal}
+        if isinstance(G, EdgeStore):
+            node_items = lambda: ((G.node(n), {}) for n in xrange(len(G.node_xy)))
+            edge_items = lambda: (((u, v), data) for u, v, data in G.edges_iter())
+        else:
+            node_items = lambda: ((n, G.node[n]) for n in G)
+            edge_items = lambda: (((u, v), data) for u, v, k, data in G.edges_iter(data=True, keys=True))
 
         # Write nodes
         if bool_node:
-            try:
-                shpdir.DeleteLayer(node_name)
-            except:
-                pass
-            nodes = shpdir.CreateLayer(node_name, srs, ogr.wkbPoint)
-            # New edge attribute write support merged into edge loop
-            n_fields = {}  # storage for field names and their data types
-
-            # Node loop
-            for n in G:
-                data = G.node[n]
-                g = netgeometry(n, data)
-                n_attributes = build_attrb_dict(self, nodes, data, n_fields)
-                create_feature(g, nodes, n_attributes)
-            nodes = None
+            write_layer(output_datasource(node_name), node_name, ogr.wkbPoint, node_items)
 
         # Write edges
-        try:
-            shpdir.DeleteLayer(shp_name)
-        except:
-            pass
-
-        edges = shpdir.CreateLayer(shp_name, srs, ogr.wkbLineString)
-        # New edge attribute write support merged into edge loop
-        e_fields = {}  # storage for field names and their data types
-
-        # Edge loop
-        for u,v,k,data in G.edges_iter(data=True,keys=True):
-            g = netgeometry(k, data)
-            e_attributes = build_attrb_dict(self, edges, data, e_fields)
-            # Create the feature with geometry, passing new attribute data
-            create_feature(g, edges, e_attributes)
-        edges = None
+        write_layer(output_datasource(shp_name), shp_name, ogr.wkbLineString, edge_items)
+        src_lyr = None
+        src_shp = None
         return
 
+    def layer_schema(self, attrb_dicts):
+        """
+        Builds the output schema for a layer in one pass over the attribute dictionaries.
+        Fields from the input shapefile are listed first (in their original order), followed
+        by GNAT fields (i.e. _netid_). Field types are based on the first non-null value.
+        :param attrb_dicts: iterable of attribute dictionaries
+        :return: list of (field name, ogr field type)
+        """
+        # Conversion dict between python and ogr types
+        OGRTypes = {int: ogr.OFTInteger, long: ogr.OFTInteger, str: ogr.OFTString, float: ogr.OFTReal}
+        input_fields = getattr(self, "fields", [])
+        input_set = set(input_fields)
+        field_types = {}
+        gnat_fields = []
+        for data in attrb_dicts:
+            for key, val in data.items():
+                if field_types.get(key) is not None:
+                    continue
+                if key not in field_types:
+                    if key not in input_set and not (key.startswith('_') and key.endswith('_')):
+                        # Reject spatial data and other keys not required for attribute table
+                        continue
+                    if key not in input_set:
+                        gnat_fields.append(key)
+                # field type is set from the first non-null value
+                field_types[key] = OGRTypes.get(type(val), ogr.OFTString) if val is not None else None
+
+        schema = []
+        for key in [f for f in input_fields if f in field_types] + gnat_fields:
+            # Data type not supported, or always null, default to string
+            schema.append((key, field_types[key] if field_types[key] is not None else ogr.OFTString))
+        return schema
+
+    def source_geometry(self, layer, feature_id, start_pt):
+        """
+        Re-reads the geometry of an edge from the source layer.
+        :param layer: source layer
+        :param feature_id: FID of the source feature
+        :param start_pt: first point of the edge, used to find the part of a multipart feature
+        :return: ogr line geometry
+        """
+        # the geometry is owned by the feature, so the feature is kept until the geometry is
+        # copied (a reference to the geometry of a freed feature is not valid)
+        feature = layer.GetFeature(feature_id)
+        geom = feature.GetGeometryRef()
+        start_pt = tuple(start_pt)
+        if geom.GetGeometryType() == ogr.wkbMultiLineString:
+            for part in self.line_parts(geom):
+                if start_pt in (part.GetPoint_2D(0), part.GetPoint_2D(part.GetPointCount() - 1)):
+                    geom = part
+                    break
+        if geom.GetGeometryType() == ogr.wkbLineString and geom.GetPoint_2D(0) != start_pt:
+            # edge was reversed (i.e. by repair_flow)
+            edge_geom = ogr.CreateGeometryFromWkb(self.reverse_wkb(geom.ExportToWkb()))
+        else:
+            edge_geom = geom.Clone()
+        feature = None
+        return edge_geom
+
+    def reverse_wkb(self, wkb):
+        """
+        Reverses the point order of a WKB line string by reordering the coordinate bytes,
+        without building a geometry.
+        :param wkb: line string as WKB (2D, 25D, or ISO Z/M/ZM)
+        :return: reversed line string as WKB
+        """
+        byte_order = '<' if bytearray(wkb[:1])[0] == 1 else '>'
+        geom_type = struct.unpack(byte_order + 'I', wkb[1:5])[0]
+        # 25D types set the high bit, ISO Z/M/ZM types add 1000, 2000 or 3000
+        if (geom_type & 0x0fffffff) % 1000 != 2:
+            raise ValueError("Only LineString WKB can be reversed, not geometry type {0}".format(geom_type))
+        point_count = struct.unpack(byte_order + 'I', wkb[5:9])[0]
+        if point_count < 2:
+            return wkb
+        # each row holds the coordinate bytes of one point (x, y and z/m if present)
+        coords = np.frombuffer(wkb, dtype=np.uint8, offset=9).reshape(point_count, -1)
+        return wkb[:9] + coords[::-1].tobytes()
+
+    def reverse_wkt(self, wkt):
+        """Reverses the point order of a WKT line string. The parts of a multi line string
+        are also reversed, so that the line runs from its last point to its first."""
+        geom_type = wkt.split('(')[0].split()[0].upper()
+        if geom_type not in ('LINESTRING', 'MULTILINESTRING'):
+            raise ValueError("Only LineString WKT can be reversed, not {0}".format(geom_type))
+        if '(' not in wkt:
+            # empty geometry
+            return wkt
+
+        def reverse_points(points):
+            return ','.join(pt.strip() for pt in reversed(points.split(',')))
+
+        start = wkt.index('(') + 1
+        end = wkt.rindex(')')
+        if geom_type == 'LINESTRING':
+            body = reverse_points(wkt[start:end])
+        else:
+            parts = re.findall(r'\(([^()]*)\)', wkt[start:end])
+            body = ','.join('({0})'.format(reverse_points(part)) for part in reversed(parts))
+        return wkt[:start] + body + wkt[end:]
+
     def edges_from_line(self, geom, attrs, simplify=True, geom_attrs=True):
         """
         Re-purposed from the shape helper here:
@@ -231,7 +448,8 @@ class Network:
         """
         if geom.GetGeometryType() == ogr.wkbLineString:
             if simplify:
-                edge_attrs = attrs.copy()
+                # attrs are not shared with other edges, so they are not copied
+                edge_attrs = attrs
                 last = geom.GetPointCount() - 1
                 if geom_attrs:
                     edge_attrs["Wkb"] = geom.ExportToWkb()
@@ -256,34 +474,31 @@ class Network:
         elif geom.GetGeometryType() == ogr.wkbMultiLineString:
             for i in range(geom.GetGeometryCount()):
                 geom_i = geom.GetGeometryRef(i)
-                for edge in self.edges_from_line(geom_i, attrs, simplify, geom_attrs):
+                for edge in self.edges_from_line(geom_i, attrs.copy(), simplify, geom_attrs):
                     yield edge
 
-    def get_subgraphs(self):
+    def label_subnetworks(self):
         """
-        Finds all subgraphs that are disconnected.
-        :param self: graph must be undirected to use this method.
+        Assigns a unique identifier to the edges within each disconnected subnetwork,
+        using a union-find over the edge end points. Edges are labelled in place, without
+        copying the graph. With the columnar backend, the network IDs are added to the edge
+        store, and the graph is not built.
+        :return: graph with network IDs added as attribute, or None if the graph is not built
         """
-        list_SG = list(nx.weakly_connected_component_subgraphs(self.G, copy=True))
-        return list_SG
-
-    def calc_network_id(self, list_SG):
-        """
-        Assigns a unique identifier to the edges within each subgraph
-        :param list_SG: list of subgraphs
-        :return: new graph with network IDs added as attribute
-        """
-        attrb_field = netid
-        try:
-            subgraph_count = 1
-            for SG in list_SG:
-                network_id = "{0}{1:0>3}".format("net", subgraph_count)
-                self.add_attribute(SG, attrb_field, network_id)
-                subgraph_count += 1
-            union_SG = nx.union_all(list_SG)
-            return union_SG
-        except:
-            raise IndexError  # not sure about this... will probably change later
+        network_id = "{0}{1:0>3}"
+        if self.store is not None:
+            labels = self.store.edge_components()
+            self.store.set_column(netid, [network_id.format("net", n + 1) for n in labels])
+        if self._G is not None:
+            node_index = dict((n, i) for i, n in enumerate(self._G.nodes_iter()))
+            edges = list(self._G.edges_iter(keys=True, data=True))
+            labels = component_labels(len(node_index),
+                                      [node_index[u] for u, v, k, d in edges],
+                                      [node_index[v] for u, v, k, d in edges])
+            for (u, v, k, d), n in zip(edges, labels):
+                d[netid] = network_id.format("net", n + 1)
+        self.invalidate_index(netid)
+        return self._G
 
     def get_graph_attributes(self, G, attrb_name):
         """Returns information on a graph"""
@@ -305,8 +520,7 @@ class Network:
 
     def attribute_as_list(self, G, attrb_name):
         """Returns unique values from graph attribute as list"""
-        attrb_list = [d[attrb_name] for u,v,k,d in G.edges_iter(keys=True, data=True)]
-        return list(sorted(set(attrb_list)))
+        return list(sorted(self.attribute_index(G, attrb_name).keys()))
 
     def check_attribute(self, G, attrb_name):
         data = next(d for u,v,k,d in G.edges_iter(keys=True, data=True))
@@ -323,11 +537,13 @@ class Network:
         dict = nx.get_edge_attributes(G, attrb_name)
         if len(dict) == 0:
             nx.set_edge_attributes(G, attrb_name, attrb_value)
+            self.invalidate_index(attrb_name)
         return
 
     def delete_attribute(self, G, attrb_name):
         for u,v,k,d in G.edges_iter(keys=True, data=True):
             del d[attrb_name]
+        self.invalidate_index(attrb_name)
 
     def select_by_attribute(self, G, attrb_name, attrb_value):
         """
@@ -335,20 +551,65 @@ class Network:
         :param G: networkx graph
         :param attrb_name: name of the attribute that will be used for the selection
         :param attrb_value: attribute value to select by
+        :return: graph of the selected edges. Edge data is shared with G (see edge_subgraph).
+        """
+        index = self.attribute_index(G, attrb_name)
+        return self.edge_subgraph(G, index.get(attrb_value, []))
+
+    def attribute_index(self, G, attrb_name):
+        """
+        Returns an inverted index of attribute values to edges (u, v, key). The index is
+        built on first use and kept until the attribute changes. Indexes are held by weak
+        reference to the graph, so they are released with the graph. Network methods that
+        write edge attributes discard the index of the attribute; code that writes edge
+        data directly must call invalidate_index.
+        :param G: networkx graph
+        :param attrb_name: name of the attribute to index
+        """
+        graph_index = self._attrb_index.setdefault(G, {})
+        index = graph_index.get(attrb_name)
+        if index is None:
+            index = {}
+            for u, v, k, d in G.edges_iter(data=True, keys=True):
+                index.setdefault(d[attrb_name], []).append((u, v, k))
+            graph_index[attrb_name] = index
+        return index
+
+    def invalidate_index(self, attrb_name=None):
+        """
+        Discards attribute indexes after edge attributes have been changed. Subgraphs share
+        edge data with the graph they were selected from, so the index of the attribute is
+        discarded for every graph.
+        :param attrb_name: attribute whose index is discarded. All indexes are discarded if None.
+        """
+        if attrb_name is None:
+            self._attrb_index.clear()
+        else:
+            for graph_index in self._attrb_index.values():
+                graph_index.pop(attrb_name, None)
+
+    def edge_subgraph(self, G, edges):
+        """
+        Builds a graph from a list of edges without copying the edge data. The edge (and
+        node) attribute dictionaries are shared with G, so changes to attributes in the
+        subgraph are also made in G. This differs from a graph built with add_edge, which
+        copies the data. Use edge_subgraph(G, edges).copy() for an independent graph.
+        :param G: networkx multidigraph
+        :param edges: list of edges (u, v, key)
         """
         select_G = nx.MultiDiGraph()
-        for u, v, k, d in G.edges_iter(data=True, keys=True):
-            if d[attrb_name]==attrb_value:
-                keys = G.get_edge_data(u,v).keys()
-                # Loop through keys if more than one (for braids)
-                for ky in keys:
-                    data = G.get_edge_data(u, v, key=ky)
-                    select_G.add_edge(u, v, ky, data)
+        succ, pred, node = select_G.succ, select_G.pred, select_G.node
+        for u, v, k in edges:
+            for n in (u, v):
+                if n not in node:
+                    node[n] = G.node[n]
+                    succ[n] = {}
+                    pred[n] = {}
+            keydict = succ[u].get(v)
+            if keydict is None:
+                keydict = succ[u][v] = pred[v][u] = {}
+            keydict[k] = G.succ[u][v][k]
         return select_G
-        # else:
-        #     print "ERROR: Attribute not found"
-        #     select_G = nx.null_graph()
-        #     return select_G
 
     def update_attribute(self, G, attrb_name, attrb_value):
         """
@@ -360,6 +621,7 @@ class Network:
         dict = nx.get_edge_attributes(G, attrb_name)
         if len(dict) > 0:
             nx.set_edge_attributes(G, attrb_name, attrb_value)
+            self.invalidate_index(attrb_name)
         return
 
     def get_outflow_edges(self, G, attrb_field, attrb_name):
@@ -418,21 +680,44 @@ class Network:
 
     def get_complex_braids(self, G, attrb_field, attrb_name):
         """
-        Create graph with the complex braid edges attributed
+        Create graph with the complex braid edges attributed. Braid edges are the edges that
+        are not bridges of the undirected network (i.e. edges found in a cycle), and each
+        connected set of braid edges is numbered as a braid complex (_braidid_).
         :param G: networkx graph
         :param attrb_field: name of the attribute field
         :param attrb_name: attribute value
         :return braid_G: graph with new attribute
         """
         if nx.is_directed(G):
-            UG = nx.Graph(G)
+            # parallel edges are simple braids, so they count as a single edge here
+            node_ids = {}
+            pair_ids = {}
+            pair_from = []
+            pair_to = []
+            edges = []
+            for u, v, key, d in G.edges_iter(data=True, keys=True):
+                node_u = node_ids.setdefault(u, len(node_ids))
+                node_v = node_ids.setdefault(v, len(node_ids))
+                pair = (min(node_u, node_v), max(node_u, node_v))
+                if pair not in pair_ids:
+                    pair_ids[pair] = len(pair_from)
+                    pair_from.append(node_u)
+                    pair_to.append(node_v)
+                edges.append((u, v, key, d, pair_ids[pair]))
+            bridges = find_bridges(len(node_ids), pair_from, pair_to)
+            braid_edges = [(u, v, key, d) for u, v, key, d, pair in edges if pair not in bridges]
+
+            # number the braid complexes, in the order of their first edge
+            node_ids = {}
+            from_nodes = [node_ids.setdefault(u, len(node_ids)) for u, v, key, d in braid_edges]
+            to_nodes = [node_ids.setdefault(v, len(node_ids)) for u, v, key, d in braid_edges]
+            labels = component_labels(len(node_ids), from_nodes, to_nodes)
+
             braid_G = nx.MultiDiGraph()
-            list_cycles = nx.cycle_basis(UG)
-            cycle_edges = [zip(nodes, (nodes[1:] + nodes[:1])) for nodes in list_cycles]
-            for edge in G.edges(data=True, keys=True):
-                is_edge = self.get_edge_in_cycle(edge, cycle_edges)
-                if is_edge == True:
-                    braid_G.add_edge(*edge)
+            for (u, v, key, d), label in zip(braid_edges, labels):
+                braid_G.add_edge(u, v, key, d)
+                braid_G[u][v][key][braidid] = label + 1
+            self.invalidate_index(braidid)
             self.update_attribute(braid_G, attrb_field, attrb_name)
             return braid_G
         else:
@@ -475,17 +760,9 @@ class Network:
                 data = G.get_edge_data(u, v, key=k)
                 data[edgetype] = m
                 G.add_edge(u, v, k, data)
+        self.invalidate_index(edgetype)
         return
 
-    def get_edge_in_cycle(self, edge, cycle_edges):
-        """Determines if a specific edge is found in a cycle (i.e. braid)"""
-        u, v, key, d = edge
-        found = False
-        for cycle in cycle_edges:
-            if (u, v) in cycle or (v, u) in cycle:
-                found = True
-        return found
-
     def merge_subgraphs(self, G, outflow_G, headwater_G, braid_complex_G, braid_simple_G):
         """
         Join all subgraphs with the main graph
@@ -494,18 +771,45 @@ class Network:
         :param headwater_G: networkx graph composed of headwater edges
         :param braid_complex_G: networkx graph composed of complex braid edges
         :param braid_simple_G: networkx graph composed of simple braid edges
-        :return G_compose: final graph output with all reach type attributes included
+        :return: G, with all reach type attributes included
         """
-        G1 = nx.compose(G, outflow_G)
-        G2 = nx.compose(G1, headwater_G)
-        if braid_complex_G is not None:
-            G3 = nx.compose(G2, braid_complex_G)
-        if braid_simple_G is not None:
-            gnat_G = nx.compose(G3, braid_simple_G)
-        if braid_complex_G is None or braid_simple_G is None:
-            gnat_G = G2
+        return self.merge_edge_data(G, outflow_G, headwater_G, braid_complex_G, braid_simple_G)
 
-        return gnat_G
+    def merge_edge_data(self, G, *graphs):
+        """
+        Writes the edge attributes of each graph into the matching edges of G, in order, so
+        that later graphs take precedence (as with nx.compose). G is edited in place rather
+        than copied, so when G is selected with select_by_attribute the attributes are also
+        written to the graph it was selected from. Edges that are not in G are added to it.
+        :param G: networkx multidigraph
+        :param graphs: networkx multidigraphs (None is skipped)
+        :return: G
+        """
+        new_edges = []
+        changed = set()
+        for H in graphs:
+            if H is None:
+                continue
+            for u, v, k, d in H.edges_iter(keys=True, data=True):
+                keydict = G.succ[u].get(v) if u in G.succ else None
+                if keydict is not None and k in keydict:
+                    data = keydict[k]
+                    if data is d:
+                        continue
+                    for attrb_name, attrb_value in d.items():
+                        if attrb_name not in data or data[attrb_name] != attrb_value:
+                            data[attrb_name] = attrb_value
+                            changed.add(attrb_name)
+                else:
+                    new_edges.append((u, v, k, d))
+                    changed.update(d)
+        if new_edges:
+            G.add_edges_from(new_edges)
+        # only the indexes of changed attributes are discarded, so that the _netid_ index
+        # used to select each subnetwork is kept
+        for attrb_name in changed:
+            self.invalidate_index(attrb_name)
+        return G
 
     def find_node_with_ID(self, G, id_field, id_value):
         """
@@ -527,34 +831,111 @@ class Network:
         implicit in defined source node.
         :param G: target digraph
         :param src_node: source node
-        :param ud: undirected graph (faster iteration with setdirection)
+        :param ud: undirected graph, used to find the edges connected to the source node
         :upstream_G: networkx graph
         """
-        RG = nx.reverse(G, copy=True)
-        flipped_G = nx.MultiDiGraph()
-        upstream_list = []
-        gnodes = list(nx.dfs_preorder_nodes(RG, src_node))
-        if not ud:
-            ud = RG.to_undirected()
-        connected = RG.edges(nx.dfs_tree(ud, src_node).nodes(), data=True, keys=True)
-
-        for edge in connected:
-            start = edge[0]
-            end = edge[1]
-            if end in gnodes and start not in gnodes:
-                upstream_list.append(edge)
-
-        # add new "error_flow" attribute to graph
-        self.add_attribute(RG, errorflow, 0)  # add 'default' value
-        for u,v,key,d in RG.edges_iter(keys=True,data=True):
-            if (u,v,key,d) in upstream_list:
-                flipped_G.add_edge(u,v,key,d)
-        if flipped_G is not None:
-            self.update_attribute(flipped_G, errorflow, 1)
-        nx.reverse(RG)
-        upstream_G = nx.compose(RG, flipped_G)
+        # nodes upstream of the source node, found with a traversal of the predecessors
+        gnodes = set([src_node])
+        queue = deque([src_node])
+        while queue:
+            node = queue.popleft()
+            for pred in G.pred[node]:
+                if pred not in gnodes:
+                    gnodes.add(pred)
+                    queue.append(pred)
+        if ud is not None:
+            connected = nx.node_connected_component(ud, src_node)
+        else:
+            connected = None
+
+        # edges leaving the upstream nodes point away from the source node
+        flipped_keys = set()
+        for u in gnodes:
+            for v, keydict in G.succ[u].items():
+                if v not in gnodes and (connected is None or v in connected):
+                    for k in keydict:
+                        flipped_keys.add((u, v, k))
+
+        # add new "error_flow" attribute to a copy of the graph
+        upstream_G = nx.MultiDiGraph()
+        upstream_G.add_nodes_from(G.nodes_iter(data=True))
+        for u, v, k, d in G.edges_iter(keys=True, data=True):
+            attrs = dict(d)
+            attrs[errorflow] = 1 if (u, v, k) in flipped_keys else 0
+            upstream_G.add_edge(u, v, k, attrs)
         return upstream_G
 
+    def repair_flow(self, G, outflow_node=None):
+        """
+        Reverses the edges that flow away from the outflow, so that every edge drains to
+        the outflow node of its subnetwork. Starting with the nodes that already drain to the
+        outflow, a single breadth-first search reverses each edge leading away from a draining
+        node, along with its line geometry (WKB/WKT), and then adds the nodes that drain
+        through the reversed edge.
+        :param G: target multidigraph, edited in place
+        :param outflow_node: outflow node. If None, the outflow of each subnetwork is the node
+            without outgoing edges that has the most nodes draining to it. The nodes draining
+            to each of these sinks are found in one traversal upstream from all of them, and
+            a node that drains to more than one sink is counted for the nearest.
+        :return: list of the feature IDs of the reversed edges
+        """
+        def drain_from(node, drained, queue):
+            # adds a node and all of the nodes that already flow into it
+            stack = [node]
+            drained.add(node)
+            while stack:
+                n = stack.pop()
+                queue.append(n)
+                for pred in G.pred[n]:
+                    if pred not in drained:
+                        drained.add(pred)
+                        stack.append(pred)
+
+        if outflow_node is not None:
+            list_outflows = [outflow_node]
+        else:
+            list_outflows = []
+            for component in nx.weakly_connected_components(G):
+                sinks = [n for n in component if not G.succ[n]]
+                if not sinks:
+                    list_outflows.append(next(iter(component)))
+                    continue
+                drains_to = dict((sink, sink) for sink in sinks)
+                sink_sizes = dict((sink, 1) for sink in sinks)
+                queue = deque(sinks)
+                while queue:
+                    n = queue.popleft()
+                    for pred in G.pred[n]:
+                        if pred not in drains_to:
+                            drains_to[pred] = drains_to[n]
+                            sink_sizes[drains_to[n]] += 1
+                            queue.append(pred)
+                list_outflows.append(max(sinks, key=lambda sink: sink_sizes[sink]))
+
+        flipped = []
+        for outflow in list_outflows:
+            drained = set()
+            queue = deque()
+            drain_from(outflow, drained, queue)
+            while queue:
+                node = queue.popleft()
+                for succ, keydict in list(G.succ[node].items()):
+                    if succ in drained:
+                        continue
+                    for key in list(keydict):
+                        data = G[node][succ][key]
+                        if 'Wkb' in data:
+                            data['Wkb'] = self.reverse_wkb(data['Wkb'])
+                        if 'Wkt' in data:
+                            data['Wkt'] = self.reverse_wkt(data['Wkt'])
+                        G.remove_edge(node, succ, key=key)
+                        G.add_edge(succ, node, key=key, attr_dict=data)
+                        flipped.append(data.get(self.id_field))
+                    drain_from(succ, drained, queue)
+        if flipped:
+            self.invalidate_index()
+        return flipped
+
     def error_dup(self, G):
         """Returns parallel edges with identical lengths
         :param G: target multidigraph
@@ -608,9 +989,10 @@ class Network:
         """
         self.add_attribute(G, errorconf, 0)
         conf_G = nx.MultiDiGraph()
+        # in-degree of every node, counted once
+        in_degree = G.in_degree()
         for u, v, k, d in G.edges_iter(keys=True, data=True):
-            in_edges = G.in_edges((u), keys=True, data=True)
-            if len(in_edges) > 2:
+            if in_degree[u] > 2:
                 conf_G.add_edge(u, v, k, d)
         if conf_G.number_of_edges() > 0:
             self.update_attribute(conf_G, errorconf, 1)
@@ -619,138 +1001,206 @@ class Network:
     def set_node_types(self, G):
         """Calculates node types for a graph which already has edge types"""
 
-        node_dict = {}
-        type_list = []
-        edge_dict = nx.get_edge_attributes(G, edgetype)
-        node_list = [n for n in G.nodes_iter()]
-        # build dictionary of node with predecessors and successors nodes
-        for node in node_list:
-            node_pred = G.predecessors(node)
-            node_succ = G.successors(node)
-            node_dict[node] = [node_pred, node_succ]
-        # build list of nodes with associated edge types. Can be duplicate node items in list.
-        for nk, nv in node_dict.items():
-            for ek, ev in edge_dict.items():
-                if nk in ek:
-                    type_list.append([nk, ev])
+        # edge types of the edges connected to each node, collected in one pass over the edges.
+        # Can be duplicate edge types for a node.
+        type_dict = dict((n, []) for n in G.nodes_iter())
+        for u, v, k, d in G.edges_iter(keys=True, data=True):
+            if edgetype in d:
+                type_dict[u].append(d[edgetype])
+                if v != u:
+                    type_dict[v].append(d[edgetype])
 
         # assign a node type code for each node
-        for nd in G.nodes_iter():
-            type_subset = [n[1] for n in type_list if nd == n[0]]
-            if 'braid' in type_subset and 'headwater' in type_subset:
-                t = 'BH'
-            elif 'braid' in type_subset and 'connector' in type_subset:
-                t = 'BC'
-            elif 'braid' in type_subset and 'mainflow' in type_subset:
-                t = 'BM'
-            elif 'braid' in type_subset and 'outflow' in type_subset:
-                t = 'BO'
-            elif all(ts == 'braid' for ts in type_subset):
-                t = 'BB'
-            elif len(type_subset) == 2 and 'connector' in type_subset:
-                t = 'CC'
-            elif len(type_subset) == 2 and 'mainflow' in type_subset:
-                t = 'CC'
-            elif 'connector' in type_subset and 'headwater' in type_subset:
-                t = 'HC'
-            elif all(ts == 'connector' for ts in type_subset):
-                t = 'TC'
-            elif 'headwater' in type_subset and 'mainflow' in type_subset:
-                t = 'TC'
-            elif 'connector' in type_subset and 'mainflow' in type_subset:
-                t = 'TC'
-            elif 'headwater' in type_subset and 'outflow' in type_subset:
-                t = 'TC'
-            elif 'connector' in type_subset and 'outflow' in type_subset:
-                t = 'TC'
-            elif 'mainflow' in type_subset and 'outflow' in type_subset:
-                t = 'TC'
-            elif all(ts == 'mainflow' for ts in type_subset):
-                t = 'TC'
-            elif len(type_subset) == 1 and 'headwater' in type_subset:
-                t = 'H'
-            elif len(type_subset) == 1 and 'outflow' in type_subset:
-                t = 'O'
-            else:
-                t = None
-            G.node[nd][nodetype] = t
+        for nd, type_subset in type_dict.items():
+            G.node[nd][nodetype] = self.node_type(type_subset)
         return
 
+    def node_type(self, type_subset):
+        """Returns the node type code for a list of the edge types connected to a node"""
+        types = set(type_subset)
+        if 'braid' in types and 'headwater' in types:
+            t = 'BH'
+        elif 'braid' in types and 'connector' in types:
+            t = 'BC'
+        elif 'braid' in types and 'mainflow' in types:
+            t = 'BM'
+        elif 'braid' in types and 'outflow' in types:
+            t = 'BO'
+        elif types <= {'braid'}:
+            t = 'BB'
+        elif len(type_subset) == 2 and 'connector' in types:
+            t = 'CC'
+        elif len(type_subset) == 2 and 'mainflow' in types:
+            t = 'CC'
+        elif 'connector' in types and 'headwater' in types:
+            t = 'HC'
+        elif types == {'connector'}:
+            t = 'TC'
+        elif 'headwater' in types and 'mainflow' in types:
+            t = 'TC'
+        elif 'connector' in types and 'mainflow' in types:
+            t = 'TC'
+        elif 'headwater' in types and 'outflow' in types:
+            t = 'TC'
+        elif 'connector' in types and 'outflow' in types:
+            t = 'TC'
+        elif 'mainflow' in types and 'outflow' in types:
+            t = 'TC'
+        elif types == {'mainflow'}:
+            t = 'TC'
+        elif len(type_subset) == 1 and 'headwater' in types:
+            t = 'H'
+        elif len(type_subset) == 1 and 'outflow' in types:
+            t = 'O'
+        else:
+            t = None
+        return t
+
     def calculate_river_km(self, G):
-        """Calculates distance of each edge from outflow node, in kilometers."""
+        """Calculates distance of each edge from outflow node, in kilometers.
+        Distances for all nodes are found in one traversal upstream from the outflow
+        node, using the shortest path through braids.
+        :param G: networkx graph with edge types attributed
+        """
 
         outflow_G = self.select_by_attribute(G, edgetype, 'outflow')
         outflow_node = next(v for u, v, key, data in outflow_G.edges_iter(keys=True, data=True))
-        self.add_attribute(G, riverkm, -9999)
+
+        # Distance from every node to the outflow node, in one pass upstream
+        node_dist = self.distance_to_node(G, outflow_node, calclen)
+
+        # edges that do not drain to the outflow node keep the -9999 default
         for u, v, key, data in G.edges_iter(keys=True, data=True):
-            path_len = nx.shortest_path_length(G,
-                                               source=u,
-                                               target=outflow_node,
-                                               weight=calclen)
-            km_val = path_len / 1000
-            data[riverkm] = km_val
+            if u in node_dist and v in node_dist:
+                data[riverkm] = node_dist[u] / 1000.0
+                data[riverkm_from] = node_dist[u] / 1000.0
+                data[riverkm_to] = node_dist[v] / 1000.0
+            else:
+                for attrb_name in (riverkm, riverkm_from, riverkm_to):
+                    data.setdefault(attrb_name, -9999)
+        for attrb_name in (riverkm, riverkm_from, riverkm_to):
+            self.invalidate_index(attrb_name)
         return
 
-    def streamorder(self, G):
+    def distance_to_node(self, G, target, weight):
+        """Dijkstra search against the direction of flow, returning the shortest
+        distance from every upstream node to the target node.
+        :param G: networkx graph
+        :param target: node that distances are measured to (i.e. outflow node)
+        :param weight: edge attribute used as the edge length
+        :return: dictionary of node: distance
+        """
+        node_dist = {}
+        heap = [(0.0, target)]
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if node in node_dist:
+                continue
+            node_dist[node] = dist
+            for pred, keydict in G.pred[node].items():
+                if pred not in node_dist:
+                    # parallel edges (i.e. simple braids) use the shortest edge
+                    edge_len = min(d.get(weight, 1) for d in keydict.values())
+                    heapq.heappush(heap, (dist + edge_len, pred))
+        return node_dist
+
+    def streamorder(self, G, shreve=False):
         """Calculates strahler stream order for all edges within a stream network graph.
-        Requires an input graph that includes an  attribute field with edge types."""
-
-        try:
-            self.add_attribute(G, streamorder, -9999)
-        except:
-            self.update_attribute(G, streamorder, -9999)
-
-        # Set up initial set of reaches so that headwaters = stream order 1
-        headwater_G = self.get_headwater_edges(G, edgetype, 'headwater')
-        for u, v, k, d in G.edges_iter(data=True, keys=True):
-            if headwater_G.has_edge(u, v, key=k):
-                G.add_edge(u, v, key=k, _strmordr_=1)
-        del headwater_G
-
-        select_G = self.select_by_attribute(G, streamorder, 1)
-        select_edges = [(u,v,k,d) for u,v,k,d in select_G.edges(keys=True, data=True)]
-        so_G = self.streamorder_iter(G, select_edges)
-        return so_G
-
-    def streamorder_iter(self, G, previous_edges):
-        """Recursively iterates through a graph (representing a stream network) and calculates
-         stream order."""
-
-        def isdup(list):
-            """Test for duplicate values in list, see Jochen Ritzel
-            (https://stackoverflow.com/a/10343450/1618640)"""
-            return len(list) - 1 == len(set(list))
-
-        # Find all successor edges from selected edges
-        next_edges = []
-        while previous_edges:
-            for u, v, k, d in G.edges_iter(data=True, keys=True):
-                if (u,v,k,d) in previous_edges:
-                    out_edges = G.out_edges(v, data=True, keys=True)
-                    for out_e in out_edges:
-                        # find all predecessor edges for this successor edge
-                        in_strmordr = []
-                        in_edges = G.in_edges(out_e[0], data=True, keys=True)
-                        for in_e in in_edges:
-                            in_strmordr.append((in_e[3][streamorder],in_e[3][edgetype]))
-                        # stream order determined by predecessor edge stream order
-                        if len(in_strmordr) == 2:
-                            so = [x[0] for x in in_strmordr]
-                            types = [x[1] for x in in_strmordr]
-                            if isdup(so) and 'braid' not in types:
-                                out_e[3][streamorder] = (in_strmordr[0][0] + 1)
-                            elif isdup(types) and types[0]=='braids':
-                                out_e[3][streamorder] = (in_strmordr[0][0])
-                            else:
-                                out_e[3][streamorder] = max(so)
-                        elif len(in_edges) == 1:
-                            out_e[3][streamorder] = (in_strmordr[0][0])
-                        if out_e not in next_edges:
-                            next_edges.append(out_e)
-                    previous_edges.remove((u,v,k,d))
-        G.add_edges_from(next_edges)
-        # recursion
-        if next_edges:
-            print "---next_edges: {0}".format(len(next_edges))
-            return self.streamorder_iter(G, next_edges)
-        return G
\ No newline at end of file
+        Requires an input graph that includes an  attribute field with edge types.
+        Edges are visited once in topological order, so headwaters are assigned before
+        the edges downstream of them.
+        :param G: networkx graph
+        :param shreve: if True, also calculate shreve stream magnitude
+        :return: graph with stream order attribute
+        """
+
+        nx.set_edge_attributes(G, streamorder, -9999)
+        if shreve:
+            nx.set_edge_attributes(G, streammag, -9999)
+            braid_keys, node_complex = self.braid_complexes(G)
+            # magnitude of the flow entering each braid complex
+            complex_mag = {}
+        else:
+            braid_keys = None
+
+        # Kahn's algorithm, with an in-degree counter for each node
+        in_degree = G.in_degree()
+        node_queue = deque(n for n, d in in_degree.items() if d == 0)
+        while node_queue:
+            node = node_queue.popleft()
+            in_edges = G.in_edges(node, keys=True, data=True)
+            so, mag = self.confluence_order(in_edges, shreve, braid_keys)
+            complex_id = node_complex.get(node) if shreve else None
+            if complex_id is not None:
+                # flow from the headwaters and tributaries that join the braid complex at this node
+                inflow = [d[streammag] for u, v, k, d in in_edges if (u, v, k) not in braid_keys]
+                complex_mag[complex_id] = complex_mag.get(complex_id, 0) + (sum(inflow) if in_edges else 1)
+            for u, v, k, d in G.out_edges(node, keys=True, data=True):
+                d[streamorder] = so
+                if shreve:
+                    if complex_id is not None and (u, v, k) not in braid_keys:
+                        # edges leaving a braid complex carry all of the flow that entered it
+                        d[streammag] = complex_mag[complex_id]
+                    else:
+                        d[streammag] = mag
+                in_degree[v] -= 1
+                if in_degree[v] == 0:
+                    node_queue.append(v)
+        self.invalidate_index(streamorder)
+        self.invalidate_index(streammag)
+        return G
+
+    def braid_complexes(self, G):
+        """Finds the edges that are part of a cycle of the undirected network (including
+        parallel edges), and numbers each connected set of them as a braid complex.
+        :param G: networkx multidigraph
+        :return: set of the braid edges (u, v, key), and dictionary of node: braid complex
+            number, for the nodes of the braid edges
+        """
+        node_ids = {}
+        edges = list(G.edges_iter(keys=True))
+        from_nodes = [node_ids.setdefault(u, len(node_ids)) for u, v, k in edges]
+        to_nodes = [node_ids.setdefault(v, len(node_ids)) for u, v, k in edges]
+        bridges = find_bridges(len(node_ids), from_nodes, to_nodes)
+        braid_edges = [edge for i, edge in enumerate(edges) if i not in bridges]
+        labels = component_labels(len(node_ids),
+                                  [node_ids[u] for u, v, k in braid_edges],
+                                  [node_ids[v] for u, v, k in braid_edges])
+        node_complex = {}
+        for (u, v, k), label in zip(braid_edges, labels):
+            node_complex[u] = node_complex[v] = label
+        return set(braid_edges), node_complex
+
+    def confluence_order(self, in_edges, shreve=False, braid_keys=None):
+        """Determines the stream order (and shreve magnitude) of edges flowing out of a node,
+        based on the edges flowing into the node. Stream order only increases where two or more
+        edges with the highest order meet and none of the incoming edges are braids.
+        :param in_edges: list of incoming edges (u, v, key, data)
+        :param shreve: if True, also determine shreve stream magnitude
+        :param braid_keys: set of the edges (u, v, key) in a braid complex, from braid_complexes.
+            If None, edges with the braid edge type are braids.
+        :return: tuple of stream order and stream magnitude
+        """
+        if not in_edges:
+            # headwater
+            return 1, 1
+        so = [d[streamorder] for u, v, k, d in in_edges]
+        types = [d.get(edgetype) for u, v, k, d in in_edges]
+        max_so = max(so)
+        if so.count(max_so) > 1 and 'braid' not in types:
+            out_so = max_so + 1
+        else:
+            out_so = max_so
+
+        out_mag = None
+        if shreve:
+            # braid channels split and rejoin the same flow, so they are not summed. This
+            # includes braid channels with other edge types (i.e. a named mainflow channel).
+            if braid_keys is None:
+                is_braid = [d.get(edgetype) == 'braid' for u, v, k, d in in_edges]
+            else:
+                is_braid = [(u, v, k) in braid_keys for u, v, k, d in in_edges]
+            mag = [d[streammag] for (u, v, k, d), braid in zip(in_edges, is_braid) if not braid]
+            braid_mag = [d[streammag] for (u, v, k, d), braid in zip(in_edges, is_braid) if braid]
+            out_mag = sum(mag) + (max(braid_mag) if braid_mag else 0)
+        return out_so, out_mag
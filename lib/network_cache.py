@@ -0,0 +1,122 @@
+#   Name:           Network Cache
+#   Description:    On-disk cache of parsed stream networks, so that a network
+#                   can be reloaded without re-reading the source shapefile.
+#   Created:        10/17/2026
+
+import os
+import hashlib
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# global variables
+cache_dir = os.path.join(tempfile.gettempdir(), "GNAT_cache")
+cache_size_limit = 2 * 1024 ** 3  # bytes
+cache_ext = ".gnatcache"
+shp_exts = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+
+def source_files(in_shp):
+    """Returns the files that make up a dataset (i.e. all of the files of a shapefile)"""
+    base, ext = os.path.splitext(in_shp)
+    if ext.lower() == ".shp":
+        return [base + x for x in shp_exts if os.path.exists(base + x)]
+    return [in_shp]
+
+
+def cache_key(in_shp, **options):
+    """
+    Fingerprint of a dataset, based on the path, modification time, size and contents of its
+    files, and the options used to load it.
+    :param in_shp: input stream network shapefile
+    :param options: load options (i.e. geometry mode, fields)
+    :return: hex digest used as the cache entry name
+    """
+    key = hashlib.sha1()
+    key.update(os.path.abspath(in_shp).lower().encode("utf-8"))
+    for src in source_files(in_shp):
+        stat = os.stat(src)
+        key.update("{0}|{1}|{2}".format(src, stat.st_mtime, stat.st_size).encode("utf-8"))
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                key.update(chunk)
+    key.update(repr(sorted(options.items())).encode("utf-8"))
+    return key.hexdigest()
+
+
+def cache_path(key):
+    return os.path.join(cache_dir, key + cache_ext)
+
+
+def load(key):
+    """
+    Returns a cached network, or None if the network is not in the cache.
+    :param key: cache key from cache_key()
+    """
+    path = cache_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            cached = pickle.load(f)
+    except Exception:
+        # unreadable entry (i.e. written by a different version), so it is discarded
+        os.remove(path)
+        return None
+    # mark as recently used
+    os.utime(path, None)
+    return cached
+
+
+def save(key, cached):
+    """
+    Writes a network to the cache, then evicts the least recently used entries if the
+    cache is larger than cache_size_limit.
+    :param key: cache key from cache_key()
+    :param cached: dictionary of network data
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    path = cache_path(key)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+    evict(cache_size_limit)
+    return
+
+
+def entries():
+    """Returns the cache entries as a list of (last used time, size, path), oldest first"""
+    if not os.path.exists(cache_dir):
+        return []
+    list_entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(cache_ext):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            list_entries.append((stat.st_mtime, stat.st_size, path))
+    return sorted(list_entries)
+
+
+def evict(size_limit):
+    """Removes least recently used cache entries until the cache is within the size limit"""
+    list_entries = entries()
+    total_size = sum(size for used, size, path in list_entries)
+    for used, size, path in list_entries:
+        if total_size <= size_limit:
+            break
+        os.remove(path)
+        total_size -= size
+    return
+
+
+def clear_cache():
+    """Removes all cached networks"""
+    evict(0)
+    return
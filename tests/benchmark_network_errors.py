@@ -0,0 +1,122 @@
+#   Name:           Network error check benchmark
+#   Description:    Compares Network.error_flow and Network.error_confluence with
+#                   their previous implementations, for the flagged edges and for
+#                   the run time at increasing network sizes. Run from the
+#                   repository root: python tests/benchmark_network_errors.py
+
+import os
+import sys
+import time
+import random
+import argparse
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+from network import errorflow, errorconf, calclen
+from test_network import empty_network
+
+
+def reference_error_flow(the_network, G, src_node, ud=None):
+    """Previous implementation of Network.error_flow, which returned the graph reversed"""
+    RG = nx.reverse(G, copy=True)
+    flipped_G = nx.MultiDiGraph()
+    upstream_list = []
+    gnodes = list(nx.dfs_preorder_nodes(RG, src_node))
+    if not ud:
+        ud = RG.to_undirected()
+    connected = RG.edges(nx.dfs_tree(ud, src_node).nodes(), data=True, keys=True)
+
+    for edge in connected:
+        start = edge[0]
+        end = edge[1]
+        if end in gnodes and start not in gnodes:
+            upstream_list.append(edge)
+
+    the_network.add_attribute(RG, errorflow, 0)
+    for u, v, key, d in RG.edges_iter(keys=True, data=True):
+        if (u, v, key, d) in upstream_list:
+            flipped_G.add_edge(u, v, key, d)
+    if flipped_G is not None:
+        the_network.update_attribute(flipped_G, errorflow, 1)
+    nx.reverse(RG)
+    upstream_G = nx.compose(RG, flipped_G)
+    return upstream_G
+
+
+def reference_error_confluence(the_network, G):
+    """Previous implementation of Network.error_confluence"""
+    the_network.add_attribute(G, errorconf, 0)
+    conf_G = nx.MultiDiGraph()
+    for u, v, k, d in G.edges_iter(keys=True, data=True):
+        in_edges = G.in_edges((u), keys=True, data=True)
+        if len(in_edges) > 2:
+            conf_G.add_edge(u, v, k, d)
+    if conf_G.number_of_edges() > 0:
+        the_network.update_attribute(conf_G, errorconf, 1)
+    return conf_G
+
+
+def synthetic_network(edge_count, seed=1):
+    """Binary tree network draining to node 0, with 10% of the edges digitized against the
+    flow direction, 10% parallel edges, and confluences with more than two incoming edges"""
+    rand = random.Random(seed)
+    G = nx.MultiDiGraph()
+    node = 0
+    edges = 0
+    while edges < edge_count:
+        node += 1
+        edges += 1
+        down = (node - 1) // 2 if rand.random() > 0.05 else rand.randrange(0, node)
+        if rand.random() < 0.1:
+            G.add_edge(down, node, key=node, attr_dict={calclen: 1.0})
+        else:
+            G.add_edge(node, down, key=node, attr_dict={calclen: 1.0})
+        if rand.random() < 0.1:
+            G.add_edge(node, down, key=-node, attr_dict={calclen: 2.0})
+            edges += 1
+    return G
+
+
+def flagged(G, attrb_name, reverse=False):
+    """Edges (u, v, key) with the error attribute set to 1"""
+    return set((v, u, k) if reverse else (u, v, k)
+               for u, v, k, d in G.edges_iter(keys=True, data=True) if d.get(attrb_name) == 1)
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def benchmark(sizes, reference_limit):
+    the_network = empty_network()
+    ok = True
+    print("{0:>8} {1:>12} {2:>12} {3:>12} {4:>12} {5:>8}".format(
+        "edges", "flow old", "flow new", "conf old", "conf new", "same"))
+    for edge_count in sizes:
+        G = synthetic_network(edge_count)
+        flow_G, flow_time = timed(the_network.error_flow, G.copy(), 0)
+        conf_G, conf_time = timed(the_network.error_confluence, G.copy())
+        if edge_count <= reference_limit:
+            ref_flow_G, ref_flow_time = timed(reference_error_flow, the_network, G.copy(), 0)
+            ref_conf_G, ref_conf_time = timed(reference_error_confluence, the_network, G.copy())
+            same = flagged(flow_G, errorflow) == flagged(ref_flow_G, errorflow, reverse=True) and \
+                flagged(conf_G, errorconf) == flagged(ref_conf_G, errorconf)
+            ok = ok and same
+            print("{0:>8} {1:>11.3f}s {2:>11.3f}s {3:>11.3f}s {4:>11.3f}s {5:>8}".format(
+                edge_count, ref_flow_time, flow_time, ref_conf_time, conf_time, str(same)))
+        else:
+            print("{0:>8} {1:>12} {2:>11.3f}s {3:>12} {4:>11.3f}s {5:>8}".format(
+                edge_count, "-", flow_time, "-", conf_time, "-"))
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of Network.error_flow and error_confluence")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 4000, 8000, 16000, 64000, 256000],
+                        help="edges in each benchmark network")
+    parser.add_argument("--reference-limit", type=int, default=16000,
+                        help="largest network also run with the previous implementations")
+    args = parser.parse_args()
+    sys.exit(0 if benchmark(args.sizes, args.reference_limit) else 1)
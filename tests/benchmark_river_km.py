@@ -0,0 +1,103 @@
+#   Name:           River km benchmark
+#   Description:    Compares Network.calculate_river_km with the previous per-edge
+#                   shortest path method, for speed on a synthetic dendritic network
+#                   and for the from/to km values on braided networks. Run from the
+#                   repository root: python tests/benchmark_river_km.py
+
+import os
+import sys
+import time
+import random
+import argparse
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+from network import edgetype, calclen, riverkm, riverkm_from, riverkm_to
+from test_network import empty_network
+
+
+def outflow_node(G):
+    return next(v for u, v, d in G.edges_iter(data=True) if d[edgetype] == 'outflow')
+
+
+def reference_river_km(G, u, target):
+    """River km of a node with the previous method: one shortest path search from each edge
+    to the outflow node"""
+    return nx.shortest_path_length(G, source=u, target=target, weight=calclen) / 1000.0
+
+
+def synthetic_network(edge_count, braid_ratio=0.0, window=100, seed=1):
+    """
+    Random dendritic network. Node 0 is the outflow node, reached from node 1 by the outflow
+    edge, and each new node drains to one of the last window nodes, so the main channels are
+    long. Braids are extra edges from a node to another node further downstream.
+    """
+    rand = random.Random(seed)
+    G = nx.MultiDiGraph()
+    G.add_edge(1, 0, key=0, attr_dict={edgetype: 'outflow', calclen: rand.uniform(10.0, 1000.0)})
+    node = 1
+    for key in range(1, edge_count):
+        if node > 2 and rand.random() < braid_ratio:
+            u = rand.randrange(3, node + 1)
+            v = rand.randrange(max(1, u - window), u)
+        else:
+            node += 1
+            u = node
+            v = rand.randrange(max(1, u - window), u)
+        G.add_edge(u, v, key=key, attr_dict={edgetype: 'connector', calclen: rand.uniform(10.0, 1000.0)})
+    return G
+
+
+def check_braided(network_count, edge_count):
+    """Compares the from/to km of every edge with the per-edge method, on braided networks"""
+    the_network = empty_network()
+    mismatches = 0
+    for seed in range(network_count):
+        G = synthetic_network(edge_count, braid_ratio=0.2, window=20, seed=seed)
+        the_network.calculate_river_km(G)
+        outflow = outflow_node(G)
+        for u, v, d in G.edges_iter(data=True):
+            expected = (reference_river_km(G, u, outflow), reference_river_km(G, v, outflow))
+            result = (d[riverkm_from], d[riverkm_to])
+            if abs(result[0] - expected[0]) > 1e-9 or abs(result[1] - expected[1]) > 1e-9 or \
+                    d[riverkm] != d[riverkm_from]:
+                mismatches += 1
+    print("Braided networks: {0} networks of {1} edges, {2} edges with different from/to km".format(
+        network_count, edge_count, mismatches))
+    return mismatches == 0
+
+
+def benchmark(edge_count, sample):
+    """Times the single traversal on the whole network, and the per-edge method on a sample of
+    edges (extrapolated to the whole network) or on all edges if sample is 0"""
+    G = synthetic_network(edge_count)
+    the_network = empty_network()
+    start = time.time()
+    the_network.calculate_river_km(G)
+    new_time = time.time() - start
+    print("Single traversal, {0} edges: {1:.2f} s".format(edge_count, new_time))
+
+    edges = G.edges(data=True)
+    if 0 < sample < len(edges):
+        edges = random.Random(1).sample(edges, sample)
+    start = time.time()
+    outflow = outflow_node(G)
+    for u, v, d in edges:
+        if abs(reference_river_km(G, u, outflow) - d[riverkm_from]) > 1e-9:
+            print("River km differs for edge {0} -> {1}".format(u, v))
+    ref_time = (time.time() - start) * G.number_of_edges() / len(edges)
+    label = "extrapolated from {0} edges".format(len(edges)) if len(edges) < G.number_of_edges() else "all edges"
+    print("Per-edge shortest paths, {0} edges: {1:.2f} s ({2})".format(edge_count, ref_time, label))
+    print("Speedup: {0:.0f}x".format(ref_time / new_time if new_time > 0 else float("inf")))
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of Network.calculate_river_km")
+    parser.add_argument("--edges", type=int, default=100000, help="edges in the benchmark network")
+    parser.add_argument("--sample", type=int, default=5000,
+                        help="edges timed with the per-edge method (0 for all edges)")
+    args = parser.parse_args()
+    ok = check_braided(20, 300)
+    benchmark(args.edges, args.sample)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,140 @@
+#   Name:           Edge store tests
+#   Description:    Checks the array-backed EdgeStore and the NetworkX graphs and
+#                   output schemas built from it. Run from the repository root:
+#                   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+import networkx as nx
+import ogr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+from edge_store import EdgeStore
+from network import fid, calclen, netid
+from test_network import empty_network
+
+
+def sample_store():
+    """Store of three edges, with text, integer and real fields"""
+    store = EdgeStore(["Name", "Count", "Width"])
+    store.add_edge((0.0, 0.0), (1.0, 0.0), 5, 1.0, ["a", 3, 2.5])
+    store.add_edge((1.0, 0.0), (2.0, 0.0), 7, 1.0, ["b", 4, 3.5])
+    store.add_edge((2.0, 0.0), (2.0, 1.0), 9, 1.0, ["c", 5, 4.5])
+    store.finalize()
+    return store
+
+
+class EdgeStoreTest(unittest.TestCase):
+
+    def test_add_edge(self):
+        store = EdgeStore(["Name"])
+        store.add_edge((0.0, 0.0), (1.0, 0.0), 5, 1.0, ["a"])
+        store.add_edge((1.0, 0.0), (0.0, 0.0), 7, 1.0, ["b"])
+        # node ids are shared by edges with the same end point coordinates
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.node_ids, {(0.0, 0.0): 0, (1.0, 0.0): 1})
+
+    def test_finalize(self):
+        store = sample_store()
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.from_node.tolist(), [0, 1, 2])
+        self.assertEqual(store.to_node.tolist(), [1, 2, 3])
+        self.assertEqual(store.node(3), (2.0, 1.0))
+        self.assertEqual(store.fid.tolist(), [5, 7, 9])
+        self.assertEqual(store.columns["Name"].dtype, object)
+        self.assertEqual(store.columns["Count"].dtype, np.int64)
+        self.assertEqual(store.columns["Width"].dtype, np.float64)
+        self.assertFalse(store.has_geometry())
+        self.assertIsNone(store.node_ids)
+
+    def test_finalize_null_values(self):
+        store = EdgeStore(["Count"])
+        store.add_edge((0.0, 0.0), (1.0, 0.0), 5, 1.0, [3])
+        store.add_edge((1.0, 0.0), (2.0, 0.0), 7, 1.0, [None])
+        store.finalize()
+        self.assertEqual(store.columns["Count"].tolist(), [3, None])
+
+    def test_geometry(self):
+        store = EdgeStore([])
+        store.add_edge((0.0, 0.0), (1.0, 0.0), 5, 1.0, [], b"ab")
+        store.add_edge((1.0, 0.0), (2.0, 0.0), 7, 1.0, [], b"cde")
+        store.finalize()
+        self.assertEqual(store.geometry(0), b"ab")
+        self.assertEqual(store.geometry(1), b"cde")
+        self.assertEqual(store.edge_attributes(1)["Wkb"], b"cde")
+
+    def test_set_column(self):
+        store = sample_store()
+        store.set_column(netid, ["net001", "net001", "net002"])
+        store.set_column("Count", np.array([1, 2, 3]))
+        self.assertEqual(store.fields, ["Name", "Count", "Width", netid])
+        self.assertEqual(store.edge_attributes(2)[netid], "net002")
+        self.assertEqual(store.edge_attributes(2)["Count"], 3)
+
+    def test_edge_components(self):
+        store = EdgeStore([])
+        for i, (u, v) in enumerate([((0, 0), (1, 0)), ((5, 5), (6, 5)), ((1, 0), (2, 0))]):
+            store.add_edge(u, v, i, 1.0, [])
+        store.finalize()
+        self.assertEqual(store.edge_components(), [0, 1, 0])
+
+    def test_to_networkx(self):
+        G = sample_store().to_networkx()
+        self.assertEqual(sorted(G.edges(keys=True)), [((0.0, 0.0), (1.0, 0.0), 5),
+                                                       ((1.0, 0.0), (2.0, 0.0), 7),
+                                                       ((2.0, 0.0), (2.0, 1.0), 9)])
+        self.assertEqual(G[(1.0, 0.0)][(2.0, 0.0)][7], {"Name": "b", "Count": 4, "Width": 3.5,
+                                                        fid: 7, calclen: 1.0})
+        G = sample_store().to_networkx([2])
+        self.assertEqual(G.edges(keys=True), [((2.0, 0.0), (2.0, 1.0), 9)])
+
+    def test_edges_iter(self):
+        store = sample_store()
+        G = store.to_networkx()
+        edges = list(store.edges_iter())
+        self.assertEqual(len(edges), 3)
+        for u, v, data in edges:
+            self.assertEqual(G[u][v][data[fid]], data)
+
+
+class LabelSubnetworksTest(unittest.TestCase):
+
+    def test_columnar_backend(self):
+        network = empty_network()
+        network.store = sample_store()
+        # the network is labelled in the store, without building the graph
+        self.assertIsNone(network.label_subnetworks())
+        self.assertIsNone(network._G)
+        self.assertEqual(network.store.columns[netid].tolist(), ["net001"] * 3)
+        self.assertEqual(set(nx.get_edge_attributes(network.G, netid).values()), set(["net001"]))
+
+
+class LayerSchemaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = empty_network()
+        self.network.fields = ["Name", "Count", "Width"]
+
+    def test_schema_from_store_graph(self):
+        G = sample_store().to_networkx()
+        for u, v, d in G.edges_iter(data=True):
+            self.assertIs(type(d["Count"]), int)
+            self.assertIs(type(d[fid]), int)
+        schema = self.network.layer_schema(d for u, v, d in G.edges_iter(data=True))
+        self.assertEqual(schema, [("Name", ogr.OFTString),
+                                  ("Count", ogr.OFTInteger),
+                                  ("Width", ogr.OFTReal),
+                                  (fid, ogr.OFTInteger),
+                                  (calclen, ogr.OFTReal)])
+
+    def test_long_values(self):
+        # long values, i.e. integer fields read on Windows Python 2, are integer fields
+        schema = dict(self.network.layer_schema([{"Count": long(3), fid: long(5)}]))
+        self.assertEqual(schema["Count"], ogr.OFTInteger)
+        self.assertEqual(schema[fid], ogr.OFTInteger)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#   Name:           Find Network Features tests
+#   Description:    Checks the segment overlap and crossing tests used by the
+#                   Find Network Features tool. Run from the repository root:
+#                   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import FindNetworkFeatures
+
+tolerance = 0.001
+CROSS = 5
+OVERLAP = 4
+
+
+def segments(*rows):
+    return np.array(rows, dtype=np.float64)
+
+
+class SegmentRelationTest(unittest.TestCase):
+
+    def relation(self, seg_a, seg_b):
+        # the relation does not depend on the order of the reaches
+        result = FindNetworkFeatures.segment_relation(seg_a, seg_b, tolerance)
+        self.assertEqual(result, FindNetworkFeatures.segment_relation(seg_b, seg_a, tolerance))
+        return result
+
+    def test_cross_between_vertices(self):
+        self.assertEqual(self.relation(segments((0, 0, 2, 2)), segments((0, 2, 2, 0))), CROSS)
+
+    def test_cross_at_vertex_of_one_reach(self):
+        reach_a = segments((0, 0, 1, 1), (1, 1, 2, 2))
+        self.assertEqual(self.relation(reach_a, segments((0, 2, 2, 0))), CROSS)
+
+    def test_cross_at_shared_vertex(self):
+        reach_a = segments((0, 0, 1, 1), (1, 1, 2, 2))
+        reach_b = segments((0, 2, 1, 1), (1, 1, 2, 0))
+        self.assertEqual(self.relation(reach_a, reach_b), CROSS)
+
+    def test_touch_at_shared_vertex(self):
+        reach_a = segments((0, 0, 1, 1), (1, 1, 2, 0))
+        reach_b = segments((0, 2, 1, 1), (1, 1, 2, 2))
+        self.assertEqual(self.relation(reach_a, reach_b), 0)
+
+    def test_touch_at_vertex_of_one_reach(self):
+        reach_a = segments((0, 0, 1, 1), (1, 1, 2, 0))
+        self.assertEqual(self.relation(reach_a, segments((0, 1, 2, 1))), 0)
+
+    def test_end_point_on_reach(self):
+        self.assertEqual(self.relation(segments((1, 0, 1, 1)), segments((0, 1, 2, 1))), 0)
+
+    def test_confluence(self):
+        self.assertEqual(self.relation(segments((0, 0, 1, 1)), segments((1, 1, 2, 0))), 0)
+
+    def test_overlap(self):
+        self.assertEqual(self.relation(segments((0, 0, 2, 0)), segments((1, 0, 3, 0))), OVERLAP)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,491 @@
+#   Name:           Network tests
+#   Description:    Checks the Network class against the previous implementations
+#                   of its network attribute calculations. Run from the repository
+#                   root: python -m unittest discover tests
+
+import os
+import sys
+import random
+import struct
+import weakref
+import unittest
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+import network
+from network import edgetype, nodetype, netid, braidid, streamorder, streammag
+
+edge_types = ['braid', 'connector', 'headwater', 'mainflow', 'outflow']
+node_type_codes = ['BH', 'BC', 'BM', 'BO', 'BB', 'CC', 'HC', 'TC', 'H', 'O']
+
+
+def reference_node_types(G):
+    """Node types from the previous implementation of Network.set_node_types, which compared
+    every node with every edge. Returns a dictionary of node type codes."""
+    node_dict = {}
+    type_list = []
+    edge_dict = nx.get_edge_attributes(G, edgetype)
+    node_list = [n for n in G.nodes_iter()]
+    for node in node_list:
+        node_pred = G.predecessors(node)
+        node_succ = G.successors(node)
+        node_dict[node] = [node_pred, node_succ]
+    for nk, nv in node_dict.items():
+        for ek, ev in edge_dict.items():
+            if nk in ek:
+                type_list.append([nk, ev])
+
+    node_types = {}
+    for nd in G.nodes_iter():
+        type_subset = [n[1] for n in type_list if nd == n[0]]
+        if 'braid' in type_subset and 'headwater' in type_subset:
+            t = 'BH'
+        elif 'braid' in type_subset and 'connector' in type_subset:
+            t = 'BC'
+        elif 'braid' in type_subset and 'mainflow' in type_subset:
+            t = 'BM'
+        elif 'braid' in type_subset and 'outflow' in type_subset:
+            t = 'BO'
+        elif all(ts == 'braid' for ts in type_subset):
+            t = 'BB'
+        elif len(type_subset) == 2 and 'connector' in type_subset:
+            t = 'CC'
+        elif len(type_subset) == 2 and 'mainflow' in type_subset:
+            t = 'CC'
+        elif 'connector' in type_subset and 'headwater' in type_subset:
+            t = 'HC'
+        elif all(ts == 'connector' for ts in type_subset):
+            t = 'TC'
+        elif 'headwater' in type_subset and 'mainflow' in type_subset:
+            t = 'TC'
+        elif 'connector' in type_subset and 'mainflow' in type_subset:
+            t = 'TC'
+        elif 'headwater' in type_subset and 'outflow' in type_subset:
+            t = 'TC'
+        elif 'connector' in type_subset and 'outflow' in type_subset:
+            t = 'TC'
+        elif 'mainflow' in type_subset and 'outflow' in type_subset:
+            t = 'TC'
+        elif all(ts == 'mainflow' for ts in type_subset):
+            t = 'TC'
+        elif len(type_subset) == 1 and 'headwater' in type_subset:
+            t = 'H'
+        elif len(type_subset) == 1 and 'outflow' in type_subset:
+            t = 'O'
+        else:
+            t = None
+        node_types[nd] = t
+    return node_types
+
+
+def braided_network(edge_count, seed):
+    """Random dendritic network draining to node (0, 0), with braids (parallel edges and
+    loops between branches), a few self-loops, and random edge types"""
+    rand = random.Random(seed)
+    G = nx.MultiDiGraph()
+    nodes = [(0, 0)]
+    for key in range(edge_count):
+        r = rand.random()
+        if r < 0.6 or len(nodes) < 3:
+            u = (len(nodes), key)
+            v = rand.choice(nodes)
+            nodes.append(u)
+        elif r < 0.95:
+            u, v = rand.sample(nodes, 2)
+        else:
+            u = v = rand.choice(nodes)
+        G.add_edge(u, v, key=key, attr_dict={edgetype: rand.choice(edge_types)})
+    return G
+
+
+def reference_complex_braids(G):
+    """Keys of the complex braid edges from the previous implementation of
+    Network.get_complex_braids, which checked each edge against a cycle basis"""
+    UG = nx.Graph(G)
+    list_cycles = nx.cycle_basis(UG)
+    cycle_edges = [zip(nodes, (nodes[1:] + nodes[:1])) for nodes in list_cycles]
+    braid_keys = set()
+    for u, v, key in G.edges(keys=True):
+        for cycle in cycle_edges:
+            if (u, v) in cycle or (v, u) in cycle:
+                braid_keys.add((u, v, key))
+    return braid_keys
+
+
+def looped_network(edge_count, seed):
+    """Random multidigraph with cycles, parallel edges (in both directions) and self-loops"""
+    rand = random.Random(seed)
+    G = nx.MultiDiGraph()
+    node_count = max(2, edge_count // 2)
+    for key in range(edge_count):
+        r = rand.random()
+        u = rand.randrange(node_count)
+        if r < 0.1:
+            v = u
+        elif r < 0.3 and G.number_of_edges():
+            u, v = rand.choice(G.edges())
+            if r < 0.2:
+                u, v = v, u
+        else:
+            v = rand.randrange(node_count)
+        G.add_edge(u, v, key=key, attr_dict={edgetype: 'connector'})
+    return G
+
+
+def reference_streamorder(the_network, G):
+    """Stream order from the previous implementation of Network.streamorder, which iterated
+    over the edges downstream of the headwaters, one front at a time"""
+    def isdup(list):
+        return len(list) - 1 == len(set(list))
+
+    the_network.add_attribute(G, streamorder, -9999)
+    headwater_G = the_network.get_headwater_edges(G, edgetype, 'headwater')
+    for u, v, k, d in G.edges_iter(data=True, keys=True):
+        if headwater_G.has_edge(u, v, key=k):
+            G.add_edge(u, v, key=k, _strmordr_=1)
+    select_G = the_network.select_by_attribute(G, streamorder, 1)
+    previous_edges = [(u, v, k, d) for u, v, k, d in select_G.edges(keys=True, data=True)]
+
+    while previous_edges:
+        next_edges = []
+        while previous_edges:
+            for u, v, k, d in G.edges_iter(data=True, keys=True):
+                if (u, v, k, d) in previous_edges:
+                    out_edges = G.out_edges(v, data=True, keys=True)
+                    for out_e in out_edges:
+                        in_strmordr = []
+                        in_edges = G.in_edges(out_e[0], data=True, keys=True)
+                        for in_e in in_edges:
+                            in_strmordr.append((in_e[3][streamorder], in_e[3][edgetype]))
+                        if len(in_strmordr) == 2:
+                            so = [x[0] for x in in_strmordr]
+                            types = [x[1] for x in in_strmordr]
+                            if isdup(so) and 'braid' not in types:
+                                out_e[3][streamorder] = (in_strmordr[0][0] + 1)
+                            elif isdup(types) and types[0] == 'braids':
+                                out_e[3][streamorder] = (in_strmordr[0][0])
+                            else:
+                                out_e[3][streamorder] = max(so)
+                        elif len(in_edges) == 1:
+                            out_e[3][streamorder] = (in_strmordr[0][0])
+                        if out_e not in next_edges:
+                            next_edges.append(out_e)
+                    previous_edges.remove((u, v, k, d))
+        G.add_edges_from(next_edges)
+        previous_edges = next_edges
+    return dict(((u, v, k), d[streamorder]) for u, v, k, d in G.edges_iter(keys=True, data=True))
+
+
+def braided_stream_network(edge_count, seed):
+    """Random stream network draining to node 0, grown upstream from the outflow, with
+    confluences, simple braids (parallel edges) and braid loops that tributaries may join.
+    One channel of some braid loops is a named 'mainflow' channel. Nodes have at most two
+    incoming edges and more than two nodes, as the previous stream order implementation required."""
+    rand = random.Random(seed)
+    G = nx.MultiDiGraph()
+    nodes = [0]
+
+    def add_edge(u, v, edge_type):
+        G.add_edge(u, v, key=G.number_of_edges(), attr_dict={edgetype: edge_type})
+
+    def new_node():
+        nodes.append(len(nodes))
+        return nodes[-1]
+
+    # nodes that still need an upstream edge
+    open_nodes = [0]
+    while open_nodes:
+        node = open_nodes.pop(rand.randrange(len(open_nodes)))
+        r = rand.random() if G.number_of_edges() < edge_count else 1.0
+        if node != 0 and r > 0.8 and G.number_of_edges() > 1:
+            # headwater
+            continue
+        if r < 0.3:
+            for i in range(2):
+                up = new_node()
+                add_edge(up, node, 'connector')
+                open_nodes.append(up)
+            continue
+        if r < 0.5 or node == 0:
+            up = new_node()
+            add_edge(up, node, 'outflow' if node == 0 else 'connector')
+            open_nodes.append(up)
+            continue
+        split = new_node()
+        if r < 0.6:
+            add_edge(split, node, 'braid')
+            add_edge(split, node, 'braid')
+        else:
+            channels = [new_node(), new_node()]
+            channel_types = ['mainflow' if r < 0.7 else 'braid', 'braid']
+            for channel, channel_type in zip(channels, channel_types):
+                add_edge(split, channel, 'braid')
+                add_edge(channel, node, channel_type)
+            if rand.random() < 0.5:
+                tributary = new_node()
+                add_edge(tributary, rand.choice(channels), 'connector')
+                open_nodes.append(tributary)
+        # the flow into the braid
+        up = new_node()
+        add_edge(up, split, 'connector')
+        open_nodes.append(up)
+    return G
+
+
+def empty_network():
+    """Network object without a source shapefile, for the graph methods"""
+    the_network = network.Network.__new__(network.Network)
+    the_network._attrb_index = weakref.WeakKeyDictionary()
+    the_network._G = None
+    the_network.store = None
+    the_network.id_field = network.fid
+    return the_network
+
+
+class NodeTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = empty_network()
+
+    def test_matches_reference(self):
+        codes = set()
+        for seed in range(50):
+            G = braided_network(random.Random(seed).randrange(5, 120), seed)
+            expected = reference_node_types(G)
+            self.network.set_node_types(G)
+            result = dict((n, d[nodetype]) for n, d in G.nodes_iter(data=True))
+            self.assertEqual(result, expected)
+            codes.update(result.values())
+        # the random networks include every node type
+        for code in node_type_codes:
+            self.assertIn(code, codes)
+
+
+class ComplexBraidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = empty_network()
+
+    def test_matches_reference(self):
+        for seed in range(40):
+            G = looped_network(random.Random(seed).randrange(2, 60), seed)
+            braid_G = self.network.get_complex_braids(G, edgetype, 'braid')
+            result = set(braid_G.edges(keys=True))
+            self.assertEqual(result, reference_complex_braids(G))
+
+            # each connected set of braid edges is one braid complex
+            complexes = list(nx.connected_components(nx.Graph(braid_G)))
+            labels = [set(d[braidid] for u, v, d in braid_G.edges(nbunch, data=True)) for nbunch in complexes]
+            self.assertTrue(all(len(label) == 1 for label in labels))
+            self.assertEqual(len(set.union(set(), *labels)), len(complexes))
+
+    def test_self_loop_and_parallel_edges(self):
+        G = nx.MultiDiGraph()
+        for key, (u, v) in enumerate([(1, 2), (2, 2), (2, 3), (2, 3), (3, 4), (4, 3), (4, 5)]):
+            G.add_edge(u, v, key=key, attr_dict={edgetype: 'connector'})
+        braid_G = self.network.get_complex_braids(G, edgetype, 'braid')
+        # parallel edges are simple braids, and are only complex braids as part of a larger cycle
+        self.assertEqual(set(braid_G.edges(keys=True)), set([(2, 2, 1)]))
+        self.assertEqual(set(braid_G.edges(keys=True)), reference_complex_braids(G))
+
+
+class StreamOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = empty_network()
+
+    def magnitudes(self, G):
+        self.network.streamorder(G, shreve=True)
+        return dict(((u, v), d[streammag]) for u, v, k, d in G.edges_iter(keys=True, data=True))
+
+    def test_matches_reference(self):
+        for seed in range(30):
+            G = braided_stream_network(random.Random(seed).randrange(5, 80), seed)
+            expected = reference_streamorder(self.network, G.copy())
+            self.network.streamorder(G)
+            result = dict(((u, v, k), d[streamorder]) for u, v, k, d in G.edges_iter(keys=True, data=True))
+            self.assertEqual(result, expected)
+
+    def braid_loop(self, tributaries):
+        """Two headwaters joining upstream of a braid loop, with a named mainflow channel"""
+        G = nx.MultiDiGraph()
+        edges = [("h1", "a", "headwater"), ("h2", "a", "headwater"), ("a", "w", "connector"),
+                 ("w", "x", "braid"), ("w", "y", "braid"), ("x", "n", "mainflow"), ("y", "n", "braid"),
+                 ("n", "o", "outflow")]
+        edges += [("t{0}".format(channel), channel, "headwater") for channel in tributaries]
+        for key, (u, v, edge_type) in enumerate(edges):
+            G.add_edge(u, v, key=key, attr_dict={edgetype: edge_type})
+        return G
+
+    def test_magnitude_of_braid_loop(self):
+        mag = self.magnitudes(self.braid_loop([]))
+        self.assertEqual(mag[("a", "w")], 2)
+        self.assertEqual(mag[("x", "n")], 2)
+        self.assertEqual(mag[("y", "n")], 2)
+        self.assertEqual(mag[("n", "o")], 2)
+
+    def test_magnitude_of_braid_loop_with_tributaries(self):
+        mag = self.magnitudes(self.braid_loop(["x", "y"]))
+        self.assertEqual(mag[("x", "n")], 3)
+        self.assertEqual(mag[("y", "n")], 3)
+        self.assertEqual(mag[("n", "o")], 4)
+
+    def test_magnitude_of_simple_braid(self):
+        G = nx.MultiDiGraph()
+        for key, (u, v) in enumerate([("h1", "a"), ("h2", "a"), ("a", "n"), ("a", "n"), ("n", "o")]):
+            G.add_edge(u, v, key=key, attr_dict={edgetype: "connector"})
+        self.assertEqual(self.magnitudes(G)[("n", "o")], 2)
+
+
+def line_wkb(points, byte_order='<', geom_type=2):
+    """WKB line string of a list of coordinate tuples"""
+    wkb = struct.pack(byte_order + 'BII', 1 if byte_order == '<' else 0, geom_type, len(points))
+    for pt in points:
+        wkb += struct.pack(byte_order + 'd' * len(pt), *pt)
+    return wkb
+
+
+class ReverseGeometryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = empty_network()
+
+    def test_reverse_wkb(self):
+        points = [(0.0, 0.0), (1.0, 2.0), (3.0, 4.0)]
+        for byte_order in '<>':
+            wkb = self.network.reverse_wkb(line_wkb(points, byte_order))
+            self.assertEqual(wkb, line_wkb(points[::-1], byte_order))
+
+    def test_reverse_wkb_25d(self):
+        points = [(0.0, 0.0, 10.0), (1.0, 2.0, 11.0), (3.0, 4.0, 12.0)]
+        for geom_type in (0x80000002, 1002):
+            wkb = self.network.reverse_wkb(line_wkb(points, geom_type=geom_type))
+            self.assertEqual(wkb, line_wkb(points[::-1], geom_type=geom_type))
+
+    def test_reverse_wkb_single_point(self):
+        wkb = line_wkb([(0.0, 0.0)])
+        self.assertEqual(self.network.reverse_wkb(wkb), wkb)
+
+    def test_reverse_wkb_not_line(self):
+        point = struct.pack('<BIdd', 1, 1, 0.0, 0.0)
+        self.assertRaises(ValueError, self.network.reverse_wkb, point)
+        multi_line = struct.pack('<BII', 1, 5, 1) + line_wkb([(0.0, 0.0), (1.0, 1.0)])
+        self.assertRaises(ValueError, self.network.reverse_wkb, multi_line)
+
+    def test_reverse_wkt(self):
+        self.assertEqual(self.network.reverse_wkt("LINESTRING (0 0, 1 2, 3 4)"),
+                         "LINESTRING (3 4,1 2,0 0)")
+        self.assertEqual(self.network.reverse_wkt("LINESTRING Z (0 0 10,1 2 11)"),
+                         "LINESTRING Z (1 2 11,0 0 10)")
+        self.assertEqual(self.network.reverse_wkt("LINESTRING EMPTY"), "LINESTRING EMPTY")
+
+    def test_reverse_wkt_multilinestring(self):
+        self.assertEqual(self.network.reverse_wkt("MULTILINESTRING ((0 0,1 1),(1 1,2 2,3 3))"),
+                         "MULTILINESTRING ((3 3,2 2,1 1),(1 1,0 0))")
+
+    def test_reverse_wkt_not_line(self):
+        self.assertRaises(ValueError, self.network.reverse_wkt, "POINT (0 0)")
+        self.assertRaises(ValueError, self.network.reverse_wkt, "POLYGON ((0 0,1 0,1 1,0 0))")
+
+
+class RepairFlowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = empty_network()
+
+    def network_graph(self, edges):
+        """Graph of (from node, to node) edges, numbered by feature ID. Node coordinates are
+        (node, 0) and each edge has its straight line geometry as WKB and WKT."""
+        G = nx.MultiDiGraph()
+        for key, (u, v) in enumerate(edges):
+            points = [(float(u), 0.0), (float(v), 0.0)]
+            G.add_edge(u, v, key=key, attr_dict={network.fid: key, 'Wkb': line_wkb(points),
+                                                'Wkt': "LINESTRING ({0} 0,{1} 0)".format(u, v)})
+        return G
+
+    def test_correct_braid(self):
+        edges = [(1, 2), (2, 3), (2, 4), (3, 5), (4, 5), (5, 6)]
+        G = self.network_graph(edges)
+        self.assertEqual(self.network.repair_flow(G), [])
+        self.assertEqual(sorted(G.edges()), sorted(edges))
+
+    def test_reversed_reach(self):
+        # the reach from node 2 to node 3 is digitized upstream, and the reach downstream of
+        # it, with a tributary, drains more of the network than the headwater above it
+        G = self.network_graph([(1, 2), (3, 2), (3, 4), (7, 4), (4, 5), (5, 6)])
+        self.assertEqual(self.network.repair_flow(G), [1])
+        self.assertEqual(sorted(G.edges()), [(1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (7, 4)])
+        data = G[2][3][1]
+        self.assertEqual(data['Wkb'], line_wkb([(2.0, 0.0), (3.0, 0.0)]))
+        self.assertEqual(data['Wkt'], "LINESTRING (2 0,3 0)")
+
+    def test_outflow_node(self):
+        G = self.network_graph([(1, 2), (3, 2), (3, 4), (7, 4), (4, 5), (5, 6)])
+        self.assertEqual(sorted(self.network.repair_flow(G, outflow_node=2)), [2, 4, 5])
+        self.assertEqual(sorted(G.edges()), [(1, 2), (3, 2), (4, 3), (5, 4), (6, 5), (7, 4)])
+
+    def test_subnetworks(self):
+        # each subnetwork drains to its own outflow
+        G = self.network_graph([(1, 2), (3, 2), (3, 4), (7, 4), (4, 5), (5, 6),
+                                (11, 12), (12, 13), (13, 14), (15, 14), (14, 16)])
+        self.assertEqual(sorted(self.network.repair_flow(G)), [1])
+        self.assertTrue(G.has_edge(2, 3))
+        self.assertEqual(sorted(n for n in G if G.out_degree(n) == 0), [6, 16])
+
+
+class AttributeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = empty_network()
+        self.G = braided_network(60, 1)
+        for u, v, k, d in self.G.edges_iter(keys=True, data=True):
+            d[netid] = "net{0}".format(k % 3)
+
+    def selected_keys(self, G, attrb_name, attrb_value):
+        return sorted(k for u, v, k in self.network.select_by_attribute(G, attrb_name, attrb_value).edges_iter(keys=True))
+
+    def test_selection(self):
+        keys = sorted(k for u, v, k, d in self.G.edges_iter(keys=True, data=True) if d[netid] == "net1")
+        self.assertEqual(self.selected_keys(self.G, netid, "net1"), keys)
+
+    def test_subgraph_shares_edge_data(self):
+        subnet_G = self.network.select_by_attribute(self.G, netid, "net1")
+        self.network.update_attribute(subnet_G, edgetype, "outflow")
+        for u, v, k, d in subnet_G.edges_iter(keys=True, data=True):
+            self.assertEqual(self.G[u][v][k][edgetype], "outflow")
+
+    def test_index_follows_subgraph_writes(self):
+        self.assertNotEqual(self.selected_keys(self.G, edgetype, "mainflow"), [])
+        subnet_G = self.network.select_by_attribute(self.G, netid, "net1")
+        self.network.update_attribute(subnet_G, edgetype, "mainflow")
+        keys = sorted(k for u, v, k, d in self.G.edges_iter(keys=True, data=True) if d[edgetype] == "mainflow")
+        self.assertEqual(self.selected_keys(self.G, edgetype, "mainflow"), keys)
+
+    def test_merge_writes_to_selected_graph(self):
+        netid_index = self.network.attribute_index(self.G, netid)
+        subnet_G = self.network.select_by_attribute(self.G, netid, "net1")
+        types_G = subnet_G.copy()
+        for u, v, k, d in types_G.edges_iter(keys=True, data=True):
+            d[braidid] = 1
+        merged_G = self.network.merge_edge_data(subnet_G, types_G)
+        self.assertIs(merged_G, subnet_G)
+        for u, v, k, d in self.G.edges_iter(keys=True, data=True):
+            self.assertEqual(braidid in d, d[netid] == "net1")
+        # the index used to select the subnetworks is kept
+        self.assertIs(self.network.attribute_index(self.G, netid), netid_index)
+
+    def test_merge_adds_missing_edges(self):
+        new_G = nx.MultiDiGraph()
+        new_G.add_edge((0, 0), (-1, -1), key=1000, attr_dict={netid: "net9"})
+        self.network.merge_edge_data(self.G, new_G)
+        self.assertEqual(self.selected_keys(self.G, netid, "net9"), [1000])
+
+    def test_index_released_with_graph(self):
+        self.network.attribute_index(self.G, netid)
+        self.assertEqual(len(self.network._attrb_index), 1)
+        self.G = None
+        self.assertEqual(len(self.network._attrb_index), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
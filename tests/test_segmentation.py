@@ -0,0 +1,77 @@
+#   Name:           Segmentation tests
+#   Description:    Checks the stream branch segmentation of the Segment Stream Network
+#                   tool. Run from the repository root: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.Segmentation import segmentBranches, listStrSegMethod
+from tools.FCT.def__SLEM import PartsLength
+
+bottom, divided = listStrSegMethod[1:]
+
+
+def branch(*parts):
+    """Stream branch of a list of parts, each a list of (x, y) vertices"""
+    listParts = [np.array(part, dtype=np.float64) for part in parts]
+    return listParts, PartsLength(listParts)
+
+
+def segment_lengths(listSegments):
+    return [PartsLength(segment) for segment in listSegments]
+
+
+class SegmentBranchesTest(unittest.TestCase):
+
+    def test_remainder_at_outflow(self):
+        segments = segmentBranches([branch([(0, 0), (100, 0)])], 30.0, bottom)
+        np.testing.assert_allclose(segment_lengths(segments), [30.0, 30.0, 30.0, 10.0])
+        np.testing.assert_allclose(segments[0][0][0], (0, 0))
+        np.testing.assert_allclose(segments[-1][0][-1], (100, 0))
+
+    def test_divided_remainder(self):
+        segments = segmentBranches([branch([(0, 0), (100, 0)])], 30.0, divided)
+        np.testing.assert_allclose(segment_lengths(segments), [100 / 3.0] * 3)
+
+    def test_exact_multiple(self):
+        # 210.3 / 70.1 is slightly more, and 2.1 / 0.7 slightly less, than 3 in floating point
+        for length, distance in [(210.3, 70.1), (2.1, 0.7)]:
+            for method in (bottom, divided):
+                segments = segmentBranches([branch([(0, 0), (length, 0)])], distance, method)
+                np.testing.assert_allclose(segment_lengths(segments), [distance] * 3)
+
+    def test_shorter_than_distance(self):
+        listBranch = branch([(0, 0), (3, 4), (3, 10)])
+        for method in (bottom, divided):
+            segments = segmentBranches([listBranch], 70.1, method)
+            self.assertEqual(len(segments), 1)
+            np.testing.assert_allclose(segments[0][0], listBranch[0][0])
+
+    def test_cut_on_vertex(self):
+        segments = segmentBranches([branch([(0, 0), (10, 0), (10, 10), (20, 10)])], 10.0, bottom)
+        self.assertEqual(len(segments), 3)
+        for segment, expected in zip(segments, [[(0, 0), (10, 0)], [(10, 0), (10, 10)], [(10, 10), (20, 10)]]):
+            np.testing.assert_allclose(segment[0], expected)
+
+    def test_multipart_branch(self):
+        # a segment spanning the gap between parts keeps both parts, and a cut on the part
+        # boundary does not add an empty part
+        listBranch = branch([(0, 0), (10, 0)], [(20, 0), (40, 0)])
+        segments = segmentBranches([listBranch], 15.0, bottom)
+        self.assertEqual([len(segment) for segment in segments], [2, 1])
+        np.testing.assert_allclose(segment_lengths(segments), [15.0, 15.0])
+        segments = segmentBranches([listBranch], 10.0, bottom)
+        self.assertEqual([len(segment) for segment in segments], [1, 1, 1])
+
+    def test_branch_order(self):
+        listBranches = [branch([(0, 0), (25, 0)]), branch([(0, 5), (10, 5)])]
+        segments = segmentBranches(listBranches, 10.0, bottom)
+        np.testing.assert_allclose(segment_lengths(segments), [10.0, 10.0, 5.0, 10.0])
+        np.testing.assert_allclose(segments[-1][0][0], (0, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#   Name:           SLEM tests
+#   Description:    Checks the cut measures and the line cutting used by def__SLEM
+#                   to split lines into segments. Run from the repository root:
+#                   python -m unittest discover tests
+
+import os
+import sys
+import random
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.FCT.def__SLEM import SplitMeasures, SplitParts, PartsLength
+
+
+def line(*points):
+    return np.array(points, dtype=np.float64)
+
+
+class SplitMeasuresTest(unittest.TestCase):
+
+    def test_remainder_upstream(self):
+        np.testing.assert_allclose(SplitMeasures(100.0, 30.0), [0.0, 10.0, 40.0, 70.0, 100.0])
+
+    def test_exact_multiple(self):
+        # 210.3 / 70.1 is slightly more than 3 in floating point, which must not add a
+        # zero length segment
+        measures = SplitMeasures(210.3, 70.1)
+        self.assertEqual(len(measures), 4)
+        np.testing.assert_allclose(measures, [0.0, 70.1, 140.2, 210.3])
+
+    def test_shorter_than_distance(self):
+        np.testing.assert_allclose(SplitMeasures(12.5, 70.1), [0.0, 12.5])
+
+    def test_equal_to_distance(self):
+        np.testing.assert_allclose(SplitMeasures(70.1, 70.1), [0.0, 70.1])
+
+
+class SplitPartsTest(unittest.TestCase):
+
+    def assertSegments(self, segments, expected):
+        self.assertEqual(len(segments), len(expected))
+        for parts, expected_parts in zip(segments, expected):
+            self.assertEqual(len(parts), len(expected_parts))
+            for xy, expected_xy in zip(parts, expected_parts):
+                np.testing.assert_allclose(xy, expected_xy)
+
+    def test_cut_between_vertices(self):
+        parts = [line((0, 0), (10, 0), (10, 10))]
+        segments = SplitParts(parts, np.array([0.0, 5.0, 15.0, 20.0]))
+        self.assertSegments(segments, [[line((0, 0), (5, 0))],
+                                       [line((5, 0), (10, 0), (10, 5))],
+                                       [line((10, 5), (10, 10))]])
+
+    def test_cut_on_vertex(self):
+        # the vertex is the end of one segment and the start of the next, and is not repeated
+        parts = [line((0, 0), (10, 0), (20, 0), (30, 0))]
+        segments = SplitParts(parts, np.array([0.0, 10.0, 30.0]))
+        self.assertSegments(segments, [[line((0, 0), (10, 0))],
+                                       [line((10, 0), (20, 0), (30, 0))]])
+
+    def test_shorter_than_distance(self):
+        parts = [line((0, 0), (3, 4), (3, 10))]
+        segments = SplitParts(parts, SplitMeasures(PartsLength(parts), 70.1))
+        self.assertSegments(segments, [parts])
+
+    def test_cut_on_part_boundary(self):
+        # no zero length part is added to the segment on either side of the boundary
+        parts = [line((0, 0), (10, 0)), line((20, 0), (30, 0))]
+        segments = SplitParts(parts, np.array([0.0, 10.0, 20.0]))
+        self.assertSegments(segments, [[line((0, 0), (10, 0))],
+                                       [line((20, 0), (30, 0))]])
+
+    def test_multipart_gap(self):
+        # measures run along the parts, not across the gap between them, and a segment
+        # spanning the gap keeps both of its parts
+        parts = [line((0, 0), (10, 0)), line((20, 0), (30, 0))]
+        segments = SplitParts(parts, np.array([0.0, 5.0, 15.0, 20.0]))
+        self.assertSegments(segments, [[line((0, 0), (5, 0))],
+                                       [line((5, 0), (10, 0)), line((20, 0), (25, 0))],
+                                       [line((25, 0), (30, 0))]])
+
+    def test_segment_lengths(self):
+        rand = random.Random(1)
+        for i in range(50):
+            parts = [np.cumsum([[rand.uniform(-5, 5), rand.uniform(-5, 5)]
+                                for j in range(rand.randrange(2, 20))], axis=0)
+                     for k in range(rand.randrange(1, 4))]
+            distance = rand.uniform(1, 40)
+            measures = SplitMeasures(PartsLength(parts), distance)
+            segments = SplitParts(parts, measures)
+            self.assertEqual(len(segments), len(measures) - 1)
+            np.testing.assert_allclose([PartsLength(segment) for segment in segments],
+                                       np.diff(measures), atol=1e-9)
+            # every vertex of the line is kept
+            vertices = np.vstack([xy for segment in segments for xy in segment])
+            for xy in parts:
+                for pt in xy:
+                    self.assertTrue(np.any(np.all(np.isclose(vertices, pt), axis=1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
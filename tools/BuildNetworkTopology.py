@@ -26,15 +26,8 @@ import sys
 import FindBraidedNetwork as braid
 from lib import ClearInMemory as in_mem, gis_tools
 
-sys.setrecursionlimit(1500)
-
 # # Script Parameters # #
-listReachPairs = [] ## Reach-Pairs written to NetworkTable
-listHeadwaterIDs = [] ## Reaches identified as headwaters, written to 
-listReachesDone = [] ## Reaches processed
-listJunctions = [] ## Reaches that are part of a junction, to ignore as an upstream reach.
-intTotalFeatures = [] ## Total number of features to be processed
-listBraidedReaches = [] ## Reaches part of a braided system
+tolerance = 0.001 ## Distance within which reach end points are connected
 
 # # Environmental parameters # #
 arcpy.env.overwriteOutput = True
@@ -42,116 +35,116 @@ arcpy.env.workspace = "in_memory"
 
 # # Functions # #
 
-def network_tree(inputID,tblNetwork,fcLines,fcNodePoint):
-
-    checkcount()
-
-    # Get OID field names
+def reach_endpoints(fcLines):
+    """Reads the start and end point of every reach with a single search cursor"""
     oid_fcLines = arcpy.Describe(fcLines).OIDFieldName
+    dictEndpoints = {}
+    with arcpy.da.SearchCursor(fcLines, [oid_fcLines, "SHAPE@"]) as scLines:
+        for row in scLines:
+            ptFirst = row[1].firstPoint
+            ptLast = row[1].lastPoint
+            dictEndpoints[row[0]] = ((ptFirst.X, ptFirst.Y), (ptLast.X, ptLast.Y))
+    del scLines
+    return dictEndpoints
+
+
+class TopologySession(object):
+    """State of a single topology build. Each run (or worker process) uses its own session,
+    so results from different basins are kept separate."""
+
+    def __init__(self, intTotalFeatures, setBraidedReaches=None):
+        self.listReachPairs = [] ## Reach-Pairs written to NetworkTable
+        self.listHeadwaterIDs = [] ## Reaches identified as headwaters
+        self.setReachesDone = set() ## Reaches processed
+        self.setJunctions = set() ## Reaches that are part of a junction, to ignore as an upstream reach.
+        self.intTotalFeatures = intTotalFeatures ## Total number of features to be processed
+        self.setBraidedReaches = setBraidedReaches if setBraidedReaches else set() ## Reaches part of a braided system
+        self.intNextPercent = 10 ## Next progress message
+
+    def checkcount(self):
+        """Reports progress every 10 percent of the features processed"""
+        intDone = len(self.setReachesDone)
+        while self.intNextPercent <= 100 and intDone >= self.intTotalFeatures * self.intNextPercent / 100.0:
+            arcpy.AddMessage(str(self.intNextPercent) + "%  complete. (" + str(intDone) + " | " +
+                             str(self.intTotalFeatures) + ")")
+            self.intNextPercent += 10
+        return
 
-    if inputID in listReachesDone or inputID == "":
-        pass #return
-
-    else:
-        listReachesDone.append(inputID)
-
-        if arcpy.Exists("InputReach"):
-            arcpy.Delete_management("InputReach")
-        if arcpy.Exists("SelectedReaches"):
-            arcpy.Delete_management("SelectedReaches")
-        if arcpy.Exists("lyrCurrentReachBraidedPoint"):
-            arcpy.Delete_management("lyrCurrentReachBraidedPoint")
-        if arcpy.Exists("lyrSelectedBraidedReaches"):
-            arcpy.Delete_management("lyrSelectedBraidedReaches")
-        arcpy.SelectLayerByAttribute_management("lyrBraidedReachStartPoints","CLEAR_SELECTION")
-
-        # Make Layers
-        arcpy.MakeFeatureLayer_management(fcLines,"InputReach", oid_fcLines + " = " + str(inputID))
-        arcpy.MakeFeatureLayer_management(fcLines,"SelectedReaches")
-
-        # Select Adjacent Features
-        if inputID in listBraidedReaches:
-            arcpy.SelectLayerByAttribute_management("lyrBraidedReachStartPoints","CLEAR_SELECTION")
-            arcpy.MakeFeatureLayer_management("lyrBraidedReachStartPoints","lyrCurrentReachBraidedPoint",""" "ORIG_FID" = """ + str(inputID))
-            arcpy.SelectLayerByLocation_management("SelectedReaches","WITHIN_A_DISTANCE","lyrCurrentReachBraidedPoint","0.001","NEW_SELECTION")
-
-            arcpy.SelectLayerByLocation_management("lyrBraidedReachStartPoints","WITHIN_A_DISTANCE","lyrCurrentReachBraidedPoint","0.001","NEW_SELECTION")
-            arcpy.AddMessage("Braided " + str(int(arcpy.GetCount_management("lyrBraidedReachStartPoints").getOutput(0))))
-            arcpy.SelectLayerByAttribute_management("lyrBraidedReachStartPoints","REMOVE_FROM_SELECTION",""" "ORIG_FID" = """ + str(inputID))
-            arcpy.SelectLayerByAttribute_management("SelectedReaches","REMOVE_FROM_SELECTION",oid_fcLines + " = " + str(inputID))
-            if int(arcpy.GetCount_management("lyrBraidedReachStartPoints").getOutput(0)) == 1:
-                with arcpy.da.SearchCursor("lyrBraidedReachStartPoints",["ORIG_FID"]) as scBraided:
-                    for row in scBraided:
-                        arcpy.SelectLayerByAttribute_management("SelectedReaches","REMOVE_FROM_SELECTION",oid_fcLines + " = " + str(row[0]))
-                del scBraided
-            descSelectedReaches = arcpy.Describe("SelectedReaches")
-            listSelected = descSelectedReaches.FIDset.split("; ")
-
-        else:
-            arcpy.SelectLayerByLocation_management("SelectedReaches","WITHIN_A_DISTANCE","InputReach","0.001","NEW_SELECTION")
-            arcpy.SelectLayerByAttribute_management("SelectedReaches","REMOVE_FROM_SELECTION",oid_fcLines + " = " + str(inputID))
-            arcpy.SelectLayerByLocation_management("lyrBraidedReachStartPoints","WITHIN_A_DISTANCE","InputReach","0.001","NEW_SELECTION")
-            listSelectedBraidedReaches = []
-            if int(arcpy.GetCount_management("lyrBraidedReachStartPoints").getOutput(0)) > 0:
-                with arcpy.da.SearchCursor("lyrBraidedReachStartPoints",["ORIG_FID"]) as scBraided:
-                    for row in scBraided:
-                        listSelectedBraidedReaches.append(str(row[0]))
-                del scBraided
-
-                arcpy.AddMessage("   Selected Braided Reaches: " + str(listSelectedBraidedReaches))
-
-            descSelectedReaches = arcpy.Describe("SelectedReaches")
-            listSelected = descSelectedReaches.FIDset.split("; ")
-            for item in listReachesDone:
-                if str(item) in listSelected:
-                    listSelected.remove(str(item))
-
-            for item in listSelectedBraidedReaches:
-                if str(item) in listSelected:
-                    listSelected.remove(str(item))
-        
-        for item in listJunctions:
-            if str(item) in listSelected:
-                listSelected.remove(str(item))
-    
-        # Recursion Cases
-        if len(listSelected) == 1: # Move Along Stream
-            #Write Output to Table
-            arcpy.AddMessage("  Single Reach, " + str(inputID))
-            listReachPairs.append([inputID,listSelected[0]])
-            network_tree(listSelected[0],tblNetwork,fcLines,fcNodePoint)
-            pass
-
-        elif len(listSelected) == 0: # Headwater
-            if inputID in listBraidedReaches:
-                pass
+    def network_tree(self, inputID, dictEndpoints):
+        """Walks upstream from the outflow reach, using an explicit stack, and records the
+        ReachID/UpstreamID pairs. Adjacent reaches are found from a hash of the reach end
+        points (snapped with the same 0.001 tolerance as the former spatial selections).
+        :param inputID: ID of the outflow reach
+        :param dictEndpoints: dictionary of reach ID: (start point, end point)
+        """
+        setBraided = self.setBraidedReaches
+        setReachesDone = self.setReachesDone
+        setJunctions = self.setJunctions
+        indexEnds = gis_tools.EndpointIndex(tolerance)
+        indexBraidedStarts = gis_tools.EndpointIndex(tolerance)
+        for reach, (ptStart, ptEnd) in dictEndpoints.items():
+            indexEnds.add(ptStart, reach)
+            indexEnds.add(ptEnd, reach)
+            if reach in setBraided:
+                indexBraidedStarts.add(ptStart, reach)
+
+        stackReaches = [inputID]
+        while stackReaches:
+            inputID = stackReaches.pop()
+            if inputID in setReachesDone:
+                continue
+            setReachesDone.add(inputID)
+            self.checkcount()
+            ptStart, ptEnd = dictEndpoints[inputID]
+
+            # Select Adjacent Features
+            if inputID in setBraided:
+                # reaches connected to the upstream end of the braided reach, excluding the other
+                # braided reach that splits from the same point
+                setSelected = set(indexEnds.near(ptStart))
+                setSelected.discard(inputID)
+                setBraidedStarts = set(indexBraidedStarts.near(ptStart))
+                setBraidedStarts.discard(inputID)
+                if len(setBraidedStarts) == 1:
+                    setSelected -= setBraidedStarts
             else:
-                listHeadwaterIDs.append(int(inputID))
-                listReachPairs.append([inputID, u'-99999'])
-                arcpy.AddMessage("  Headwater, " + str(inputID))
-            return # Return to Next Junction
-
-        else: # Recurse through Multiple Junctions
-            arcpy.AddMessage("  Junction, " + str(inputID))
-            for item in listSelected:
-                listJunctions.append(item)
-            for selectedID in listSelected:
-                listReachPairs.append([inputID,selectedID])
-
-                network_tree(selectedID,tblNetwork,fcLines,fcNodePoint)
+                setSelected = set(indexEnds.near(ptStart)) | set(indexEnds.near(ptEnd))
+                setSelected.discard(inputID)
+                if setSelected:
+                    setSelected -= setReachesDone
+                    setSelected -= set(indexBraidedStarts.near(ptStart)) | set(indexBraidedStarts.near(ptEnd))
+                else:
+                    # isolated reach, flagged as a potential topology error
+                    self.listReachPairs.append([inputID, u''])
+                    continue
+
+            if not setSelected and inputID in setBraided:
+                # braided reach with no upstream reach, flagged as a potential topology error
+                self.listReachPairs.append([inputID, u''])
+                continue
+
+            setSelected -= setJunctions
+            listSelected = sorted(setSelected)
+
+            if len(listSelected) == 1: # Move Along Stream
+                self.listReachPairs.append([inputID, listSelected[0]])
+                stackReaches.append(listSelected[0])
+
+            elif len(listSelected) == 0: # Headwater
+                if inputID not in setBraided:
+                    self.listHeadwaterIDs.append(int(inputID))
+                    self.listReachPairs.append([inputID, u'-99999'])
+
+            else: # Multiple Junctions
+                setJunctions.update(listSelected)
+                for selectedID in listSelected:
+                    self.listReachPairs.append([inputID, selectedID])
+                # reversed, so the first junction reach is processed first
+                stackReaches.extend(reversed(listSelected))
 
         return
 
 
-def checkcount():
-    arcpy.AddMessage(str(len(listReachesDone)) + " | " + str(intTotalFeatures[0]))
-    if len(listReachesDone) > 0:
-        for percent in range(1,11):
-            if len(listReachesDone) == int(intTotalFeatures[0] * 0.1 * percent):
-                arcpy.AddMessage(str(10*percent) + "%  complete.")
-    return
-
-
 def calcNodes(fcStreamNetwork):
     arcpy.AddMessage("Calculating stream network nodes...")
     arcpy.MakeFeatureLayer_management(fcStreamNetwork, "StreamNetwork_lyr")
@@ -197,20 +190,18 @@ def calcNodes(fcStreamNetwork):
     return networkVrtx
 
 
-def queryNodes(inputID, fcNodePoint):
-    fcNodePoint_lyr = "fcNodePoint_lyr"
-    arcpy.MakeFeatureLayer_management(fcNodePoint, fcNodePoint_lyr)
-    expr = """"{0}" = {1}""".format("ReachID", inputID)
-    nodeDict = {}
-    with arcpy.da.SearchCursor(fcNodePoint_lyr, ['ReachID','PointType','FROM_NODE','TO_NODE'], where_clause=expr) as cursor:
+def queryNodes(fcNodePoint):
+    """Builds a lookup of ReachID to FROM_NODE and TO_NODE, in a single pass over the node points"""
+    dictNodes = {}
+    with arcpy.da.SearchCursor(fcNodePoint, ['ReachID','PointType','FROM_NODE','TO_NODE']) as cursor:
         for row in cursor:
+            nodeDict = dictNodes.setdefault(row[0], {})
             if row[1] == 'START':
-                nodeDict = {'FROM_NODE': row[2]}
+                nodeDict['FROM_NODE'] = row[2]
             if row[1] == 'END':
                 nodeDict['TO_NODE'] = row[3]
-    arcpy.Delete_management(fcNodePoint_lyr)
     del cursor
-    return nodeDict
+    return dictNodes
 
 
 def selectDownstreamReach(fcNetwork, intOutflowReachID):
@@ -294,7 +285,7 @@ def main(fcNetwork,intOutflowReachID):
     arcpy.AddField_management(fcStreamNetworkTemp, add_fields[1], "LONG") # add ReachID field
     arcpy.CalculateField_management(fcStreamNetworkTemp_lyr, "ReachID", "!" + oid_field + "!", "PYTHON_9.3")
 
-    intTotalFeatures.append(int(arcpy.GetCount_management(fcStreamNetworkTemp).getOutput(0)))
+    session = TopologySession(int(arcpy.GetCount_management(fcStreamNetworkTemp).getOutput(0)))
 
     # Populate Braided List
     if arcpy.Exists("lyrBraidedReaches"):
@@ -308,14 +299,8 @@ def main(fcNetwork,intOutflowReachID):
     arcpy.SelectLayerByAttribute_management("lyrBraidedReaches","NEW_SELECTION",whereBraidedReaches)
     descLyrBraidedReaches = arcpy.Describe("lyrBraidedReaches")
     for item in descLyrBraidedReaches.FIDset.split("; "):
-        listBraidedReaches.append(item)
-
-    if arcpy.Exists("in_memory\\BraidedReachStartPoints"):
-        arcpy.Delete_management("in_memory\\BraidedReachStartPoints")
-    arcpy.FeatureVerticesToPoints_management("lyrBraidedReaches","in_memory\\BraidedReachStartPoints","START")
-    if arcpy.Exists("lyrBraidedReachStartPoints"):
-        arcpy.Delete_management("lyrBraidedReachStartPoints")
-    arcpy.MakeFeatureLayer_management("in_memory\\BraidedReachStartPoints","lyrBraidedReachStartPoints")
+        if item != "":
+            session.setBraidedReaches.add(int(item))
 
     # Write node points feature class to disk
     fcNodePoint = calcNodes(fcStreamNetworkTemp)  # build node point feature class
@@ -330,19 +315,20 @@ def main(fcNetwork,intOutflowReachID):
         arcpy.AddError("GNAT is not compatible with enterprise geodatabase sources!")
 
     # Process
-    network_tree(downstream_oid,tableNetwork,fcStreamNetworkTemp_lyr,fcNodePoint)
-    checkcount()
+    session.network_tree(downstream_oid, reach_endpoints(fcStreamNetworkTemp))
 
     # Write outputs
     arcpy.AddMessage("Writing to table...")
+    dictNodes = queryNodes(fcNodePoint)
+    listRows = []
+    for pair in session.listReachPairs:
+        nodeDict = dictNodes.get(int(pair[0]), {})
+        upstreamID = -11111 if pair[1] == '' else pair[1]
+        listRows.append([pair[0], upstreamID, nodeDict.get('FROM_NODE'), nodeDict.get('TO_NODE')])
     with arcpy.da.InsertCursor(tableNetwork,["ReachID","UpstreamID","FROM_NODE","TO_NODE"]) as icNetworkTable:
         try:
-            for pair in listReachPairs:
-                nodeDict = queryNodes(pair[0], fcNodePoint)
-                if pair[1] == '':
-                    icNetworkTable.insertRow([pair[0],-11111,nodeDict['FROM_NODE'], nodeDict['TO_NODE']])
-                else:
-                    icNetworkTable.insertRow([pair[0],pair[1],nodeDict['FROM_NODE'], nodeDict['TO_NODE']])
+            for row in listRows:
+                icNetworkTable.insertRow(row)
         except RuntimeError as e:
             print "Runtime error: {0}".format(e)
     if wspace_type.dataType == "Folder":
@@ -354,10 +340,10 @@ def main(fcNetwork,intOutflowReachID):
         arcpy.Delete_management("LineLayer")
     arcpy.MakeFeatureLayer_management(fcStreamNetworkTemp,"LineLayer")
     arcpy.CalculateField_management(fcStreamNetworkTemp,"IsHeadwatr",0,"PYTHON")
-    if len(listHeadwaterIDs) > 1:
-        where = oid_field + ' IN ' + str(tuple(listHeadwaterIDs))
+    if len(session.listHeadwaterIDs) > 1:
+        where = oid_field + ' IN ' + str(tuple(session.listHeadwaterIDs))
     else:
-        where = oid_field + ' = ' + str(listHeadwaterIDs[0]) # corner case of one headwater
+        where = oid_field + ' = ' + str(session.listHeadwaterIDs[0]) # corner case of one headwater
     arcpy.SelectLayerByAttribute_management("LineLayer","NEW_SELECTION", where)
     arcpy.CalculateField_management("LineLayer","IsHeadwatr",1,"PYTHON")
     arcpy.SelectLayerByAttribute_management("LineLayer", "CLEAR_SELECTION")
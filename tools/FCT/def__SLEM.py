@@ -21,112 +21,126 @@ Last update on 07 fev. 2014
           polyline from upstream to downstream.
 
           This code has been significantly modified by Jesse Langdon, South Fork Research, Inc. (SFR).
+          The route and event table steps have been replaced by cutting each line's vertex array
+          with NumPy, which produces the same segments and fields.
 '''
 
 
 # Import of required librairies
+import os
+import math
+import numpy as np
 import arcpy
 import def__UpToDateShapeLengthField as UPD_SL
 
 # Allow the temporary outputs overwrite
 arcpy.env.overwriteOutput = True
 
+# Cut measures closer than this (map units) to the line ends are floating point error, not segments
+tolerance = 1e-6
+
 #===============================================================================
 # CODING
 #===============================================================================
+def SplitMeasures(Length, Distance):
+    """Returns the measures at which a line is cut, from upstream (0) to downstream (Length).
+    Segments of length Distance are measured from the downstream end, so the remaining
+    shorter segment is at the upstream end of the line."""
+    nsegments = int(math.ceil(Length / float(Distance)))
+    tops = Length - float(Distance) * np.arange(nsegments)
+    tops = tops[tops > tolerance]
+    return np.concatenate(([0.0], tops[::-1]))
+
+
+def LineParts(Shape):
+    """Returns the parts of a polyline geometry as (n, 2) vertex arrays, skipping empty parts"""
+    parts = [np.array([(pnt.X, pnt.Y) for pnt in part if pnt], dtype=np.float64) for part in Shape]
+    return [xy for xy in parts if len(xy) > 1]
+
+
+def PartsLength(Parts):
+    """Returns the total length of a list of vertex arrays"""
+    return sum(np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1])).sum() for xy in Parts)
+
+
+def PartsToPolyline(Parts, SpatialRef):
+    """Builds a polyline geometry from a list of vertex arrays"""
+    array = arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in xy]) for xy in Parts])
+    return arcpy.Polyline(array, SpatialRef)
+
+
+def SplitParts(Parts, Measures):
+    """Cuts the parts of a line at the given measures.
+    :param Parts: list of (n, 2) vertex arrays, in line order
+    :param Measures: ascending cut measures, from 0 to the line length
+    :return: list with, for each segment, the list of (m, 2) vertex arrays of its parts
+    """
+    nsegments = len(Measures) - 1
+    segments = [[] for i in range(nsegments)]
+    offset = 0.0
+    for xy in Parts:
+        seglen = np.hypot(np.diff(xy[:, 0]), np.diff(xy[:, 1]))
+        cum = offset + np.concatenate(([0.0], np.cumsum(seglen)))
+        part_end = cum[-1]
+
+        # segments overlapping this part, and their cut measures clipped to the part
+        first = max(np.searchsorted(Measures, offset, side="right") - 1, 0)
+        last = min(np.searchsorted(Measures, part_end, side="left"), nsegments)
+        m_from = np.clip(Measures[first:last], offset, part_end)
+        m_to = np.clip(Measures[first + 1:last + 1], offset, part_end)
+
+        # cut points, interpolated on the vertex segment holding each measure
+        def interpolate(m):
+            idx = np.clip(np.searchsorted(cum, m, side="right") - 1, 0, len(cum) - 2)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.where(seglen[idx] > 0, (m - cum[idx]) / seglen[idx], 0.0)
+            return xy[idx] + t[:, np.newaxis] * (xy[idx + 1] - xy[idx])
+        pts_from = interpolate(m_from)
+        pts_to = interpolate(m_to)
+        inner_lo = np.searchsorted(cum, m_from, side="right")
+        inner_hi = np.searchsorted(cum, m_to, side="left")
+
+        for j in range(len(m_from)):
+            if m_to[j] <= m_from[j]:
+                continue
+            segments[first + j].append(np.vstack((pts_from[j], xy[inner_lo[j]:inner_hi[j]], pts_to[j])))
+        offset = part_end
+    return segments
+
+
 def SLEM(Line, Distance, Output, TF):
-    
-    CopyLine = arcpy.CopyFeatures_management(Line, r"in_memory\CopyLine")
-    
-    fieldnames = [f.name for f in arcpy.ListFields(CopyLine)]
-
-    #/identification of the polyline type : raw, UGOs, sequenced UGOs, or AGOs
-    k = 0
-    if "Rank_AGO" in fieldnames :
-        k = 3
-    elif "Order_ID" in fieldnames :
-        k = 2
-    elif "Rank_UGO" in fieldnames :
-        k = 1
-            
-
-    ################################
-    ########## Raw polyline ########
-    ################################
-    if k == 0 :
-        
-        #/shaping of the segmented result
-        arcpy.AddField_management(CopyLine, "Rank_UGO", "LONG", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-        arcpy.CalculateField_management(CopyLine, "Rank_UGO", "!"+fieldnames[0]+"!", "PYTHON_9.3", "")
-        arcpy.AddField_management(CopyLine, "From_Measure", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-        arcpy.CalculateField_management(CopyLine, "From_Measure", "0", "PYTHON_9.3", "")
-        arcpy.AddField_management(CopyLine, "To_Measure", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-        arcpy.CalculateField_management(CopyLine, "To_Measure", "!shape.length!", "PYTHON_9.3", "")
-        
-        #/conversion in routes
-        LineRoutes = arcpy.CreateRoutes_lr(CopyLine, "Rank_UGO", r"in_memory\LineRoutes", "TWO_FIELDS", "From_Measure", "To_Measure")
-
-        #/creation of the event table
-        PointEventTEMP = arcpy.CreateTable_management("in_memory", "PointEventTEMP", "", "")
-        arcpy.AddField_management(PointEventTEMP, "Rank_UGO", "LONG", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-        arcpy.AddField_management(PointEventTEMP, "Distance", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-        arcpy.AddField_management(PointEventTEMP, "To_M", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-        
-        UPD_SL.UpToDateShapeLengthField(LineRoutes)
-
-        rowslines = arcpy.SearchCursor(LineRoutes)
-        rowsevents = arcpy.InsertCursor(PointEventTEMP)
-        for line in rowslines:
-            tempdistance = float(line.Shape_Length)
-            while (tempdistance > float(0)):
-                row = rowsevents.newRow()
-                row.Rank_UGO = line.Rank_UGO
-                row.To_M = max(0, tempdistance - float(Distance))
-                row.Distance = tempdistance
-                rowsevents.insertRow(row)
-                tempdistance = tempdistance - float(Distance)
-        del rowslines
-        del rowsevents
-
-        #/creation of the route event layer
-        MakeRouteEventTEMP = arcpy.MakeRouteEventLayer_lr(LineRoutes, "Rank_UGO", PointEventTEMP,
-                                                         "Rank_UGO LINE Distance To_M",
-                                                         r"in_memory\MakeRouteEventTEMP")
-        Split = arcpy.CopyFeatures_management(MakeRouteEventTEMP, r"in_memory\Split", "", "0", "0", "0")
-        Sort = arcpy.Sort_management(Split, Output, [["Rank_UGO", "ASCENDING"], ["Distance", "ASCENDING"]])
-
-        arcpy.DeleteField_management(Sort, "To_M")
-        
-        #/calculation of the "Distance" field
-        UPD_SL.UpToDateShapeLengthField(Sort)
-        
-        rows1 = arcpy.UpdateCursor(Sort)
-        rows2 = arcpy.UpdateCursor(Sort)
-        line2 = rows2.next()
-        line2.Distance = 0
-        rows2.updateRow(line2)
-        nrows = int(str(arcpy.GetCount_management(Sort)))
-        n = 0
-        for line1 in rows1 :
-            line2 = rows2.next()          
-            if n == nrows-1 :
-                break
-            if n == 0 :
-                line1.Distance = 0
-            if line2.Rank_UGO == line1.Rank_UGO :
-                line2.Distance = line1.Distance + line1.Shape_Length
-                rows2.updateRow(line2)
-            if line2.Rank_UGO != line1.Rank_UGO :
-                line2.Distance = 0
-                rows2.updateRow(line2)
-            
-            n+=1
-        
-        #/deleting of the temporary files
-        if str(TF) == "true" :
-            arcpy.Delete_management(Split)
-            arcpy.Delete_management(CopyLine)
-            arcpy.Delete_management(LineRoutes)
-            arcpy.Delete_management(PointEventTEMP)
-    
-    return Sort
\ No newline at end of file
+    """Splits each line into segments of a user-defined length (Distance, in map units), with the
+    remainder at the upstream end. Output segments are sorted by Rank_UGO (the line ID) and Distance
+    (the measure of the segment start along its line). TF is kept for compatibility, as no
+    temporary datasets are created."""
+
+    fieldnames = [f.name for f in arcpy.ListFields(Line)]
+    rankField = "Rank_UGO" if "Rank_UGO" in fieldnames else "OID@"
+    spatialRef = arcpy.Describe(Line).spatialReference
+
+    arcpy.CreateFeatureclass_management(os.path.dirname(Output), os.path.basename(Output), "POLYLINE",
+                                        spatial_reference=spatialRef)
+    arcpy.AddField_management(Output, "Rank_UGO", "LONG", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    arcpy.AddField_management(Output, "Distance", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+
+    with arcpy.da.SearchCursor(Line, [rankField, "SHAPE@"]) as rowslines:
+        rows = sorted(rowslines, key=lambda row: row[0])
+    with arcpy.da.InsertCursor(Output, ["SHAPE@", "Rank_UGO", "Distance"]) as rowsevents:
+        for rank, shape in rows:
+            if shape is None:
+                continue
+            parts = LineParts(shape)
+            if not parts:
+                continue
+            length = PartsLength(parts)
+            if length <= 0:
+                continue
+            measures = SplitMeasures(length, Distance)
+            for m_from, segment in zip(measures[:-1], SplitParts(parts, measures)):
+                if not segment:
+                    continue
+                rowsevents.insertRow((PartsToPolyline(segment, spatialRef), rank, float(m_from)))
+
+    UPD_SL.UpToDateShapeLengthField(Output)
+
+    return Output
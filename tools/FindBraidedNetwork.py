@@ -19,22 +19,69 @@
 # Import modules
 import sys
 import arcpy
+from lib import gis_tools, graph_tools
 
+tolerance = 0.001 ## Distance within which reach end points are connected
 
-def main(fcStreamNetwork):
 
+def main(fcStreamNetwork, method="graph"):
+    """
+    Flags braided reaches (reaches that are part of a closed loop) in the IsBraided field.
+    :param fcStreamNetwork: stream network polyline feature class
+    :param method: "graph" finds the reaches that are not bridges of the reach end point graph,
+        "polygon" finds the reaches that share a line segment with the polygonized network
+    """
     # Polyline prep
     listFields = arcpy.ListFields(fcStreamNetwork,"IsBraided")
     if len(listFields) is not 1:
         arcpy.AddField_management(fcStreamNetwork, "IsBraided", "SHORT", "", "", "", "", "NULLABLE")
-    arcpy.CalculateField_management(fcStreamNetwork,"IsBraided",0,"PYTHON")
 
     # Process
-    findBraidedReaches(fcStreamNetwork)
+    if method == "polygon":
+        arcpy.CalculateField_management(fcStreamNetwork,"IsBraided",0,"PYTHON")
+        findBraidedReaches(fcStreamNetwork)
+    else:
+        findBraidedReachesGraph(fcStreamNetwork)
 
     return
 
 
+def findBraidedReachesGraph(fcLines):
+
+    # Build the reach end point graph, with end points within the tolerance as one node
+    indexNodes = gis_tools.EndpointIndex(tolerance)
+    listNodes = []
+    listOIDs = []
+    listEdges = []
+
+    def nodeID(pnt):
+        pt = (pnt.X, pnt.Y)
+        listNear = indexNodes.near(pt)
+        if listNear:
+            return listNear[0]
+        node = len(listNodes)
+        listNodes.append(pt)
+        indexNodes.add(pt, node)
+        return node
+
+    with arcpy.da.SearchCursor(fcLines, ["OID@", "SHAPE@"]) as scLines:
+        for oid, shape in scLines:
+            if shape is None:
+                continue
+            listOIDs.append(oid)
+            listEdges.append((nodeID(shape.firstPoint), nodeID(shape.lastPoint)))
+
+    # Braided reaches are all reaches that are not bridges
+    setBridges = graph_tools.find_bridges(len(listNodes), [u for u, v in listEdges], [v for u, v in listEdges])
+    setBraided = set(oid for edge, oid in enumerate(listOIDs) if edge not in setBridges)
+
+    with arcpy.da.UpdateCursor(fcLines, ["OID@", "IsBraided"]) as ucLines:
+        for row in ucLines:
+            row[1] = 1 if row[0] in setBraided else 0
+            ucLines.updateRow(row)
+    return
+
+
 def findBraidedReaches(fcLines):
 
     # Clear temporary data
@@ -18,9 +18,12 @@
 # Import arcpy module
 import os
 import sys
-import itertools
+import time
+import hashlib
+import numpy as np
 import arcpy
 from arcpy.sa import *
+from lib import gis_tools
 
 
 # Set environmental variables
@@ -37,238 +40,302 @@ arcpy.env.overwriteOutput = True
 # 7 - flipped flow direction
 # 8 - other potential errors
 
-
-# Find braided reaches
-def braids(in_network_fc, tmp_network_tbl):
-    arcpy.AddMessage("...braids")
-    in_network_fc_lyr = "in_network_fc_lyr"
-    arcpy.MakeFeatureLayer_management(in_network_fc, in_network_fc_lyr)
-
-    # Set global variables
-    FTR_CODE = 2
-
-    # Create temporary in_memory version of input stream network
-    tmp_network_fc = r"in_memory\tmp_network_fc"
-    #arcpy.FeatureClassToFeatureClass_conversion(in_network_fc_lyr, "in_memory", "tmp_network_fc")
-    arcpy.FeatureClassToFeatureClass_conversion(in_network_fc_lyr, "in_memory", "tmp_network_fc")
-    arcpy.MakeFeatureLayer_management(r"in_memory\tmp_network_fc", "tmp_network_fc_lyr")
-
-    # Select reaches based on "IsBraided" attribute field
-    expr = """"{0}" = {1}""".format("IsBraided", 1)
-    arcpy.SelectLayerByAttribute_management("tmp_network_fc_lyr", "NEW_SELECTION", expr)
-    arcpy.FeatureClassToFeatureClass_conversion("tmp_network_fc_lyr", "in_memory", "braids")
-    arcpy.MakeFeatureLayer_management(r"in_memory\braids", "braids_lyr")
-
-    # Add code values to network table
-    arcpy.AddJoin_management(tmp_network_tbl, "ReachID", "braids_lyr", "ReachID", "KEEP_COMMON")
-    arcpy.CalculateField_management(tmp_network_tbl, "FTR_CODE", FTR_CODE, "PYTHON_9.3")
-    arcpy.RemoveJoin_management(tmp_network_tbl)
-
-    # Clean up
-    arcpy.Delete_management(tmp_network_fc)
-
-    return
-
-
-# Find duplicate reaches
-def duplicates(in_network_fc, tmp_network_tbl):
-    arcpy.AddMessage("...duplicate reaches")
-    in_network_fc_lyr = "in_network_fc_lyr"
-    arcpy.MakeFeatureLayer_management(in_network_fc, in_network_fc_lyr)
-
-    # Set global variables
-    FTR_CODE = 3
-
-    # Create temporary in_memory version of in_network_fc
-    tmp_network_fc = r"in_memory\tmp_network_fc"
-    arcpy.FeatureClassToFeatureClass_conversion(in_network_fc_lyr, "in_memory", "tmp_network_fc")
-    arcpy.AddField_management(tmp_network_fc, "IsDuplicate", "SHORT")
-    arcpy.AddField_management(tmp_network_fc, "Reach_Length", "DOUBLE")
-    arcpy.MakeFeatureLayer_management(tmp_network_fc, "tmp_network_fc_lyr")
-    arcpy.CalculateField_management("tmp_network_fc_lyr", "Reach_Length", "!shape.length@meters!", "PYTHON_9.3" )
-
-    # Find identical reaches based on length field
-    with arcpy.da.SearchCursor("tmp_network_fc_lyr", ["Reach_Length"]) as length_cursor:
-        lengths = [r[0] for r in length_cursor]
-    with arcpy.da.UpdateCursor("tmp_network_fc_lyr", ["Reach_Length", "IsDuplicate"]) as cursor:
-        for row in cursor:
-            if lengths.count(row[0]) > 1:
-                row[1] = 1
-            else:                row[1] = 0
-            cursor.updateRow(row)
-
-    # Select duplicate records
-    expr = """"{0}" = {1}""".format("IsDuplicate", 1)
-    arcpy.SelectLayerByAttribute_management("tmp_network_fc_lyr","NEW_SELECTION", expr)
-    arcpy.FeatureClassToFeatureClass_conversion("tmp_network_fc_lyr", "in_memory", "duplicates_only")
-    arcpy.MakeFeatureLayer_management("in_memory\\duplicates_only", "duplicates_only_lyr")
-
-    # Add feature code values to network table
-    arcpy.AddJoin_management(tmp_network_tbl, "ReachID", "duplicates_only_lyr", "ReachID", "KEEP_COMMON")
-    arcpy.CalculateField_management(tmp_network_tbl, "FTR_CODE", FTR_CODE, "PYTHON_9.3")
-    arcpy.RemoveJoin_management(tmp_network_tbl)
-
-    # Clean up
-    arcpy.Delete_management(tmp_network_fc)
-    arcpy.Delete_management("tmp_network_fc_lyr")
-    arcpy.Delete_management("in_memory\\duplicates_only")
-    arcpy.Delete_management("duplicates_only_lyr")
-
-    return
-
-
-## Find overlapped or crossed segments
-def reach_pairs(in_network_fc, tmp_network_tbl, reach_id):
-    arcpy.AddMessage("...overlapping/crossing reaches")
-    in_network_fc_lyr = "in_network_fc_lyr"
-    arcpy.MakeFeatureLayer_management(in_network_fc, in_network_fc_lyr)
-
-    # Create a list with reach ID and associated upstream ID
-    field_name_list = ['ReachID', 'UpstreamID', 'FTR_CODE']
-    with arcpy.da.SearchCursor(tmp_network_tbl, field_name_list) as scursor:
-        for srow in scursor:
-            reach_pair = [srow[0], srow[1]]
-
-            # Select reach and its upstream buddy
-            expr = """"{0}" = {1} or "{0}" = {2}""".format("ReachID", reach_pair[0], reach_pair[1])
-            arcpy.SelectLayerByAttribute_management(in_network_fc_lyr, "NEW_SELECTION", expr)
-            arcpy.CopyFeatures_management(in_network_fc_lyr, r"in_memory\sel_rch")
-            arcpy.MakeFeatureLayer_management(r"in_memory\sel_rch", "sel_rch_lyr")
-            #arcpy.FeatureClassToFeatureClass_conversion("sel_rch_lyr", r"C:\JL\Testing\GNAT\BuildNetworkTopology\YF.gdb", "sel_rch")
-
-            result_cross = cross("sel_rch_lyr")
-            result_overlap = overlap("sel_rch_lyr")
-
-            # Update record in network table
-            if result_overlap != 0:
-                with arcpy.da.UpdateCursor(tmp_network_tbl, ["ReachID", "FTR_CODE"], expr) as ucursor:
-                    for urow in ucursor:
-                        urow[1] = result_overlap
-                        ucursor.updateRow(urow)
-            elif result_cross != 0:
-                with arcpy.da.UpdateCursor(tmp_network_tbl, ["ReachID", "FTR_CODE"], expr) as ucursor:
-                    for urow in ucursor:
-                        urow[1] = result_cross
-                        ucursor.updateRow(urow)
-            else:
-                with arcpy.da.UpdateCursor(tmp_network_tbl, ["ReachID", "FTR_CODE"], expr) as ucursor:
-                    for urow in ucursor:
-                        if urow[1] != 0:
-                            pass
-                        else:
-                            urow[1] = 0
-                            ucursor.updateRow(urow)
-
-            # Clean up
-            del urow, ucursor
-            arcpy.Delete_management("sel_rch_lyr")
-            arcpy.Delete_management("in_memory\sel_rch")
-
-    return
-
-
-def overlap(tmp_network_fc):
-    # Set global constant
-    FTR_CODE = 4
-
-    with arcpy.da.SearchCursor(tmp_network_fc, ['ReachID', 'SHAPE@']) as cursor:
-        for r1,r2 in itertools.combinations(cursor, 2):
-            if r1[1].overlaps(r2[1]):
-                return FTR_CODE
-            else:
-                return 0
-
-
-def cross(tmp_network_fc):
-    # Set global constant
-    FTR_CODE = 5
-
-    with arcpy.da.SearchCursor(tmp_network_fc, ['ReachID', 'SHAPE@']) as cursor:
-        for r1,r2 in itertools.combinations(cursor, 2):
-            if r1[1].crosses(r2[1]):
-                return FTR_CODE
-            else:
-                return 0
-
-
-# Disconnected reaches
-def disconnected(in_network_fc, tmp_network_tbl):
-    arcpy.AddMessage("...disconnected reaches")
-
-    FTR_CODE = 6
-
-    in_network_fc_lyr = "in_network_fc_lyr"
-    arcpy.MakeFeatureLayer_management(in_network_fc, in_network_fc_lyr)
-
-    # join topology table to stream network feature class, and select reaches not found in the topology table
-    arcpy.AddJoin_management(in_network_fc_lyr, "ReachID", tmp_network_tbl, "ReachID", "KEEP_ALL")
-    for field in arcpy.ListFields(in_network_fc_lyr, "*UpstreamID"):
-        upstream_field = field.name
-    expr = """"{0}" IS NOT NULL""".format(upstream_field)
-    arcpy.SelectLayerByAttribute_management(in_network_fc_lyr, "NEW_SELECTION", expr)
-    arcpy.SelectLayerByAttribute_management(in_network_fc_lyr, "SWITCH_SELECTION")
-    arcpy.RemoveJoin_management(in_network_fc_lyr)
-
-    # copy selected reaches to a temporary table and append to tmp_network_tbl
-    arcpy.CopyRows_management(in_network_fc_lyr, r"in_memory\disconnected_reaches")
-    arcpy.MakeTableView_management(r"in_memory\disconnected_reaches", "disconnected_view")
-    arcpy.AddField_management("disconnected_view", "UpstreamID", "LONG")
-    arcpy.AddField_management("disconnected_view", "TO_NODE", "DOUBLE")
-    arcpy.AddField_management("disconnected_view", "FROM_NODE", "DOUBLE")
-    arcpy.AddField_management("disconnected_view", "FTR_CODE", "SHORT")
-    with arcpy.da.SearchCursor("disconnected_view", ["ReachID", "UpstreamID", "TO_NODE", "FROM_NODE", "FTR_CODE"]) as scursor:
-        with arcpy.da.InsertCursor(tmp_network_tbl, ["ReachID", "UpstreamID", "TO_NODE", "FROM_NODE", "FTR_CODE"]) as icursor:
-            for srow in scursor:
-                icursor.insertRow(srow)
-
-    arcpy.SelectLayerByAttribute_management(tmp_network_tbl, "NEW_SELECTION", """"UpstreamID" IS NULL""")
-    with arcpy.da.UpdateCursor(tmp_network_tbl, ["FTR_CODE"]) as ucursor:
-        for urow in ucursor:
-            if urow[0] == None:
-                urow[0] = FTR_CODE
-                ucursor.updateRow(urow)
-        #del urow, ucursor
-
-    # clean up
-    arcpy.SelectLayerByAttribute_management(tmp_network_tbl, "CLEAR_SELECTION")
-    arcpy.SelectLayerByAttribute_management(in_network_fc_lyr, "CLEAR_SELECTION")
-
-
-# Find flow direction errors
-def flow_direction(tmp_network_tbl):
-    arcpy.AddMessage("...flow direction")
-
-    FTR_CODE = 7
-
-    upstream_fields = ["UpstreamID","FROM_NODE","TO_NODE"]
-    val_dict = {r[0]:(r[1:]) for r in arcpy.da.SearchCursor(tmp_network_tbl, upstream_fields)}
-    update_fields = ["OID@","ReachID","UpstreamID","FROM_NODE","FTR_CODE"]
-
-    with arcpy.da.UpdateCursor(tmp_network_tbl, update_fields) as ucursor:
-        for urow in ucursor:
-            key_val = urow[1]
-            if key_val in val_dict:
-                if urow[1] != val_dict[key_val]:
-                    if urow[3] == val_dict[key_val][0]:
-                        urow[4] = FTR_CODE
-                        ucursor.updateRow(urow)
-    return
-
-
-# find potential miscellaneous errors
-def other_errors(tmp_network_tbl):
-    arcpy.AddMessage("...other potential issues")
-
-    # Set global variables
-    FTR_CODE = 8
-
-    # Select records UpstreamID == -11111
-    expr = """"{0}" = {1}""".format("UpstreamID", -11111)
-    arcpy.SelectLayerByAttribute_management(tmp_network_tbl,"NEW_SELECTION", expr)
-
-    # Add code values to network table
-    arcpy.CalculateField_management(tmp_network_tbl, "FTR_CODE", FTR_CODE, "PYTHON_9.3")
-    arcpy.SelectLayerByAttribute_management(tmp_network_tbl, "CLEAR_SELECTION")
+tolerance = 0.001 # distance within which vertices and segments are treated as identical or touching
+
+
+# Quantized vertex coordinates of a reach, used to compare geometries
+def vertex_array(shape, tolerance):
+    coords = []
+    for part in shape:
+        for pnt in part:
+            if pnt:
+                coords.append((int(round(pnt.X / tolerance)), int(round(pnt.Y / tolerance))))
+        coords.append(None) # part separator
+    return coords
+
+
+# Fingerprint of a reach geometry that is the same for a reach and its reversed copy
+def geometry_fingerprint(shape, tolerance):
+    forward = vertex_array(shape, tolerance)
+    backward = forward[-2::-1] + [None]
+    digest_fwd = hashlib.sha1(repr(forward)).digest()
+    digest_bwd = hashlib.sha1(repr(backward)).digest()
+    return min(digest_fwd, digest_bwd)
+
+
+# Line segments of a reach as an array of (x0, y0, x1, y1) rows
+def segment_array(shape):
+    segments = []
+    for part in shape:
+        pnts = [(pnt.X, pnt.Y) for pnt in part if pnt]
+        for (x0, y0), (x1, y1) in zip(pnts[:-1], pnts[1:]):
+            if x0 != x1 or y0 != y1:
+                segments.append((x0, y0, x1, y1))
+    return np.array(segments, dtype=np.float64).reshape(-1, 4)
+
+
+# Segments that fall within an extent (xmin, ymin, xmax, ymax)
+def segments_in_extent(segments, extent):
+    keep = (np.minimum(segments[:, 0], segments[:, 2]) <= extent[2]) & \
+           (np.maximum(segments[:, 0], segments[:, 2]) >= extent[0]) & \
+           (np.minimum(segments[:, 1], segments[:, 3]) <= extent[3]) & \
+           (np.maximum(segments[:, 1], segments[:, 3]) >= extent[1])
+    return segments[keep]
+
+
+# Side of each point relative to each segment: -1, 1, or 0 if within the tolerance of the segment line
+def side(x0, y0, dx, dy, seg_len, px, py, tolerance):
+    cross = dx * (py - y0) - dy * (px - x0)
+    return np.where(np.abs(cross) <= tolerance * seg_len, 0, np.sign(cross))
+
+
+# Vertices where two consecutive segments of a reach meet, as (x_prev, y_prev, x, y, x_next, y_next) rows
+def segment_joints(segments):
+    joined = (segments[:-1, 2] == segments[1:, 0]) & (segments[:-1, 3] == segments[1:, 1])
+    return np.hstack((segments[:-1][joined], segments[1:][joined][:, 2:]))
+
+
+# True if a reach passes through a segment of another reach at one of its vertices, with the
+# segments before and after the vertex on opposite sides of the other segment
+def joint_crosses_segment(joints, segments, tolerance):
+    jpx, jpy, jx, jy, jnx, jny = [joints[:, i][:, np.newaxis] for i in range(6)]
+    x0, y0, x1, y1 = [segments[:, i][np.newaxis, :] for i in range(4)]
+    dx, dy = x1 - x0, y1 - y0
+    seg_len = np.hypot(dx, dy)
+    on_line = side(x0, y0, dx, dy, seg_len, jx, jy, tolerance) == 0
+    t = ((jx - x0) * dx + (jy - y0) * dy) / seg_len
+    inside = (t > tolerance) & (t < seg_len - tolerance)
+    opposite = side(x0, y0, dx, dy, seg_len, jpx, jpy, tolerance) * \
+               side(x0, y0, dx, dy, seg_len, jnx, jny, tolerance) == -1
+    return (on_line & inside & opposite).any()
+
+
+# True if two reaches pass through a shared vertex, each from one side of the other to the
+# opposite side. The rays to the previous and next vertex of one reach divide the plane in two,
+# and the reaches cross when the rays of the other reach fall on different sides.
+def joints_cross(joints_a, joints_b, tolerance):
+    for jpx, jpy, jx, jy, jnx, jny in joints_a:
+        near = np.hypot(joints_b[:, 2] - jx, joints_b[:, 3] - jy) <= tolerance
+        if not near.any():
+            continue
+        angle_prev = np.arctan2(jpy - jy, jpx - jx)
+        angle_next = (np.arctan2(jny - jy, jnx - jx) - angle_prev) % (2 * np.pi)
+        for row in joints_b[near]:
+            angles = (np.arctan2(row[[1, 5]] - jy, row[[0, 4]] - jx) - angle_prev) % (2 * np.pi)
+            # rays of the other reach along a ray of this reach touch, rather than cross
+            if np.isclose(angles, 0).any() or np.isclose(angles, 2 * np.pi).any() or \
+                    np.isclose(angles, angle_next).any():
+                continue
+            between = (angles > 0) & (angles < angle_next)
+            if between[0] != between[1]:
+                return True
+    return False
+
+
+# Compares every segment of one reach to every segment of another reach
+def segment_relation(seg_a, seg_b, tolerance):
+    ax0, ay0, ax1, ay1 = [seg_a[:, i][:, np.newaxis] for i in range(4)]
+    bx0, by0, bx1, by1 = [seg_b[:, i][np.newaxis, :] for i in range(4)]
+    adx, ady = ax1 - ax0, ay1 - ay0
+    bdx, bdy = bx1 - bx0, by1 - by0
+    len_a = np.hypot(adx, ady)
+    len_b = np.hypot(bdx, bdy)
+
+    side_b0 = side(ax0, ay0, adx, ady, len_a, bx0, by0, tolerance)
+    side_b1 = side(ax0, ay0, adx, ady, len_a, bx1, by1, tolerance)
+
+    # overlap: segment of b lies on the line of a segment of a, and shares a length of it
+    collinear = (side_b0 == 0) & (side_b1 == 0)
+    if collinear.any():
+        t0 = ((bx0 - ax0) * adx + (by0 - ay0) * ady) / len_a
+        t1 = ((bx1 - ax0) * adx + (by1 - ay0) * ady) / len_a
+        shared = np.minimum(np.maximum(t0, t1), len_a) - np.maximum(np.minimum(t0, t1), 0)
+        if (collinear & (shared > tolerance)).any():
+            return 4
+
+    # cross: the segment interiors intersect at a single point
+    side_a0 = side(bx0, by0, bdx, bdy, len_b, ax0, ay0, tolerance)
+    side_a1 = side(bx0, by0, bdx, bdy, len_b, ax1, ay1, tolerance)
+    if ((side_b0 * side_b1 == -1) & (side_a0 * side_a1 == -1)).any():
+        return 5
+
+    # cross at a vertex: the vertex of one reach is on the interior of a segment of the other
+    # reach, or is a vertex of both reaches
+    joints_a = segment_joints(seg_a)
+    joints_b = segment_joints(seg_b)
+    if len(joints_a) and joint_crosses_segment(joints_a, seg_b, tolerance):
+        return 5
+    if len(joints_b) and joint_crosses_segment(joints_b, seg_a, tolerance):
+        return 5
+    if len(joints_a) and len(joints_b) and joints_cross(joints_a, joints_b, tolerance):
+        return 5
+    return 0
+
+
+
+class NetworkScanner(object):
+    """Loads the stream network and its topology table into memory once, and finds all of
+    the network features and issues from the shared data."""
+
+    def __init__(self, in_network_fc, in_network_table):
+        self.in_network_fc = in_network_fc
+        self.in_network_table = in_network_table
+        self.reach_ids = [] ## Reaches in the network feature class
+        self.reach_braided = set() ## Reaches with IsBraided = 1
+        self.reach_fingerprints = {} ## Reach geometry fingerprints
+        self.reach_segments = {} ## Reach line segments
+        self.reach_extents = [] ## Reach bounding boxes, padded by the tolerance
+        self.rows = [] ## Topology table rows: ReachID, UpstreamID, FROM_NODE, TO_NODE
+        self.codes = [] ## Feature code of each topology table row
+        self.timings = [] ## (check, seconds)
+
+    def timed(self, label, check):
+        start = time.time()
+        check()
+        elapsed = time.time() - start
+        self.timings.append((label, elapsed))
+        arcpy.AddMessage("...{0} ({1:.2f} s)".format(label, elapsed))
+        return
+
+    def run(self):
+        self.timed("loading network", self.load)
+        self.timed("flow direction", self.flow_direction)
+        self.timed("braids", self.braids)
+        self.timed("duplicate reaches", self.duplicates)
+        self.timed("overlapping/crossing reaches", self.reach_pairs)
+        self.timed("disconnected reaches", self.disconnected)
+        self.timed("other potential issues", self.other_errors)
+        return self
+
+    # Read the network and the topology table
+    def load(self):
+        with arcpy.da.SearchCursor(self.in_network_fc, ["ReachID", "IsBraided", "SHAPE@"]) as cursor:
+            for reach, is_braided, shape in cursor:
+                self.reach_ids.append(reach)
+                if is_braided == 1:
+                    self.reach_braided.add(reach)
+                if shape is None:
+                    continue
+                self.reach_fingerprints[reach] = geometry_fingerprint(shape, tolerance)
+                segments = segment_array(shape)
+                if len(segments) == 0:
+                    continue
+                self.reach_segments[reach] = segments
+                ext = shape.extent
+                self.reach_extents.append((reach, (ext.XMin - tolerance, ext.YMin - tolerance,
+                                                   ext.XMax + tolerance, ext.YMax + tolerance)))
+
+        table_fields = ["ReachID", "UpstreamID", "FROM_NODE", "TO_NODE"]
+        has_code = len(arcpy.ListFields(self.in_network_table, "FTR_CODE")) == 1
+        if has_code:
+            table_fields.append("FTR_CODE")
+        with arcpy.da.SearchCursor(self.in_network_table, table_fields) as cursor:
+            for row in cursor:
+                self.rows.append(row[:4])
+                self.codes.append(row[4] if has_code and row[4] is not None else 0)
+        return
+
+    def set_codes(self, dict_codes):
+        """Sets the feature code of all rows for each reach in a dictionary of ReachID: code"""
+        if dict_codes:
+            for i, row in enumerate(self.rows):
+                if row[0] in dict_codes:
+                    self.codes[i] = dict_codes[row[0]]
+        return
+
+    # Find flow direction errors
+    def flow_direction(self):
+        FTR_CODE = 7
+        # FROM_NODE of the downstream reach, for each upstream reach
+        val_dict = dict((row[1], row[2:]) for row in self.rows)
+        for i, row in enumerate(self.rows):
+            if row[0] in val_dict and row[2] == val_dict[row[0]][0]:
+                self.codes[i] = FTR_CODE
+        return
+
+    # Find braided reaches
+    def braids(self):
+        FTR_CODE = 2
+        self.set_codes(dict.fromkeys(self.reach_braided, FTR_CODE))
+        return
+
+    # Find duplicate reaches. Exact and reversed duplicates share a fingerprint.
+    def duplicates(self):
+        FTR_CODE = 3
+        dict_groups = {}
+        for reach, key in self.reach_fingerprints.iteritems():
+            dict_groups.setdefault(key, []).append(reach)
+        dict_codes = {}
+        for reach_ids in dict_groups.itervalues():
+            if len(reach_ids) > 1:
+                dict_codes.update(dict.fromkeys(reach_ids, FTR_CODE))
+        self.set_codes(dict_codes)
+        return
+
+    ## Find overlapped or crossed segments
+    def reach_pairs(self):
+        if not self.reach_extents:
+            return
+        # grid cells sized to the average reach extent
+        cell_size = max(sum(max(e[2] - e[0], e[3] - e[1]) for r, e in self.reach_extents) /
+                        len(self.reach_extents), tolerance)
+        index = gis_tools.BoundingBoxIndex(cell_size)
+        for reach, extent in self.reach_extents:
+            index.add(extent, reach)
+
+        # Test candidate pairs. Overlap takes precedence over crossing, and duplicate reaches
+        # are left with the duplicate code.
+        fingerprints = self.reach_fingerprints
+        dict_codes = {}
+        for reach_a, reach_b in index.pairs():
+            if fingerprints[reach_a] == fingerprints[reach_b]:
+                continue
+            seg_a = segments_in_extent(self.reach_segments[reach_a], index.extents[reach_b])
+            seg_b = segments_in_extent(self.reach_segments[reach_b], index.extents[reach_a])
+            if len(seg_a) == 0 or len(seg_b) == 0:
+                continue
+            result = segment_relation(seg_a, seg_b, tolerance)
+            if result != 0:
+                for reach in (reach_a, reach_b):
+                    if dict_codes.get(reach) != 4:
+                        dict_codes[reach] = result
+        self.set_codes(dict_codes)
+        return
+
+    # Disconnected reaches, which are not in the topology table, are added to it
+    def disconnected(self):
+        FTR_CODE = 6
+        set_table_reaches = set(row[0] for row in self.rows)
+        for reach in self.reach_ids:
+            if reach not in set_table_reaches:
+                set_table_reaches.add(reach)
+                self.rows.append((reach, None, None, None))
+                self.codes.append(FTR_CODE)
+        return
+
+    # find potential miscellaneous errors
+    def other_errors(self):
+        FTR_CODE = 8
+        for i, row in enumerate(self.rows):
+            if row[1] == -11111:
+                self.codes[i] = FTR_CODE
+        return
+
+    def write(self, out_table):
+        """Writes the reaches with a feature code to the output table"""
+        tmp_table = r"in_memory\network_features"
+        if arcpy.Exists(tmp_table):
+            arcpy.Delete_management(tmp_table)
+        arcpy.CreateTable_management("in_memory", "network_features")
+        arcpy.AddField_management(tmp_table, "ReachID", "LONG")
+        arcpy.AddField_management(tmp_table, "FTR_CODE", "LONG")
+        with arcpy.da.InsertCursor(tmp_table, ["ReachID", "FTR_CODE"]) as icursor:
+            for row, code in zip(self.rows, self.codes):
+                if code > 0:
+                    icursor.insertRow((row[0], code))
+        arcpy.CopyRows_management(tmp_table, out_table)
+        arcpy.Delete_management(tmp_table)
+        return
 
 
 def main(in_network_fc, in_network_table, outflow_id):
@@ -285,46 +352,16 @@ def main(in_network_fc, in_network_table, outflow_id):
     for obj in field_objects:
         input_fields.append(obj.name)
     if set(req_fields) < set(input_fields):
-        # Create temporary, in_memory version of stream network table
-        if arcpy.Exists("in_network_fc"):
-            arcpy.Delete_management("in_network_fc")
-        if arcpy.Exists("in_network_table"):
-            arcpy.Delete_management("in_network_table")
-        if arcpy.Exists("tmp_memory_table"):
-            arcpy.Delete_management("tmp_memory_table")
-        arcpy.MakeTableView_management(in_network_table, "in_network_table_view")
-        arcpy.CopyRows_management("in_network_table_view", r"in_memory\tmp_network_table")
-        arcpy.MakeTableView_management(r"in_memory\tmp_network_table", "tmp_network_table_view")
-
-        # Add required fields
-        code_field = arcpy.ListFields("tmp_network_table_view", "FTR_CODE")
-        if len(code_field) != 1:
-            arcpy.AddField_management("tmp_network_table_view", "FTR_CODE", "LONG")
-            arcpy.CalculateField_management("tmp_network_table_view", "FTR_CODE", "0", "PYTHON_9.3")
-
         # Find network features and issues
-        flow_direction("tmp_network_table_view")
-        braids(in_network_fc, "tmp_network_table_view")
-        duplicates(in_network_fc, "tmp_network_table_view")
-        reach_pairs(in_network_fc, "tmp_network_table_view", outflow_id)
-        disconnected(in_network_fc, "tmp_network_table_view")
-        other_errors("tmp_network_table_view")
-
-        # Clean up and write final output table
-        oid_field = arcpy.Describe("tmp_network_table_view").OIDFieldName
-        keep_fields = [oid_field, "ReachID", "FTR_CODE"]
-        list_obj = arcpy.ListFields("tmp_network_table_view")
-        tmp_field_names = [f.name for f in list_obj]
-        for field_name in tmp_field_names:
-            if field_name not in keep_fields:
-                arcpy.DeleteField_management("tmp_network_table_view", field_name)
-        expr = """"{0}" > {1}""".format("FTR_CODE", "0")
-        arcpy.SelectLayerByAttribute_management("tmp_network_table_view", "NEW_SELECTION", expr)
+        scanner = NetworkScanner(in_network_fc, in_network_table).run()
+        arcpy.AddMessage("...total ({0:.2f} s)".format(sum(t for c, t in scanner.timings)))
+
+        # Write final output table
         if wspace_type == "Folder":
-            arcpy.CopyRows_management("tmp_network_table_view", wspace_path + "\NetworkFeatures.dbf")
+            scanner.write(wspace_path + "\NetworkFeatures.dbf")
         elif wspace_type == "Workspace":
-            arcpy.CopyRows_management("tmp_network_table_view", wspace_path + "\NetworkFeatures")
+            scanner.write(wspace_path + "\NetworkFeatures")
     else:
         arcpy.AddError(in_network_fc + " does not include required attribute fields. Please use the feature class " \
                                      "produced by the Build Network Topology Table tool.")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
@@ -42,8 +42,8 @@ def find_errors(theNetwork, G):
     :return:
     """
     net_ids = theNetwork.attribute_as_list(G, "_netid_")
-    # iterate through list of network IDs generate attributes, and produce a subnetwork graph
-    list_subnets = []
+    # iterate through list of network IDs and find errors. Subnetwork graphs share edge data
+    # with G, so the error attributes are written to G in place.
     for id in net_ids:
         arcpy.AddMessage("Finding errors for subnet {0}...".format(id))
         subnet_G = theNetwork.select_by_attribute(G, "_netid_", id)
@@ -51,22 +51,21 @@ def find_errors(theNetwork, G):
         outflow_G = theNetwork.error_outflow(subnet_G)
         conf_G = theNetwork.error_confluence(subnet_G)
         # merge all error graphs
-        error_G = nx.compose_all([subnet_G, duplicates_G, conf_G, outflow_G])
-        list_subnets.append(error_G)
+        theNetwork.merge_edge_data(subnet_G, duplicates_G, conf_G, outflow_G)
         arcpy.AddMessage("Subnetwork #{} complete...".format(id))
 
-    # Union all subnetwork graphs
-    union_G = nx.union_all(list_subnets)
-    if theNetwork.check_attribute(union_G, "_edgetype_"):
-        theNetwork.delete_attribute(union_G, "_edgetype_")
-    return union_G
+    if theNetwork.check_attribute(G, "_edgetype_"):
+        theNetwork.delete_attribute(G, "_edgetype_")
+    return G
 
 
-def main(in_shp, out_shp, bool_error=False):
+def main(in_shp, out_shp, bool_error=False, bool_repair=False):
     """
     The main processing module for the Find Subnetworks tool.
     :param in_shp: Stream network polyline feature class.
     :param out_workspace: Directory where tool output will be stored
+    :param bool_error: if True, potential topology errors are attributed
+    :param bool_repair: if True, stream features that flow away from the subnetwork outflow are reversed
     """
     arcpy.AddMessage("FSN: Finding and labeling subnetworks...")
     # remove GNAT fields if present
@@ -75,20 +74,31 @@ def main(in_shp, out_shp, bool_error=False):
             arcpy.AddMessage("FSN: Deleting and replacing existing GNAT fields...")
             arcpy.DeleteField_management(in_shp, f.name)
 
-    # calculate network ID
-    theNetwork = net.Network(in_shp)
-    list_SG = theNetwork.get_subgraphs()
-    id_G = theNetwork.calc_network_id(list_SG)
+    # calculate network ID. Without repair or error checks, the network is labelled and written
+    # from the columnar edge store, without building a networkx graph.
+    backend = "networkx" if bool_error or bool_repair else "columnar"
+    theNetwork = net.Network(in_shp, backend=backend, geometry="lazy", cache=True)
+    id_G = theNetwork.label_subnetworks()
+
+    # repair flow direction
+    if bool_repair:
+        arcpy.AddMessage("FSN: Repairing flow direction...")
+        flipped = theNetwork.repair_flow(id_G)
+        arcpy.AddMessage("FSN: Reversed {0} stream features".format(len(flipped)))
+        if flipped:
+            arcpy.AddMessage("FSN: FIDs of reversed features: {0}".format(", ".join(str(x) for x in sorted(flipped))))
 
     # find topology errors
     if bool_error:
         arcpy.AddMessage("FSN: Finding network topology errors...")
         error_G = find_errors(theNetwork, id_G)
         final_G = error_G
+    elif id_G is None:
+        final_G = theNetwork.store
     else:
         final_G = id_G
 
-    arcpy.AddMessage("FSN: Writing networkx graph to shapefile...")
+    arcpy.AddMessage("FSN: Writing network to shapefile...")
     theNetwork._nx_to_shp(final_G, out_shp, bool_node = False)
 
     return
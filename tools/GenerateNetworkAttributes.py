@@ -47,7 +47,7 @@ def main(in_shp, field_name, out_shp, riverkm_bool=False):
     arcpy.AddMessage("GNA: Generating network attributes...")
     arcpy.AddMessage("GNA: Converting shapefile to a NetworkX graph...")
     #prep_shp = prep_network(in_shp, temp_workspace)
-    theNetwork = net.Network(in_shp)
+    theNetwork = net.Network(in_shp, cache=True)
     arcpy.AddMessage("GNA: Getting list of network IDs...")
 
     if theNetwork.check_attribute(theNetwork.G, netid):
@@ -60,8 +60,8 @@ def main(in_shp, field_name, out_shp, riverkm_bool=False):
     if theNetwork.check_attribute(theNetwork.G, edgetype):
         theNetwork.delete_attribute(theNetwork.G, edgetype)
 
-    # iterate through list of network IDs generate attributes, and produce a subnetwork graph
-    list_subnets = []
+    # iterate through list of network IDs and generate attributes. Subnetwork graphs share edge
+    # data with theNetwork.G, so the attributes are written to the network in place.
     for id in net_ids:
         subnet_G = theNetwork.select_by_attribute(theNetwork.G, netid, id)
         theNetwork.add_attribute(subnet_G, edgetype, "connector")
@@ -85,13 +85,8 @@ def main(in_shp, field_name, out_shp, riverkm_bool=False):
             arcpy.AddMessage("GNA: Calculating river kilometers...")
             theNetwork.calculate_river_km(gnat_G)
 
-        list_subnets.append(gnat_G)
         arcpy.AddMessage("Network ID {0} processed...".format(id))
 
-    # Union all subnetwork graphs
-    arcpy.AddMessage("GNA: Merging all subnetworks...")
-    theNetwork.G = nx.union_all(list_subnets)
-
     arcpy.AddMessage("GNA: Writing to shapefile...")
     theNetwork._nx_to_shp(theNetwork.G, out_shp, bool_node=True)
 
@@ -65,11 +65,12 @@ def dslv_network(in_shp, name_field, temp_wspace):
         arcpy.AddError("{0} attribute field not found in {1}".format("GNIS_Name", os.path.basename(in_shp)))
 
 
-def main(in_shp, name_field, out_shp, temp_wspace):
+def main(in_shp, name_field, out_shp, temp_wspace, shreve_bool=False):
     """Main function to calculate Strahler stream order for an input stream network.
     :param in_shp: Shapefile output, which is the output from Find Subnetworks tool.
     :param temp_wspace: Temporary workspace to store intermediate datasets.
     :param out_shp: Stream network shapefile with stream order attribute field.
+    :param shreve_bool: If True, Shreve stream magnitude is also calculated.
     """
 
     gc.enable()
@@ -95,24 +96,22 @@ def main(in_shp, name_field, out_shp, temp_wspace):
     # Calculate stream order
     arcpy.AddMessage("SO: Calcuating stream order...")
     arcpy.AddMessage("SO: Converting shapefile to a NetworkX graph...")
-    theNetwork = net.Network(attrb_shp)
+    theNetwork = net.Network(attrb_shp, geometry="lazy", fields=[name_field, "_netid_", "_edgetype_"],
+                             cache=True)
 
     # Iterate through subnetworks
     arcpy.AddMessage("SO: Getting list of network IDs...")
     net_ids = theNetwork.attribute_as_list(theNetwork.G, "_netid_")
-    list_subnets = []
     for id in net_ids:
+        # stream order is written in place, through the edge data shared with theNetwork.G
         subnet_G = theNetwork.select_by_attribute(theNetwork.G, "_netid_", id)
-        streamorder_G = theNetwork.streamorder(subnet_G)
-        list_subnets.append(streamorder_G)
-    arcpy.AddMessage("SO: Merging all subnetworks...")
-    theNetwork.G = nx.union_all(list_subnets)
+        theNetwork.streamorder(subnet_G, shreve_bool)
 
     streamorder_shp = "{0}\\{1}".format(temp_wspace, "GNAT_SO_streamorder.shp")
     theNetwork._nx_to_shp(theNetwork.G, streamorder_shp, bool_node=False)
     # Intersect stream order output shapefile with original network shapefile
     fields = arcpy.ListFields(streamorder_shp)
-    keep_fields = [f.name for f in fields if f.type == "OID" or f.type == "Geometry" or f.name == "_strmordr_"]
+    keep_fields = [f.name for f in fields if f.type == "OID" or f.type == "Geometry" or f.name in ("_strmordr_", "_strmmag_")]
     for f in fields:
         if f.name not in keep_fields:
             arcpy.DeleteField_management(streamorder_shp, f.name)
@@ -18,10 +18,14 @@
 
 # # Import Modules # #
 import os
+import sys
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
 import arcpy
 from tools.FCT import def__SLEM as dS
 from lib import ClearInMemory, gis_tools
-from decimal import *
 
 listStrSegMethod = ["Remaining segment at inflow (top) of stream branch",
                     "Remaining segment at outflow (bottom) of stream branch",
@@ -33,19 +37,33 @@ arcpy.env.outputZFlag = "Disabled"
 arcpy.env.overwriteOutput = True
 
 
+def segmentLengths(inputDistance):
+    """Returns the segment lengths as a list of unique floats, from a single length, a list of lengths,
+    or a semicolon delimited string of lengths (i.e. "100;200;500"). Semicolons are the multivalue
+    parameter separator, so commas in the string are decimal separators (i.e. "100,5;200")."""
+    if isinstance(inputDistance, basestring):
+        listValues = [value.replace(",", ".") for value in inputDistance.split(";") if value.strip()]
+    elif isinstance(inputDistance, (list, tuple)):
+        listValues = inputDistance
+    else:
+        listValues = [inputDistance]
+
+    listDistances = []
+    for value in listValues:
+        dblDistance = float(value)
+        if dblDistance <= 0:
+            strError = "Segment length must be greater than zero: {}".format(value)
+            arcpy.AddError(strError)
+            raise ValueError(strError)
+        if dblDistance not in listDistances:
+            listDistances.append(dblDistance)
+    return listDistances
+
+
 def getNetworkNodes(inStreamNetwork, scratchWorkspace="in_memory"):
-    # Preprocess network
-    fcNetworkDissolved = gis_tools.newGISDataset(scratchWorkspace, "GNAT_SO_NetworkDissolved")
-    arcpy.Dissolve_management(inStreamNetwork, fcNetworkDissolved, multi_part="SINGLE_PART",
-                              unsplit_lines="DISSOLVE_LINES")
-
-    fcNetworkIntersectPoints = gis_tools.newGISDataset(scratchWorkspace, "GNAT_SO_NetworkIntersectPoints")
-    arcpy.Intersect_analysis(fcNetworkDissolved, fcNetworkIntersectPoints, "ALL", output_type="POINT")
-    arcpy.AddXY_management(fcNetworkIntersectPoints)
+    # Confluence nodes, from the stream network line end points
     fcNetworkNodes = gis_tools.newGISDataset(scratchWorkspace, "GNAT_SO_NetworkNodes")
-    arcpy.Dissolve_management(fcNetworkIntersectPoints, fcNetworkNodes, ["POINT_X", "POINT_Y"], "#", "SINGLE_PART")
-    del fcNetworkDissolved
-    del fcNetworkIntersectPoints
+    gis_tools.network_nodes(inStreamNetwork, fcNetworkNodes)
     return fcNetworkNodes
 
 def cleanLineGeom(inLine, streamID, segID, lineClusterTolerance):
@@ -148,73 +166,249 @@ def segOptionA(in_hydro, seg_length, outFGB, outSegmentIDField="SegmentID", scra
     return clean_stream
 
 
+def segmentBranches(listBranches, dblDistance, segMethod):
+    """Cuts stream branches at the split measures of the segment length, using NumPy geometry only, so
+    that it can run in a worker process.
+    :param listBranches: list of (vertex arrays of the branch parts, branch length)
+    :param dblDistance: segment length
+    :param segMethod: "Remaining segment at outflow (bottom) of stream branch" or divided remainder method
+    :return: list of segments (each a list of vertex arrays), in branch order, from upstream to downstream
+    """
+    listSegments = []
+    for listParts, dblLength in listBranches:
+        if segMethod == "Remaining segment at outflow (bottom) of stream branch":
+            arrayMeasures = np.arange(0.0, dblLength, dblDistance)
+            arrayMeasures = np.append(arrayMeasures[arrayMeasures < dblLength - dS.tolerance], dblLength)
+        else:
+            # the tolerance keeps exact multiples of the segment length (i.e. 2.1 / 0.7) from losing a segment
+            intNumberOfSegments = max(int((dblLength + dS.tolerance) / dblDistance), 1)
+            arrayMeasures = np.linspace(0.0, dblLength, intNumberOfSegments + 1)
+        listSegments.extend(segment for segment in dS.SplitParts(listParts, arrayMeasures) if segment)
+    return listSegments
+
+
+def readBranches(fcStreamBranch, strWhereClause=None):
+    """Reads the stream branches as a list of (vertex arrays of the branch parts, branch length), skipping
+    empty branches"""
+    listBranches = []
+    with arcpy.da.SearchCursor(fcStreamBranch, ["SHAPE@"], strWhereClause) as scBranches:
+        for row in scBranches:
+            if row[0] is None:
+                continue
+            listParts = dS.LineParts(row[0])
+            dblLength = dS.PartsLength(listParts)
+            if dblLength > 0:
+                listBranches.append((listParts, dblLength))
+    return listBranches
+
+
+def createSegmentsFC(fcSegments, spatialRef, outSegmentIDField, outScaleField=None):
+    """Creates an empty stream segment feature class, with the Segment ID and (optional) segment length fields"""
+    arcpy.CreateFeatureclass_management(os.path.dirname(fcSegments), os.path.basename(fcSegments), "POLYLINE",
+                                        spatial_reference=spatialRef)
+    arcpy.AddField_management(fcSegments, outSegmentIDField, "LONG")
+    if outScaleField:
+        arcpy.AddField_management(fcSegments, outScaleField, "DOUBLE")
+    return fcSegments
+
+
+def writeSegments(listBranches, listDistances, segMethod, listOutputs, spatialRef, outSegmentIDField,
+                  outScaleField=None):
+    """Segments the stream branches at each segment length, and writes the segments of each length to the
+    matching output feature class (outputs can be repeated). Segment IDs are numbered from 1 for each length.
+    :return: list of the number of segments written for each length
+    """
+    listFields = ["SHAPE@", outSegmentIDField]
+    if outScaleField:
+        listFields.append(outScaleField)
+    listCounts = []
+    for dblDistance, fcOutput in zip(listDistances, listOutputs):
+        intSegmentID = 0
+        with arcpy.da.InsertCursor(fcOutput, listFields) as icSegments:
+            for segment in segmentBranches(listBranches, dblDistance, segMethod):
+                intSegmentID += 1
+                rowSegment = [dS.PartsToPolyline(segment, spatialRef), intSegmentID]
+                if outScaleField:
+                    rowSegment.append(dblDistance)
+                icSegments.insertRow(rowSegment)
+        listCounts.append(intSegmentID)
+    return listCounts
+
+
+strWorkerGDB = None ## Scratch file geodatabase of a worker process, set by initSegmentWorker
+
+
+def initSegmentWorker(strScratchFolder):
+    """Worker process initializer. Each worker writes to its own file geodatabase, as a file geodatabase
+    cannot be edited by several processes at once."""
+    global strWorkerGDB
+    strName = "worker_{}.gdb".format(os.getpid())
+    arcpy.CreateFileGDB_management(strScratchFolder, strName)
+    strWorkerGDB = os.path.join(strScratchFolder, strName)
+
+
+def segmentChunkTask(args):
+    """Worker process entry point. Reads a chunk (OID range) of the stream branches, segments it at each
+    segment length, and writes the segments of each length to a new feature class in the worker geodatabase,
+    with Segment IDs numbered from 1 in the chunk.
+    :return: list of (output feature class, number of segments) for each length
+    """
+    fcBranches, intChunk, intFirstOID, intLastOID, listDistances, segMethod, outSegmentIDField, outScaleField = args
+    descBranches = arcpy.Describe(fcBranches)
+    spatialRef = descBranches.spatialReference
+    strWhereClause = "{0} >= {1} AND {0} <= {2}".format(descBranches.OIDFieldName, intFirstOID, intLastOID)
+    listBranches = readBranches(fcBranches, strWhereClause)
+    listOutputs = [createSegmentsFC(os.path.join(strWorkerGDB, "segments_{}_{}".format(intChunk, i)), spatialRef,
+                                    outSegmentIDField, outScaleField) for i in range(len(listDistances))]
+    listCounts = writeSegments(listBranches, listDistances, segMethod, listOutputs, spatialRef, outSegmentIDField,
+                               outScaleField)
+    return list(zip(listOutputs, listCounts))
+
+
+def offsetSegmentIDsTask(args):
+    """Worker process entry point. Adds the number of segments in the previous chunks to the Segment IDs of a
+    chunk output, so that the IDs continue from the previous chunk."""
+    fcSegments, outSegmentIDField, intOffset = args
+    with arcpy.da.UpdateCursor(fcSegments, [outSegmentIDField]) as ucSegments:
+        for row in ucSegments:
+            row[0] += intOffset
+            ucSegments.updateRow(row)
+    return fcSegments
+
+
+def chunkBranches(listWeights, intChunks):
+    """Splits a sequence of stream branches into contiguous chunks with about the same total weight (i.e.
+    branch length) each, so that segments keep the branch order when the chunk outputs are merged in chunk
+    order. Returns the (start, end) indexes of each chunk."""
+    arrayWeights = np.cumsum(listWeights)
+    arrayBreaks = np.searchsorted(arrayWeights, arrayWeights[-1] * np.arange(1, intChunks) / float(intChunks))
+    listBounds = [0] + sorted(set(int(i) + 1 for i in arrayBreaks)) + [len(listWeights)]
+    return [(i, j) for i, j in zip(listBounds[:-1], listBounds[1:]) if j > i]
+
+
 def segOptionBC(fcDissolvedStreamBranch,
          inputDistance,
          segMethod,
          fcTempStreamNetwork=r"in_memory\temp_network",
          outSegmentIDField="SegmentID",
-         scratchWorkspace=r"in_memory"):
+         scratchWorkspace=r"in_memory",
+         outScaleField=None,
+         intProcesses=1):
     """Segment the input stream network feature class using one of two methods:
 
     1. Remainder at the outflow of each stream reach
     2. Remainder is divided amongst each stream segment
+
+    inputDistance can be a list of segment lengths, in which case the stream branches are read once and
+    segmented at each length. Segment IDs are numbered from 1 for each length, and the length is stored
+    in outScaleField, if provided.
+
+    With intProcesses > 1, the stream branches are copied to a scratch file geodatabase and split into
+    chunks of consecutive branches. Each worker process reads, segments and writes its chunks to its own
+    file geodatabase, and the chunk outputs are appended in chunk order, with the Segment IDs offset in the
+    workers, so the output is the same as a single process run.
     """
+    listDistances = inputDistance if isinstance(inputDistance, (list, tuple)) else [inputDistance]
+    listDistances = [float(dblDistance) for dblDistance in listDistances]
 
     gis_tools.resetData(fcTempStreamNetwork)
-    listPoints = []
 
     if segMethod == "Remaining segment at outflow (bottom) of stream branch":
         arcpy.AddMessage("Segmenting using the remainder at stream branch outflow method...")
     else:
         arcpy.AddMessage("Segmenting using the segment remainder division method...")
 
-    with arcpy.da.SearchCursor(fcDissolvedStreamBranch,["SHAPE@","SHAPE@LENGTH"]) as scBranches:
-        for row in scBranches:
-            gLine = row[0]
-            dblPointPosition = 0
-            if segMethod == "Remaining segment at outflow (bottom) of stream branch":
-                while dblPointPosition < row[1]:
-                    listPoints.append(gLine.positionAlongLine(dblPointPosition))
-                    dblPointPosition += Decimal(inputDistance)
-            else:
-                intNumberOfPositions = int(Decimal(row[1])/Decimal(inputDistance))
-                for intPosition in range(intNumberOfPositions):
-                    
-                    dblProportionalPosition = float(intPosition)/intNumberOfPositions
-                    listPoints.append(gLine.positionAlongLine(dblProportionalPosition,True))
-
-    fcSplitPoints = gis_tools.newGISDataset(scratchWorkspace, "GNAT_SEG_SplitPoints")
-    arcpy.CreateFeatureclass_management(scratchWorkspace,"GNAT_SEG_SplitPoints","POINT",spatial_reference=fcDissolvedStreamBranch)
-
-    with arcpy.da.InsertCursor(fcSplitPoints,["SHAPE@"]) as icSplitPoints:
-        for point in listPoints:
-            icSplitPoints.insertRow([point])
-    arcpy.SplitLineAtPoint_management(fcDissolvedStreamBranch,fcSplitPoints,fcTempStreamNetwork,"1 Meters")
-    gis_tools.addUniqueIDField(fcTempStreamNetwork, outSegmentIDField)
-
-    # Remove unnecessary fields
-    fieldObjects = arcpy.ListFields(fcTempStreamNetwork)
-    oidField = arcpy.Describe(fcTempStreamNetwork).OIDFieldName
-    shapeField = arcpy.Describe(fcTempStreamNetwork).shapeFieldName
-    lengthField = arcpy.Describe(fcTempStreamNetwork).lengthFieldName
-    keepFields = [oidField, shapeField, lengthField, outSegmentIDField]
-    for field in fieldObjects:
-        if field.name not in keepFields:
-            arcpy.DeleteField_management(fcTempStreamNetwork, [field.name])
-
-    # Clean up
-    del fcSplitPoints
+    spatialRef = arcpy.Describe(fcDissolvedStreamBranch).spatialReference
+    createSegmentsFC(fcTempStreamNetwork, spatialRef, outSegmentIDField, outScaleField)
+
+    intProcesses = int(intProcesses or 1)
+    if intProcesses <= 1:
+        # Read the stream branches once, for all segment lengths, and cut each stream branch directly at the
+        # split measures, from upstream to downstream
+        listBranches = readBranches(fcDissolvedStreamBranch)
+        writeSegments(listBranches, listDistances, segMethod, [fcTempStreamNetwork] * len(listDistances),
+                      spatialRef, outSegmentIDField, outScaleField)
+        return fcTempStreamNetwork
+
+    # Worker processes cannot read in_memory datasets, so the stream branches are copied to a scratch file
+    # geodatabase that each worker reads its chunks from
+    strScratchFolder = tempfile.mkdtemp(prefix="GNAT_Segmentation_")
+    pool = None
+    try:
+        arcpy.CreateFileGDB_management(strScratchFolder, "branches.gdb")
+        fcBranches = os.path.join(strScratchFolder, "branches.gdb", "branches")
+        arcpy.CopyFeatures_management(fcDissolvedStreamBranch, fcBranches)
+        listOIDs = []
+        listLengths = []
+        with arcpy.da.SearchCursor(fcBranches, ["OID@", "SHAPE@LENGTH"]) as scBranches:
+            for intOID, dblLength in scBranches:
+                listOIDs.append(intOID)
+                listLengths.append(dblLength or 0.0)
+        if not listOIDs:
+            return fcTempStreamNetwork
+
+        # Several chunks per process, so that workers with short chunks pick up more work
+        listChunks = chunkBranches(listLengths, intProcesses * 4)
+        intProcesses = min(intProcesses, len(listChunks))
+        arcpy.AddMessage("Segmenting {} stream branches in {} chunks, with {} processes...".format(
+            len(listOIDs), len(listChunks), intProcesses))
+        # Inside ArcGIS, sys.executable is the application rather than python, so the worker processes are
+        # started with the python interpreter instead
+        if not os.path.basename(sys.executable).lower().startswith("python"):
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+        pool = multiprocessing.Pool(intProcesses, initSegmentWorker, (strScratchFolder,))
+        listTasks = [(fcBranches, intChunk, listOIDs[i], listOIDs[j - 1], listDistances, segMethod,
+                      outSegmentIDField, outScaleField) for intChunk, (i, j) in enumerate(listChunks)]
+        listResults = pool.map(segmentChunkTask, listTasks)
+
+        # Segment IDs continue from the previous chunk of the same segment length
+        listChunkFCs = []
+        listOffsetTasks = []
+        for i in range(len(listDistances)):
+            intOffset = 0
+            for listChunkResult in listResults:
+                fcChunk, intCount = listChunkResult[i]
+                listChunkFCs.append(fcChunk)
+                if intOffset > 0 and intCount > 0:
+                    listOffsetTasks.append((fcChunk, outSegmentIDField, intOffset))
+                intOffset += intCount
+        pool.map(offsetSegmentIDsTask, listOffsetTasks)
+        pool.close()
+        pool.join()
+        pool = None
+
+        # All chunks of the first segment length, then the next length
+        arcpy.Append_management(listChunkFCs, fcTempStreamNetwork, "NO_TEST")
+    finally:
+        if pool is not None:
+            # on error, the queued tasks are discarded rather than waited for
+            pool.terminate()
+            pool.join()
+        arcpy.ClearWorkspaceCache_management()
+        shutil.rmtree(strScratchFolder, ignore_errors=True)
 
     return fcTempStreamNetwork
 
 
 # # Main Function # #
-def main(inputFCStreamNetwork, inputDistance, strmIndex, segMethod, boolNode, boolMerge, outputFCSegments):
-    """Segment a stream network into user-defined length intervals."""
+def main(inputFCStreamNetwork, inputDistance, strmIndex, segMethod, boolNode, boolMerge, outputFCSegments,
+         intProcesses=1):
+    """Segment a stream network into user-defined length intervals.
+
+    inputDistance can be a single segment length or several (a list, or a semicolon delimited string).
+    The network is dissolved and split at nodes once, then segmented at each length. With several
+    lengths, all segments are written to the one output, with the segment length in the SegLength field.
+
+    intProcesses > 1 segments the dissolved stream branches in parallel worker processes (remainder at
+    outflow and divided remainder methods only).
+    """
 
     # Get output workspace from output feature class
     out_wspace = os.path.dirname(outputFCSegments)
 
+    listDistances = segmentLengths(inputDistance)
+    strScaleField = "SegLength" if len(listDistances) > 1 else None
+
     # process terminates if input requirements not met
     gis_tools.checkReq(inputFCStreamNetwork)
 
@@ -234,10 +428,23 @@ def main(inputFCStreamNetwork, inputDistance, strmIndex, segMethod, boolNode, bo
 
     # Segment using method with remainder at inflow of each stream reach (i.e. Jesse's method)
     if segMethod == "Remaining segment at inflow (top) of stream branch":
-        strm_seg = segOptionA(strm_split_node, inputDistance, out_wspace)
+        listSegments = []
+        for i, dblDistance in enumerate(listDistances):
+            fcSegments = r"in_memory\strm_seg_{}".format(i)
+            arcpy.CopyFeatures_management(segOptionA(strm_split_node, dblDistance, out_wspace), fcSegments)
+            if strScaleField:
+                arcpy.AddField_management(fcSegments, strScaleField, "DOUBLE")
+                arcpy.CalculateField_management(fcSegments, strScaleField, dblDistance, "PYTHON")
+            listSegments.append(fcSegments)
+        if len(listSegments) > 1:
+            strm_seg = r"in_memory\strm_seg"
+            arcpy.Merge_management(listSegments, strm_seg)
+        else:
+            strm_seg = listSegments[0]
     # Segment using method with remainder at outflow, or divided remainder (i.e. Kelly's method)
     else:
-        strm_seg = segOptionBC(strm_split_node, inputDistance, segMethod)
+        strm_seg = segOptionBC(strm_split_node, listDistances, segMethod, outScaleField=strScaleField,
+                               intProcesses=intProcesses)
 
     if boolMerge == 'true':
         arcpy.AddMessage("Merging attributes and geometry from " + inputFCStreamNetwork + " with segmented stream network...")
@@ -45,11 +45,8 @@ def main(inputFCPolylineNetwork,
     arcpy.Dissolve_management(inputFCPolylineNetwork, fcNetworkDissolved, multi_part="SINGLE_PART",
                              unsplit_lines="DISSOLVE_LINES")
     
-    fcNetworkIntersectPoints = gis_tools.newGISDataset(scratchWorkspace, "GNAT_SO_NetworkIntersectPoints")
-    arcpy.Intersect_analysis(fcNetworkDissolved, fcNetworkIntersectPoints, "ALL", output_type="POINT")
-    arcpy.AddXY_management(fcNetworkIntersectPoints)
     fcNetworkNodes = gis_tools.newGISDataset(scratchWorkspace, "GNAT_SO_NetworkNodes")
-    arcpy.Dissolve_management(fcNetworkIntersectPoints,fcNetworkNodes, ["POINT_X", "POINT_Y"], "#", "SINGLE_PART")
+    gis_tools.network_nodes(inputFCPolylineNetwork, fcNetworkNodes)
 
     listFields = arcpy.ListFields(fcNetworkDissolved,"strm_order")
     if len(listFields) == 0: